@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+
+"""
+Make-like runner for the steps from the GWAS summary statistics to the results of
+the fisher exact tests.
+
+The stages of the pipeline are declared in a yaml file with their command, inputs
+and outputs. A stage depends on the stages producing its inputs. A stage is only run
+when it is stale: an output is missing or the content of an input, an output or the
+command changed since the last successful run (content hashes are stored in a state
+file). Independent stages are run at the same time, within a budget of cores.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import yaml
+
+
+__version__ = "v0.1"
+
+
+@dataclass
+class Stage:
+    """
+    A stage of the pipeline.
+
+    :attributes
+    -----------
+    name - str
+        Name of the stage
+    command - str
+        Shell command, {cores} is replaced by the number of cores of the stage. Stages
+        without a command are manual steps (e.g. running the NetWAS web service), only
+        their outputs are checked
+    inputs - List[Path]
+        Files and directories used by the stage
+    outputs - List[Path]
+        Files and directories created by the stage
+    cores - int
+        Number of cores used by the stage
+    cwd - Path
+        Working directory of the command
+    after - List[str]
+        Stages that need to run first, besides the stages producing the inputs
+    """
+
+    name: str
+    command: Optional[str]
+    inputs: List[Path] = field(default_factory=list)
+    outputs: List[Path] = field(default_factory=list)
+    cores: int = 1
+    cwd: Optional[Path] = None
+    after: List[str] = field(default_factory=list)
+
+
+class FileHasher:
+    """
+    Calculates the content hashes of files and directories. The hash of a file is
+    reused as long as its size and modification time do not change.
+    """
+
+    def __init__(self, known: Optional[dict] = None) -> None:
+        self.known = dict(known or {})
+
+    def hash_path(self, path: Path) -> Optional[str]:
+        """
+        Calculate the hash of a file or directory (all files inside it).
+
+        :parameters
+        -----------
+        path - Path
+            File or directory
+
+        :returns
+        --------
+        hash - str or None
+            sha256 hex digest, None if the path does not exist
+        """
+        if path.is_dir():
+            digest = hashlib.sha256()
+            for file in sorted(path.rglob("*")):
+                if file.is_file():
+                    digest.update(str(file.relative_to(path)).encode("utf-8"))
+                    digest.update(self.hash_file(file).encode("utf-8"))
+            return digest.hexdigest()
+        if not path.is_file():
+            return None
+        return self.hash_file(path)
+
+    def hash_file(self, file: Path) -> str:
+        """
+        Calculate the hash of a file, or reuse it if the file did not change.
+        """
+        stat = file.stat()
+        known = self.known.get(str(file))
+        if known is not None and known["size"] == stat.st_size \
+                and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        digest = hashlib.sha256()
+        with open(file, 'rb') as stream:
+            for block in iter(lambda: stream.read(1024 ** 2), b""):
+                digest.update(block)
+        self.known[str(file)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                 "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Stages of the pipeline with their dependencies and the state of the last runs.
+    """
+
+    def __init__(self, stages: List[Stage], state_file: Path) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = Path(state_file)
+        self.state = self.read_state()
+        self.hasher = FileHasher(self.state.get("files"))
+        self.dependencies = self.get_dependencies()
+
+    @classmethod
+    def from_config(cls, file: Path) -> "Pipeline":
+        """
+        Read the stages from a yaml file. Relative paths are relative to the
+        directory of the file.
+
+        :parameters
+        -----------
+        file - Path
+            Pipeline file
+
+        :returns
+        --------
+        pipeline - Pipeline
+            The pipeline
+        """
+        file = Path(file)
+        with open(file, 'r', encoding="utf-8") as stream:
+            config = yaml.safe_load(stream)
+        root = file.resolve().parent
+
+        def resolve(path):
+            return (root / os.path.expanduser(path)).resolve()
+
+        stages = []
+        for name, spec in config["stages"].items():
+            stages.append(Stage(name=name, command=spec.get("command"),
+                                inputs=[resolve(path) for path in spec.get("inputs", [])],
+                                outputs=[resolve(path) for path in spec.get("outputs", [])],
+                                cores=spec.get("cores", 1),
+                                cwd=resolve(spec.get("cwd", ".")),
+                                after=list(spec.get("after", []))))
+        state_file = resolve(config.get("state", ".pipeline_state.json"))
+        return cls(stages, state_file)
+
+    def get_dependencies(self) -> Dict[str, set]:
+        """
+        Get the stages every stage depends on: the stages producing its inputs
+        (or a directory containing them) and the stages in its after list.
+
+        :returns
+        --------
+        dependencies - Dict[str, set]
+            Name of the stage -> names of the stages it depends on
+        """
+        producers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"{output} is created by both {producers[output]} "
+                                     f"and {stage.name}")
+                producers[output] = stage.name
+
+        dependencies = {}
+        for stage in self.stages.values():
+            depends = set(stage.after)
+            for path in stage.inputs:
+                for output, producer in producers.items():
+                    if path == output or output in path.parents or path in output.parents:
+                        depends.add(producer)
+            depends.discard(stage.name)
+            unknown = depends - set(self.stages)
+            if unknown:
+                raise ValueError(f"Unknown stages in {stage.name}: {sorted(unknown)}")
+            dependencies[stage.name] = depends
+        self.check_cycles(dependencies)
+        return dependencies
+
+    @staticmethod
+    def check_cycles(dependencies: Dict[str, set]) -> None:
+        """
+        Check that the stages do not depend on themselves.
+        """
+        done, visiting = set(), set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError("Cyclic dependency: " + " -> ".join(path + [name]))
+            visiting.add(name)
+            for dependency in sorted(dependencies[name]):
+                visit(dependency, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in sorted(dependencies):
+            visit(name, [])
+
+    def get_upstream(self, targets: List[str]) -> set:
+        """
+        Get the targets and all stages they depend on.
+        """
+        selected = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage: {name}")
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.dependencies[name])
+        return selected
+
+    def read_state(self) -> dict:
+        """
+        Read the state of the last runs.
+
+        :returns
+        --------
+        state - dict
+            stages: the hashes of every successfully run stage, files: the known
+            file hashes
+        """
+        try:
+            with open(self.state_file, 'r', encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return {"stages": {}, "files": {}}
+
+    def write_state(self) -> None:
+        """
+        Atomically write the state of the runs.
+        """
+        self.state["files"] = self.hasher.known
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_name(f"{self.state_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding="utf-8") as stream:
+            json.dump(self.state, stream, indent=1)
+        os.replace(tmp_file, self.state_file)
+
+    def get_fingerprint(self, stage: Stage) -> dict:
+        """
+        Get the command and the content hashes of the inputs of a stage.
+        """
+        return {"command": stage.command,
+                "inputs": {str(path): self.hasher.hash_path(path) for path in stage.inputs}}
+
+    def get_outputs(self, stage: Stage) -> dict:
+        """
+        Get the content hashes of the outputs of a stage.
+        """
+        return {str(path): self.hasher.hash_path(path) for path in stage.outputs}
+
+    def is_stale(self, stage: Stage) -> Optional[str]:
+        """
+        Check if a stage needs to run.
+
+        :parameters
+        -----------
+        stage - Stage
+            A stage
+
+        :returns
+        --------
+        reason - str or None
+            Why the stage needs to run, None if it is up to date
+        """
+        outputs = self.get_outputs(stage)
+        missing = [path for path, digest in outputs.items() if digest is None]
+        if missing:
+            return f"missing output {missing[0]}"
+        previous = self.state["stages"].get(stage.name)
+        if previous is None:
+            return "never run"
+        fingerprint = self.get_fingerprint(stage)
+        if previous["command"] != fingerprint["command"]:
+            return "command changed"
+        for path, digest in fingerprint["inputs"].items():
+            if previous["inputs"].get(path) != digest:
+                return f"input changed {path}"
+        for path, digest in outputs.items():
+            if previous["outputs"].get(path) != digest:
+                return f"output changed {path}"
+        return None
+
+    def record(self, stage: Stage) -> None:
+        """
+        Store the hashes of a stage after it ran successfully.
+        """
+        state = self.get_fingerprint(stage)
+        state["outputs"] = self.get_outputs(stage)
+        self.state["stages"][stage.name] = state
+        self.write_state()
+
+    def run(self, targets: Optional[List[str]] = None, cores: Optional[int] = None,
+            force: Optional[List[str]] = None, dry_run: bool = False,
+            keep_going: bool = False) -> bool:
+        """
+        Run the stale stages. A stage is started when all stages it depends on are
+        finished and enough cores are free. Whether a stage is stale is decided when
+        it can start, so a stage whose inputs did not change after its upstream
+        stages ran is skipped.
+
+        :parameters
+        -----------
+        targets - List[str]
+            Stages to bring up to date (with their upstream stages), None for all stages
+        cores - int
+            Maximum number of cores used at the same time, default = all cores
+        force - List[str]
+            Stages that are run even if they are up to date
+        dry_run - bool
+            Only print the stages that would run, assuming their upstream stages
+            change their outputs
+        keep_going - bool
+            Keep running the stages that do not depend on a failed stage
+
+        :returns
+        --------
+        success - bool
+            False if a stage failed
+        """
+        cores = cores or os.cpu_count()
+        selected = self.get_upstream(targets) if targets else set(self.stages)
+        force = set(force or [])
+        pending = {name: self.dependencies[name] & selected for name in selected}
+        finished, rerun, failed = set(), set(), set()
+        running = {}
+        used = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, len(selected))) as executor:
+            while pending or running:
+                ready = sorted(name for name, depends in pending.items()
+                               if depends <= finished and (keep_going or not failed))
+                for name in ready:
+                    stage = self.stages[name]
+                    reason = "forced" if name in force else self.is_stale(stage)
+                    if dry_run and reason is None and pending[name] & rerun:
+                        reason = "upstream stage runs"
+                    if reason is None:
+                        print(f"[{name}] up to date")
+                        finished.add(name)
+                        del pending[name]
+                        continue
+
+                    stage_cores = min(stage.cores, cores)
+                    if used + stage_cores > cores:
+                        continue
+                    del pending[name]
+                    rerun.add(name)
+                    if dry_run:
+                        print(f"[{name}] would run ({reason}): {stage.command or 'manual step'}")
+                        finished.add(name)
+                        continue
+                    print(f"[{name}] running ({reason}), {stage_cores} cores")
+                    used += stage_cores
+                    running[executor.submit(self.run_stage, stage, stage_cores)] = \
+                        (name, stage_cores)
+
+                if failed and not running and not keep_going:
+                    break
+                if not running:
+                    if pending and not any(depends <= finished for depends in pending.values()):
+                        break
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, stage_cores = running.pop(future)
+                    used -= stage_cores
+                    stage = self.stages[name]
+                    if future.result():
+                        self.record(stage)
+                        finished.add(name)
+                    else:
+                        failed.add(name)
+
+        for name in sorted(pending):
+            print(f"[{name}] not run")
+        return not failed
+
+    @staticmethod
+    def run_stage(stage: Stage, cores: int) -> bool:
+        """
+        Run the command of a stage.
+
+        :parameters
+        -----------
+        stage - Stage
+            A stage
+        cores - int
+            Number of cores given to the stage
+
+        :returns
+        --------
+        success - bool
+            True if the command succeeded and created all outputs
+        """
+        start = time.perf_counter()
+        if stage.command is not None:
+            env = dict(os.environ, PIPELINE_CORES=str(cores))
+            result = subprocess.run(stage.command.format(cores=cores), shell=True,
+                                    cwd=stage.cwd, env=env, check=False)
+            if result.returncode != 0:
+                print(f"[{stage.name}] failed with exit code {result.returncode}")
+                return False
+        missing = [str(path) for path in stage.outputs if not path.exists()]
+        if missing:
+            print(f"[{stage.name}] did not create: {', '.join(missing)}")
+            return False
+        print(f"[{stage.name}] finished in {time.perf_counter() - start:.1f} s")
+        return True
+
+
+class ArgumentParser:
+    """
+    Class to parse the input arguments.
+    """
+
+    def __init__(self) -> None:
+        self.parser = self._create_argument_parser()
+        self.arguments = self.parser.parse_args()
+
+    @staticmethod
+    def _create_argument_parser():
+        """
+        Create an argument parser.
+
+        :returns
+        --------
+        parser - ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog=f"python {os.path.basename(__file__)}",
+            description="Run the stages of the pipeline that are out of date.",
+            epilog="Contact: stijnarend@live.nl")
+
+        # Set version
+        parser.version = __version__
+
+        parser.add_argument('targets', nargs='*',
+            help='Stages to bring up to date, default = all stages')
+
+        parser.add_argument('-c',
+            '--config', dest="config", default="pipeline.yaml",
+            help='Pipeline file declaring the stages, default = pipeline.yaml')
+
+        parser.add_argument('-j',
+            '--cores', dest="cores", type=int, default=None,
+            help='Maximum number of cores used at the same time, default = all cores')
+
+        parser.add_argument('--force', dest="force", nargs='+', default=None,
+            help='Run these stages even if they are up to date')
+
+        parser.add_argument('-k',
+            '--keep-going', dest="keep_going", action="store_true",
+            help='Keep running the stages that do not depend on a failed stage')
+
+        parser.add_argument('-n',
+            '--dry-run', dest="dry_run", action="store_true",
+            help='Only show the stages that would run')
+
+        parser.add_argument('-v',
+            '--version',
+            help='Displays the version number of the script and exitst',
+            action='version')
+
+        return parser
+
+    def get_argument(self, argument_key: str) -> Any:
+        """
+        Method to get an input argument.
+        :parameters
+        -----------
+        argument_key - str
+            Full command line argument (so --config for the configuration file argument).
+
+        :returns
+        --------
+        value - List or boolean
+        """
+        if self.arguments is not None and argument_key in self.arguments:
+            value = getattr(self.arguments, argument_key)
+        else:
+            value = None
+        return value
+
+
+def main():
+    """
+    Run the main program.
+    """
+    arg_parser = ArgumentParser()
+    config = Path(arg_parser.get_argument("config"))
+    if not config.is_file():
+        raise FileNotFoundError(f"Pipeline file does not exist: {config}")
+
+    pipeline = Pipeline.from_config(config)
+    success = pipeline.run(targets=arg_parser.get_argument("targets"),
+                           cores=arg_parser.get_argument("cores"),
+                           force=arg_parser.get_argument("force"),
+                           dry_run=arg_parser.get_argument("dry_run"),
+                           keep_going=arg_parser.get_argument("keep_going"))
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,28 +2,380 @@
 This module prepares files for PLINK and DEPICT.
 """
 
-import gzip
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from operator import itemgetter
 from pathlib import Path
 import yaml
+import numpy as np
 import pandas as pd
 
 
-def prep_plink(file) -> None:
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir,
+                  os.pardir,
+                  "results"))
+
+sys.path.insert(0, root_dir)
+
+from utils.compressed_io import open_file, open_output, read_blocks
+
+
+# Columns of the harmonized summary statistics that are used by PLINK and their new names
+PLINK_COLUMNS = {"chromosome":"CHR", "base_pair_location":"POS", "variant_id":"SNP", "beta":"BETA", "standard_error":"SE", "p_value":"P"}
+
+# Seed of the random sample of the height SNPs, so every run uses the same SNPs
+DOWNSAMPLE_SEED = 42
+
+
+def get_plink_output_file(file, compression=None) -> str:
+    """
+    Get the name of the PLINK file that is created for a summary statistics file.
+    """
+    output_file = file.split(".", 1)[0] + "_prepped.txt"
+    if compression is not None:
+        output_file += ".gz"
+    return output_file
+
+
+def parse_plink_header(header):
+    """
+    Find the PLINK columns in the header of a summary statistics file.
+
+    :parameters
+    -----------
+    header - bytes
+        First line of the file
+
+    :returns
+    --------
+    delimiter - bytes
+        Tab if the file is tab seperated, otherwise None (any whitespace)
+    positions - list
+        Positions of the PLINK columns, in the order of the file
+    new_header - bytes
+        Tab seperated header with the PLINK column names
+    """
+    delimiter = b"\t" if b"\t" in header else None
+    names = header.rstrip(b"\r\n").split(delimiter)
+    names = [name.decode("utf-8") for name in names]
+    missing = set(PLINK_COLUMNS) - set(names)
+    if missing:
+        raise ValueError(f"Columns not found: {sorted(missing)}")
+    positions = sorted(names.index(name) for name in PLINK_COLUMNS)
+    new_header = "\t".join(PLINK_COLUMNS[names[position]] for position in positions) + "\n"
+    return delimiter, positions, new_header.encode("utf-8")
+
+
+def convert_lines(lines, delimiter, positions, file=None, first_line=2) -> bytes:
+    """
+    Select the PLINK columns of a list of lines and join them with tabs. Tab
+    seperated files are split on every tab, so empty values are kept, other files
+    on any whitespace. Empty lines are skipped.
+
+    :parameters
+    -----------
+    lines - list
+        Lines of the summary statistics file without the header
+    delimiter - bytes
+        Tab or None, see parse_plink_header
+    positions - list
+        Positions of the PLINK columns
+    file - str
+        Name of the summary statistics file, used in error messages
+    first_line - int
+        Line number of the first line inside the file, used in error messages
+
+    :returns
+    --------
+    block - bytes
+        Tab seperated lines of the selected columns
+    """
+    select = itemgetter(*positions)
+    try:
+        if delimiter is None:
+            return b"".join([b"\t".join(select(line.split())) + b"\n"
+                             for line in lines if not line.isspace()])
+        return b"".join([b"\t".join(select(line.rstrip(b"\r\n").split(delimiter))) + b"\n"
+                         for line in lines if not line.isspace()])
+    except IndexError:
+        # Only search for the short line when the conversion fails
+        n_fields = max(positions) + 1
+        for number, line in enumerate(lines, first_line):
+            fields = line.split() if delimiter is None else line.rstrip(b"\r\n").split(delimiter)
+            if not line.isspace() and len(fields) < n_fields:
+                raise ValueError(f"{file}, line {number}: expected at least {n_fields} "
+                                 f"fields but found {len(fields)}") from None
+        raise
+
+
+def prep_plink(file, compression=None, n_threads=2, block_size=1024 ** 2) -> None:
     """
     Function to prepare IBD (Inflammatory bowel disease) and PC (Prostate cancer) files
-    Only loads in the usefull columns
+    Only keeps the usefull columns
     renames all columns so Plink will recognize them
+
+    The file is streamed in blocks of lines, so the memory usage does not depend on
+    the size of the file. Values are copied as they appear in the input file. The
+    output is optionally gzip or bgzip compressed by background threads.
     """
-    col_list = ["chromosome", "base_pair_location", "variant_id", "beta", "standard_error", "p_value"]
-    if file.rsplit(".", 1)[1] == "gz":
-        with gzip.open(file, "rb") as f:
-            data = pd.read_csv(f, sep="\s+", usecols=col_list)
-    else:
-        data = pd.read_csv(file, sep="\s+", usecols=col_list)
-    
-    data = data.rename(columns={"chromosome":"CHR", "base_pair_location":"POS", "variant_id":"SNP", "beta":"BETA", "standard_error":"SE", "p_value":"P"})
-    file = file.split(".", 1)[0]
-    data.to_csv(file + "_prepped.txt", sep="\t", index=False)
+    with open_file(file) as stream, \
+            open_output(get_plink_output_file(file, compression), compression, n_threads) as output:
+        delimiter, positions, header = parse_plink_header(stream.readline())
+        output.write(header)
+        line_number = 2
+        while True:
+            lines = stream.readlines(block_size)
+            if not lines:
+                break
+            output.write(convert_lines(lines, delimiter, positions, file, line_number))
+            line_number += len(lines)
+
+
+def convert_block(block, delimiter, positions, file=None, first_line=2) -> bytes:
+    """
+    Select the PLINK columns of a block of lines. Runs inside a worker process of
+    prep_plink_parallel.
+
+    :parameters
+    -----------
+    block - bytes
+        Lines of the summary statistics file without the header
+    delimiter - bytes
+        Tab or None, see parse_plink_header
+    positions - list
+        Positions of the PLINK columns
+    file - str
+        Name of the summary statistics file, used in error messages
+    first_line - int
+        Line number of the first line of the block inside the file
+
+    :returns
+    --------
+    block - bytes
+        Tab seperated lines of the selected columns
+    """
+    return convert_lines(block.splitlines(keepends=True), delimiter, positions, file, first_line)
+
+
+def prep_plink_parallel(file, n_workers=None, block_size=64 * 1024 ** 2,
+                        compression=None, n_threads=2) -> None:
+    """
+    Same as prep_plink, but the file is divided into blocks of lines that are
+    converted by a pool of worker processes and written in the order of the file.
+    At most two blocks per worker are kept in memory.
+    """
+    n_workers = n_workers if n_workers is not None else os.cpu_count()
+
+    with open_file(file) as stream, \
+            open_output(get_plink_output_file(file, compression), compression, n_threads) as output, \
+            ProcessPoolExecutor(max_workers=n_workers) as executor:
+        delimiter, positions, header = parse_plink_header(stream.readline())
+        output.write(header)
+
+        pending = deque()
+        line_number = 2
+        for block in read_blocks(stream, block_size):
+            pending.append(executor.submit(convert_block, block, delimiter, positions,
+                                           file, line_number))
+            line_number += block.count(b"\n")
+            if len(pending) >= 2 * n_workers:
+                output.write(pending.popleft().result())
+        for future in pending:
+            output.write(future.result())
+
+
+class BedFile:
+    """
+    Memory-mapped PLINK 1 binary genotype file (.bed with its .bim and .fam file),
+    used as LD reference panel by clump. Only the genotypes of the SNPs that are
+    requested are read from disk.
+    """
+
+    # Dosage of every 2 bit genotype code (00 = 2, 01 = missing, 10 = 1, 11 = 0)
+    # for the four samples stored in every byte
+    _dosages = np.array([2.0, np.nan, 1.0, 0.0])[
+        (np.arange(256)[:, None] >> np.array([0, 2, 4, 6])) & 3]
+
+    def __init__(self, prefix) -> None:
+        bim = pd.read_csv(prefix + ".bim", sep=r"\s+", header=None, usecols=[1], dtype=str)
+        self.snps = pd.Index(bim[1])
+        with open(prefix + ".fam", "rb") as stream:
+            self.n_samples = sum(1 for line in stream if line.strip())
+
+        with open(prefix + ".bed", "rb") as stream:
+            if stream.read(3) != b"\x6c\x1b\x01":
+                raise ValueError(f"{prefix}.bed is not a SNP-major PLINK .bed file")
+        self.matrix = np.memmap(prefix + ".bed", dtype=np.uint8, mode="r", offset=3,
+                                shape=(len(self.snps), (self.n_samples + 3) // 4))
+
+    def genotypes(self, rows) -> np.ndarray:
+        """
+        Get the dosages of SNPs, missing genotypes are NaN.
+
+        :parameters
+        -----------
+        rows - np.ndarray
+            Positions of the SNPs in the .bim file
+
+        :returns
+        --------
+        genotypes - np.ndarray
+            Array of shape (len(rows), n_samples)
+        """
+        rows = np.asarray(rows)
+        return self._dosages[self.matrix[rows]].reshape(rows.shape[0], -1)[:, :self.n_samples]
+
+    def r_squared(self, row, rows) -> np.ndarray:
+        """
+        Calculate the squared correlation between the genotypes of a SNP and other
+        SNPs. Missing genotypes are replaced by the mean dosage of the SNP.
+
+        :parameters
+        -----------
+        row - int
+            Position of the SNP in the .bim file
+        rows - np.ndarray
+            Positions of the other SNPs in the .bim file
+
+        :returns
+        --------
+        r_squared - np.ndarray
+            r2 between the SNP and every other SNP, 0 for monomorphic SNPs
+        """
+        genotypes = self.genotypes(np.concatenate([[row], rows]))
+        means = np.nanmean(genotypes, axis=1, keepdims=True)
+        genotypes = np.where(np.isnan(genotypes), means, genotypes) - means
+        squares = (genotypes ** 2).sum(axis=1)
+        covariances = genotypes[1:] @ genotypes[0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_squared = covariances ** 2 / (squares[1:] * squares[0])
+        return np.nan_to_num(r_squared)
+
+
+def clump_chromosome(positions, p_values, p1, window, bed=None, rows=None, r2=0.5):
+    """
+    Select the lead SNPs of a single chromosome. Starting with the most significant
+    SNP, every SNP with a p value below p1 that is not clumped yet becomes a lead SNP
+    and clumps all unclumped SNPs within window base pairs (and, with a reference
+    panel, with an r2 of at least r2).
+
+    :parameters
+    -----------
+    positions - np.ndarray
+        Base pair positions of the SNPs
+    p_values - np.ndarray
+        P values of the SNPs
+    p1 - float
+        Significance threshold of lead SNPs
+    window - int
+        Maximum distance in base pairs between a lead SNP and the SNPs it clumps
+    bed - BedFile
+        LD reference panel or None for distance based clumping
+    rows - np.ndarray
+        Positions of the SNPs in the reference panel
+    r2 - float
+        Minimum r2 between a lead SNP and the SNPs it clumps
+
+    :returns
+    --------
+    leads - list
+        Indices of the lead SNPs, from most to least significant
+    sizes - list
+        Number of SNPs clumped by every lead SNP
+    """
+    order = np.argsort(positions, kind="stable")
+    sorted_positions = positions[order]
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(order.shape[0])
+    clumped = np.zeros(order.shape[0], dtype=bool)
+
+    leads = []
+    sizes = []
+    for index in np.argsort(p_values, kind="stable"):
+        if p_values[index] > p1:
+            break
+        if clumped[ranks[index]]:
+            continue
+        start = np.searchsorted(sorted_positions, positions[index] - window, side="left")
+        end = np.searchsorted(sorted_positions, positions[index] + window, side="right")
+        neighbours = np.arange(start, end)
+        neighbours = neighbours[~clumped[neighbours] & (neighbours != ranks[index])]
+        if bed is not None and neighbours.shape[0] > 0:
+            r_squared = bed.r_squared(rows[index], rows[order[neighbours]])
+            neighbours = neighbours[r_squared >= r2]
+        clumped[neighbours] = True
+        clumped[ranks[index]] = True
+        leads.append(index)
+        sizes.append(neighbours.shape[0])
+    return leads, sizes
+
+
+def clump(file, p1=1e-4, p2=1e-2, kb=250, r2=0.5, bfile=None, max_loci=None) -> str:
+    """
+    Select independent lead SNPs from a PLINK file created by prep_plink, similar to
+    PLINK --clump, and save them to <name>.clumped so they can be used by
+    prep_for_depict. Without a reference panel (bfile) all SNPs within kb kilo base
+    pairs of a lead SNP are clumped, with a reference panel only those with an r2 of
+    at least r2. SNPs that are not in the reference panel are ignored.
+
+    :parameters
+    -----------
+    file - str
+        PLINK file created by prep_plink
+    p1 - float
+        Significance threshold of lead SNPs
+    p2 - float
+        Significance threshold of clumped SNPs
+    kb - float
+        Clumping window in kilo base pairs
+    r2 - float
+        r2 threshold, only used with a reference panel. Default = 0.5, like PLINK
+    bfile - str
+        Prefix of a PLINK .bed/.bim/.fam reference panel or None
+    max_loci - int
+        Keep only the max_loci most significant lead SNPs, None to keep all
+
+    :returns
+    --------
+    new_file - str
+        Location of the clumped file
+    """
+    data = pd.read_csv(file, sep="\t", usecols=["CHR", "SNP", "POS", "P"],
+                       dtype={"CHR": str, "SNP": str})
+    data = data.dropna(subset=["POS", "P"])
+    data = data[data["P"] <= p2]
+
+    bed = None
+    if bfile is not None:
+        bed = BedFile(bfile)
+        data = data.assign(row=bed.snps.get_indexer(data["SNP"]))
+        missing = (data["row"] < 0).sum()
+        if missing > 0:
+            print(f"{missing} SNPs are not in the reference panel and are ignored")
+        data = data[data["row"] >= 0]
+
+    results = []
+    for _, group in data.groupby("CHR", sort=False):
+        rows = group["row"].values if bed is not None else None
+        leads, sizes = clump_chromosome(group["POS"].values, group["P"].values, p1,
+                                        kb * 1000, bed, rows, r2)
+        results.append(group.iloc[leads, :].assign(TOTAL=sizes))
+
+    columns = ["CHR", "SNP", "POS", "P", "TOTAL"]
+    clumps = pd.concat(results) if results else pd.DataFrame(columns=columns)
+    clumps = clumps.sort_values("P", kind="mergesort")
+    if max_loci is not None:
+        clumps = clumps.head(max_loci)
+    clumps = clumps.loc[:, columns].rename(columns={"POS": "BP"})
+
+    new_file = file.split(".", 1)[0] + ".clumped"
+    clumps.to_csv(new_file, sep="\t", index=False)
+    return new_file
 
 
 def prep_for_depict(file) -> str:
@@ -31,7 +383,7 @@ def prep_for_depict(file) -> str:
     Removes all columns except SNP. this is needed for Depict
     run for IBD, PC, and Height file
     """
-    data = pd.read_csv(file, sep="\s+")
+    data = pd.read_csv(file, sep=r"\s+")
     data = data["SNP"]
     file = file.split(".", 1)[0]
     new_file = file + "_prepped4depict.txt"
@@ -39,18 +391,80 @@ def prep_for_depict(file) -> str:
     return new_file
 
 
-def downsample_file(file) -> None:
+def reservoir_sample(lines, n, rngs) -> list:
+    """
+    Draw uniform random samples of n lines from an iterable in a single pass
+    (reservoir sampling). Every random number generator produces an independent
+    sample, so any number of replicates only requires a single pass.
+
+    :parameters
+    -----------
+    lines - iterable
+        Lines to sample from
+    n - int
+        Number of lines per sample
+    rngs - list
+        A np.random.Generator per replicate
+
+    :returns
+    --------
+    samples - list
+        A list of sampled lines per replicate, in the order of the input
+    """
+    reservoirs = [[] for _ in rngs]
+    block_size = 65536
+    index = 0
+    iterator = iter(lines)
+    while True:
+        block = list(islice(iterator, block_size))
+        if not block:
+            break
+        positions = np.arange(index, index + len(block))
+        for reservoir, rng in zip(reservoirs, rngs):
+            # Fill the reservoir with the first n lines
+            fill = positions < n
+            reservoir.extend(zip(positions[fill], (block[i] for i in np.flatnonzero(fill))))
+            # Line i replaces a random line of the reservoir with probability n / (i + 1)
+            rest = np.flatnonzero(~fill)
+            slots = rng.integers(0, positions[rest] + 1) if rest.shape[0] else rest
+            for i, slot in zip(rest[slots < n], slots[slots < n]):
+                reservoir[slot] = (positions[i], block[i])
+        index += len(block)
+    return [[line for _, line in sorted(reservoir)] for reservoir in reservoirs]
+
+
+def downsample_file(file, n=200, seed=DOWNSAMPLE_SEED, replicates=1) -> list:
     """
     The Height SNP file is too large for Depict.
     Therefor it was found it could not have more than 200 SNP's
-    Takes 200 random SNP's from Height file to use in Depict and saves this to Height_200.txt
+    Takes n random SNP's from Height file to use in Depict and saves this to Height_<n>.txt
+
+    The file is read once, with reservoir sampling, and the sample only depends on
+    the seed. With multiple replicates, independent samples are saved to
+    Height_<n>_<replicate>.txt.
+
+    :returns
+    --------
+    files - list
+        Locations of the samples
     """
-    data = pd.read_csv(file, sep="\t")
-    data = data.sample(n=200, axis=0)
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    with open(file, "r", encoding="utf-8") as stream:
+        samples = reservoir_sample(stream, n, [np.random.default_rng(s) for s in seeds])
+
     path = file.rsplit("/", 1)[0]
     if path == file:
-        path = ""
-    data.to_csv(path + "/Height_200.txt", sep="\t", index=False, header=False)
+        path = "."
+    files = []
+    for replicate, sample in enumerate(samples):
+        if replicates == 1:
+            new_file = f"{path}/Height_{n}.txt"
+        else:
+            new_file = f"{path}/Height_{n}_{replicate}.txt"
+        with open(new_file, "w", encoding="utf-8") as output:
+            output.writelines(sample)
+        files.append(new_file)
+    return files
 
 
 def get_config(file: Path) -> dict:
@@ -76,17 +490,40 @@ def get_config(file: Path) -> dict:
     return config
 
 def main():
-    config = get_config("config.yaml")
-    for _, file in config["plink"]:
-        prep_plink(file)
+    config = get_config(Path("config.yaml"))
+    compression = config.get("compression")
+    files = list(config["plink"].values())
+    # Number of processes, given by the pipeline runner (see pipeline/README.md) or the
+    # workers key of the config file, by default one process per file
+    n_workers = int(os.environ.get("PIPELINE_CORES", config.get("workers", len(files))))
+    n_workers = max(1, min(n_workers, os.cpu_count() or 1))
+    if n_workers > len(files):
+        # More processes than files, every file is divided into blocks
+        for file in files:
+            prep_plink_parallel(file, n_workers, config.get("block_size", 64) * 1024 ** 2,
+                                compression)
+    elif files:
+        # Every file is streamed by its own process
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(prep_plink, files, repeat(compression)))
+
+    # Optionally create the DEPICT input loci instead of using existing .clumped files
+    clump_files = config.get("clump", {})
+    settings = config.get("clump_settings", {})
+    for trait, file in clump_files.items():
+        config["DEPICT"][trait] = clump(file, **settings)
 
     IBD_prepped = prep_for_depict(config["DEPICT"]["IBD"])
     PrC_prepped = prep_for_depict(config["DEPICT"]["PrC"])
     height_prepped = prep_for_depict(config["DEPICT"]["Height"])
 
-    downsample_file(height_prepped)
+    # Clumped loci are already limited by max_loci
+    if "Height" not in clump_files:
+        downsample = config.get("downsample", {})
+        downsample_file(height_prepped, n=downsample.get("n", 200), seed=downsample.get("seed", DOWNSAMPLE_SEED),
+                        replicates=downsample.get("replicates", 1))
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -41,10 +41,15 @@ class ArgumentParser:
         # Set version
         parser.version = __version__
 
-        parser.add_argument('-f',
+        inputs = parser.add_mutually_exclusive_group(required=True)
+        inputs.add_argument('-f',
             '--file', dest="file",
-            help='Input NetWas file - tab seperated txt or csv file',
-            required=True)
+            help='Input NetWas file - tab seperated txt or csv file')
+
+        inputs.add_argument('-d',
+            '--directory', dest="directory",
+            help='Directory with NetWas files (txt or csv) that are all parsed, '
+                 'the output should then be a directory.')
 
         parser.add_argument('-t',
             '--threshold', dest="threshold",
@@ -53,9 +58,25 @@ class ArgumentParser:
 
         parser.add_argument('-o',
             '--output', dest="output",
-            help='Location and name of the ouput file.',
+            help='Location and name of the ouput file (or directory with --directory).',
             required=True)
 
+        parser.add_argument('-j',
+            '--workers', dest="workers",
+            help='Number of files that are parsed at the same time with --directory, '
+                 'default = number of CPUs',
+            default=None, type=int)
+
+        parser.add_argument('--matrix', dest="matrix",
+            help='With --directory, also write the scores of all files into a single '
+                 'gene x (trait, tissue) matrix to this file.',
+            default=None)
+
+        parser.add_argument('--name_pattern', dest="name_pattern",
+            help='Regular expression with the groups trait and tissue to get them from the '
+                 'file names, default = "(?P<trait>[^_]+)_(?P<tissue>.+)"',
+            default=r"(?P<trait>[^_]+)_(?P<tissue>.+)")
+
         parser.add_argument('--gene_list', dest="gene_list",
             help='Specify if only gene symbols are written out."\
                 "Default is NetWas file with filtered genes',
@@ -116,6 +137,19 @@ class CLIArgValidator:
         self._validate_input_exists(input_path)
         self._validate_input_extension(input_path)
 
+    @staticmethod
+    def validate_input_dir(input_path: str) -> None:
+        """
+        Check if a directory exists.
+
+        :parameters
+        -----------
+        input_path - str
+            Path to a directory
+        """
+        if not Path(input_path).is_dir():
+            raise FileNotFoundError('Input directory does not exist!')
+
     @staticmethod
     def _validate_input_exists(input_path: Path) -> None:
         """
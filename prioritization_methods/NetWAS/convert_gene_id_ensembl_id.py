@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Convert the gene symbols of (parsed) NetWAS results into ensembl gene IDs using a
+local gene mapping dump (e.g. the HGNC complete set), without network access.
+Offline alternative for convert_gene_id_ensembl_id.R, using the same config file.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Any
+import pandas as pd
+import yaml
+
+
+__version__ = "v0.1"
+
+
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir,
+                  os.pardir,
+                  "results"))
+
+sys.path.insert(0, root_dir)
+
+from utils.gene_mapping import SymbolIndex, print_report
+
+
+def read_netwas(file: Path) -> pd.DataFrame:
+    """
+    Read in data resulting from parse_netwas_results.py. Data is tab seperated and
+    contains three columns: gene_symbol, training_label, netwas_score.
+
+    :parameters
+    -----------
+    file - Path
+        Parsed NetWas results
+
+    :returns
+    --------
+    data - pd.DataFrame
+        NetWAS data
+    """
+    return pd.read_csv(file, sep="\t", header=None,
+                       names=["gene_symbol", "training_label", "netwas_score"],
+                       dtype={"gene_symbol": str, "training_label": str,
+                              "netwas_score": "float64"})
+
+
+def convert_file(file: Path, output_file: Path, symbol_index: SymbolIndex,
+                 drop_ambiguous: bool = False) -> None:
+    """
+    Convert the gene symbols of a NetWAS result file into ensembl gene IDs and
+    write the gene symbol, ensembl gene ID and netwas score to a CSV file.
+
+    :parameters
+    -----------
+    file - Path
+        Parsed NetWas results
+    output_file - Path
+        Name and location of the output file
+    symbol_index - SymbolIndex
+        Index of the gene mapping
+    drop_ambiguous - bool
+        Remove gene symbols that match multiple genes instead of using the first
+    """
+    data = read_netwas(file)
+    converted, report = symbol_index.map_table(data, "gene_symbol",
+                                               drop_ambiguous=drop_ambiguous)
+    print_report(report, str(file))
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    converted[["gene_symbol", "ensemble_id", "netwas_score"]].to_csv(output_file,
+                                                                     index=False)
+
+
+class ArgumentParser:
+    """
+    Class to parse the input arguments.
+    """
+
+    def __init__(self) -> None:
+        self.parser = self._create_argument_parser()
+        # Print help if no arguments are supplied and stop the program
+        if len(sys.argv) == 1:
+            self.parser.print_help(sys.stderr)
+            sys.exit(1)
+        self.arguments = self.parser.parse_args()
+
+    @staticmethod
+    def _create_argument_parser():
+        """
+        Create an argument parser.
+
+        :returns
+        --------
+        parser - ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog=f"python {os.path.basename(__file__)}",
+            description="Convert the gene symbols of NetWas results into ensembl gene IDs.",
+            epilog="Contact: stijnarend@live.nl")
+
+        # Set version
+        parser.version = __version__
+
+        parser.add_argument('-c',
+            '--config', dest="config",
+            help='Configuration file with the traits and output_folder, default = config.yml',
+            default="config.yml")
+
+        parser.add_argument('-m',
+            '--mapping', dest="mapping",
+            help='Gene mapping dump, tab seperated with the columns symbol, alias_symbol, '
+                 'prev_symbol and ensembl_gene_id (e.g. the HGNC complete set)',
+            required=True)
+
+        parser.add_argument('--drop_ambiguous', dest="drop_ambiguous",
+            help='Remove gene symbols that match multiple genes instead of using the first gene',
+            action="store_true")
+
+        parser.add_argument('-v',
+            '--version',
+            help='Displays the version number of the script and exitst',
+            action='version')
+
+        return parser
+
+    def get_argument(self, argument_key: str) -> Any:
+        """
+        Method to get an input argument.
+        :parameters
+        -----------
+        argument_key - str
+            Full command line argument (so --config for the configuration file argument).
+
+        :returns
+        --------
+        value - List or boolean
+        """
+        if self.arguments is not None and argument_key in self.arguments:
+            value = getattr(self.arguments, argument_key)
+        else:
+            value = None
+        return value
+
+
+def main():
+    """
+    Run the main program.
+    """
+    arg_parser = ArgumentParser()
+    config_file = Path(arg_parser.get_argument('config'))
+    mapping = Path(arg_parser.get_argument('mapping'))
+    for file in (config_file, mapping):
+        if not file.is_file():
+            raise FileNotFoundError(f"File does not exist: {file}")
+
+    with open(config_file, 'r', encoding="utf-8") as stream:
+        config = yaml.safe_load(stream)
+    config = config.get("default", config)
+
+    symbol_index = SymbolIndex(mapping).load()
+    for file in config["traits"].values():
+        file = Path(file)
+        output_file = Path(config["output_folder"]) / file.name
+        convert_file(file, output_file, symbol_index,
+                     drop_ambiguous=arg_parser.get_argument('drop_ambiguous'))
+
+
+if __name__ == "__main__":
+    main()
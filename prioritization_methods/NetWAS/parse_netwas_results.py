@@ -4,7 +4,10 @@
 Module for parsing the results produced by NetWAS.
 """
 
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional, Tuple
 import pandas as pd
 from arg_parser import ArgumentParser, CLIArgValidator
 
@@ -13,6 +16,14 @@ __author__ = "Stijn Arends"
 __version__ = "v0.1"
 __date__ = "20-5-2022"
 
+COLUMNS = ["Gene", "label", "score"]
+
+# The training label is kept as text, so it is written out as it was read
+DTYPES = {"Gene": str, "label": str, "score": "float64"}
+
+# Default pattern to get the trait and tissue from the name of a NetWAS file in batch mode
+NAME_PATTERN = r"(?P<trait>[^_]+)_(?P<tissue>.+)"
+
 
 class NetWasParser:
     """
@@ -40,6 +51,21 @@ class NetWasParser:
                 False - all columns
         """
         df = self.read_netwas_data(self.file)
+        self.write_filtered_data(df, threshold, gene_list)
+
+    def write_filtered_data(self, df: pd.DataFrame, threshold: float, gene_list: bool) -> None:
+        """
+        Filter NetWas data and write it to the output file.
+
+        :paramters
+        ----------
+        df - pd.DataFrame
+            NetWas data
+        threshold - float
+            Threshold to decide which gene to keep - used on the NetWas score column
+        gene_list - Boolean
+            Flag specifying wheter or not to write out all the columns or only the gene names
+        """
         filtered_df = self.get_prioritized_genes(df, threshold)
         if gene_list:
             df_genes = pd.DataFrame(filtered_df.Gene)
@@ -50,17 +76,64 @@ class NetWasParser:
     @staticmethod
     def read_netwas_data(file: Path) -> pd.DataFrame:
         """
-        Read in a NetWas result file
+        Read in a NetWas result file. The header added by NetWas is skipped by
+        finding the first line containing data, after which the data is parsed
+        with the C engine.
 
         :parameters
         -----------
         file - Path
             File containing NetWas results
+
+        :returns
+        --------
+        df - pd.DataFrame
+            NetWas data - columns: [Gene, label, score]
         """
-        df = pd.read_csv(file, sep=None, skiprows=28,
-                        names= ["Gene", "label", "score"], engine='python')
+        skiprows, sep = NetWasParser.find_data_start(file)
+        df = pd.read_csv(file, sep=sep, skiprows=skiprows, header=None, names=COLUMNS,
+                         dtype=DTYPES, engine='c')
         return df
 
+    @staticmethod
+    def find_data_start(file: Path, max_lines: int = 10000) -> Tuple[int, str]:
+        """
+        Find the end of the header of a NetWas result file by scanning the lines
+        until a line with three (tab or comma separated) fields and a numeric
+        score is found.
+
+        :parameters
+        -----------
+        file - Path
+            File containing NetWas results
+        max_lines - int
+            Maximum number of lines to scan
+
+        :returns
+        --------
+        skiprows - int
+            Number of header lines
+        sep - str
+            Separator of the data
+        """
+        with open(file, 'r', encoding="utf-8") as stream:
+            for index, line in enumerate(stream):
+                if index >= max_lines:
+                    break
+                for sep in ("\t", ","):
+                    fields = line.rstrip("\r\n").split(sep)
+                    if len(fields) == 3 and NetWasParser._is_number(fields[2]):
+                        return index, sep
+        raise ValueError(f"No NetWas results found in {file}")
+
+    @staticmethod
+    def _is_number(value: str) -> bool:
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
+
     @staticmethod
     def get_prioritized_genes(df:pd.DataFrame, threshold:float) -> pd.DataFrame:
         """
@@ -113,6 +186,114 @@ class NetWasParser:
             pass
 
 
+def get_trait_tissue(file: Path, pattern: str = NAME_PATTERN) -> Tuple[str, str]:
+    """
+    Get the trait and tissue of a NetWas result file from its name.
+
+    :parameters
+    -----------
+    file - Path
+        File containing NetWas results
+    pattern - str
+        Regular expression with the groups 'trait' and 'tissue', matched against
+        the name of the file without extension
+
+    :returns
+    --------
+    trait - str
+        Name of the trait, the name of the file if the pattern does not match
+    tissue - str
+        Name of the tissue, empty if the pattern does not match
+    """
+    match = re.fullmatch(pattern, Path(file).stem)
+    if match is None:
+        return Path(file).stem, ""
+    return match.group("trait"), match.group("tissue")
+
+
+def parse_file(file: Path, output_file: Path, threshold: float,
+               gene_list: bool) -> pd.Series:
+    """
+    Parse a NetWas result file, used by the processes in batch mode.
+
+    :parameters
+    -----------
+    file - Path
+        File containing NetWas results
+    output_file - Path
+        Name and location of the output file
+    threshold - float
+        Threshold to decide which gene to keep - used on the NetWas score column
+    gene_list - Boolean
+        Flag specifying wheter or not to write out all the columns or only the gene names
+
+    :returns
+    --------
+    scores - pd.Series
+        NetWas scores of all genes
+    """
+    net_was = NetWasParser(file=file, output_file=output_file)
+    df = net_was.read_netwas_data(file)
+    net_was.write_filtered_data(df, threshold, gene_list)
+    return df.drop_duplicates("Gene").set_index("Gene").score
+
+
+def parse_directory(directory: Path, output_dir: Path, threshold: float, gene_list: bool,
+                    n_workers: Optional[int] = None, matrix_file: Optional[Path] = None,
+                    pattern: str = NAME_PATTERN) -> Optional[pd.DataFrame]:
+    """
+    Parse all NetWas result files (.txt and .csv) in a directory at the same
+    time. The parsed files are written to the output directory with the same
+    names. Optionally the scores of all files are collected into a single
+    gene x (trait, tissue) matrix.
+
+    :parameters
+    -----------
+    directory - Path
+        Directory containing NetWas result files
+    output_dir - Path
+        Directory to write the parsed files to
+    threshold - float
+        Threshold to decide which gene to keep - used on the NetWas score column
+    gene_list - Boolean
+        Flag specifying wheter or not to write out all the columns or only the gene names
+    n_workers - int
+        Number of processes
+    matrix_file - Path
+        File to write the score matrix to, None to not create the matrix
+    pattern - str
+        Regular expression to get the trait and tissue from the file names
+
+    :returns
+    --------
+    matrix - pd.DataFrame
+        Scores of all genes (unfiltered) per trait and tissue, None if no
+        matrix_file is given
+    """
+    files = sorted(file for file in Path(directory).iterdir()
+                   if file.is_file() and file.suffix in (".txt", ".csv"))
+    if not files:
+        raise FileNotFoundError(f"No NetWas result files found in {directory}")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(parse_file, file, Path(output_dir) / file.name,
+                                   threshold, gene_list) for file in files]
+        scores = {}
+        for file, future in zip(files, futures):
+            scores[get_trait_tissue(file, pattern)] = future.result()
+            print(f"Parsed {file}")
+
+    if matrix_file is None:
+        return None
+    if len(scores) != len(files):
+        raise ValueError("Multiple files have the same trait and tissue, change the name pattern")
+    matrix = pd.concat(scores, axis=1, names=["trait", "tissue"])
+    matrix.index.name = "Gene"
+    NetWasParser.make_data_dir(Path(matrix_file))
+    matrix.to_csv(matrix_file, sep="\t")
+    return matrix
+
+
 def main():
     """
     Run the main program.
@@ -120,10 +301,21 @@ def main():
     arg_parser = ArgumentParser()
     arg_validator = CLIArgValidator()
     file = arg_parser.get_argument('file')
+    directory = arg_parser.get_argument('directory')
     threshold = arg_parser.get_argument('threshold')
 
     output_file = Path(arg_parser.get_argument('output'))
     gene_list = arg_parser.get_argument("gene_list")
+
+    if directory is not None:
+        arg_validator.validate_input_dir(directory)
+        matrix_file = arg_parser.get_argument('matrix')
+        parse_directory(Path(directory), output_file, threshold, gene_list,
+                        n_workers=arg_parser.get_argument('workers'),
+                        matrix_file=Path(matrix_file) if matrix_file else None,
+                        pattern=arg_parser.get_argument('name_pattern'))
+        return
+
     arg_validator.validate_input_file(file)
 
     net_was = NetWasParser(file=file, output_file=output_file)
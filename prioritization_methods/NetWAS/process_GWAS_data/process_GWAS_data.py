@@ -7,15 +7,39 @@ VEGAS requires as input a GWAS summary statistics file containing rs SNP IDs and
 link: https://vegas2.qimrberghofer.edu.au/
 """
 
+import hashlib
+import heapq
+import io
+import json
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 import pandas as pd
 from fuzzywuzzy import fuzz
 from fuzzywuzzy import process
 from validate_config import ConfigValidator
 
+
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir,
+                  os.pardir,
+                  os.pardir,
+                  "results"))
+
+sys.path.insert(0, root_dir)
+
+from utils.compressed_io import open_file, read_blocks
+
 __author__ = "Stijn Arends"
 __version__ = "v.01"
 
+DEFAULT_REGISTRY = Path.home() / ".cache" / "benchmark-gwas-prio" / "column_registry.json"
+
 
 class AutomaticColumnExtractError(Exception):
     """
@@ -42,6 +66,12 @@ class ExtractVEGASColumns:
     p_val_columns = ["P", "pvalue", "p-value", "p_value"]
 
     def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the columns found in a previous file.
+        """
         self.snp = {"score":0, "name":None}
         self.pval = {"score":0, "name":None}
 
@@ -79,8 +109,10 @@ class ExtractVEGASColumns:
 
     def find_column_names(self, df) -> None:
         """
-        Try to find the column names which are needed to run VEGAS.
+        Try to find the column names which are needed to run VEGAS. Only the column
+        names are used, so a data frame without any rows (the header) is enough.
         """
+        self.reset()
         for column in df.columns:
             self.check_p_col(column)
             self.check_SNP_col(column)
@@ -98,16 +130,115 @@ class ExtractVEGASColumns:
             raise Exception("Run find column names")
         return [self.snp["name"], self.pval["name"]]
 
+    def get_scores(self) -> list:
+        """
+        Get the matching scores of the found columns
+
+        :returns
+        --------
+        snp,pval - list
+            Scores of the SNP and pvalue columns
+        """
+        return [self.snp["score"], self.pval["score"]]
+
+
+class ColumnRegistry:
+    """
+    Persistent registry of the SNP and p value columns that were automatically found
+    for a header, so the column names of a file only have to be matched once.
+
+    The registry is a JSON file that maps a signature of the header (and of the
+    pre-defined column names used for the matching) to the chosen columns and their
+    matching scores.
+    """
+
+    def __init__(self, file) -> None:
+        self.file = Path(file)
+        self.entries = self.read_registry()
+
+    def read_registry(self) -> dict:
+        """
+        Read the registry file.
+
+        :returns
+        --------
+        entries - dict
+            Header signature -> columns and scores, empty if the file does not exist
+        """
+        try:
+            with open(self.file, 'r', encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def get_signature(columns) -> str:
+        """
+        Create the signature of a header.
+
+        :parameters
+        -----------
+        columns - list
+            Column names of a file
+
+        :returns
+        --------
+        signature - str
+            Hex digest of the column names and the pre-defined column names
+        """
+        content = json.dumps([list(columns), ExtractVEGASColumns.snp_columns,
+                              ExtractVEGASColumns.p_val_columns])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, columns):
+        """
+        Look up the SNP and p value columns of a header.
+
+        :parameters
+        -----------
+        columns - list
+            Column names of a file
+
+        :returns
+        --------
+        columns - list
+            Names of the SNP and p value columns, None if the header is unknown
+        """
+        entry = self.entries.get(self.get_signature(columns))
+        return None if entry is None else entry["columns"]
+
+    def add(self, columns, chosen, scores) -> None:
+        """
+        Store the SNP and p value columns of a header and write the registry.
+
+        :parameters
+        -----------
+        columns - list
+            Column names of a file
+        chosen - list
+            Names of the SNP and p value columns
+        scores - list
+            Matching scores of the SNP and p value columns
+        """
+        self.entries[self.get_signature(columns)] = {"columns": list(chosen),
+                                                     "scores": list(scores)}
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding="utf-8") as stream:
+            json.dump(self.entries, stream, indent=2)
+        os.replace(tmp_file, self.file)
+
 
 class PrepGWASData:
     """
     Prepares GWAS data so that it can be used to run VEGAS.
     """
 
-    def __init__(self, file, vegas, snp_col, pval_col):
+    def __init__(self, file, vegas, snp_col, pval_col, registry=None):
         self.snp_col = snp_col
         self.pval_col = pval_col
         self.vegas = vegas
+        self.registry = registry
         self.df = self.prepare_data(Path(file))
 
     def get_df(self) -> pd.DataFrame:
@@ -130,18 +261,12 @@ class PrepGWASData:
         file - Path
             GWAS summstats file
         """
-        df = self.read_data(file)
-
-        if self.snp_col == 'None' or self.pval_col == 'None':
-            df = self.select_columns(df)
-        else:
-            try:
-                df = df.loc[:, [self.snp_col, self.pval_col]]
-            except KeyError:
-                print("Specified column(s) are not found, trying to find them automatically...")
-                df = self.select_columns(df)
+        columns = self.get_columns(file)
+        df = self.read_data(file, columns)
+        df = df.loc[:, columns]
 
-        # Drop NaN
+        # Drop NaN, including p values that are not numeric
+        df = self.to_numeric(df)
         df = self.drop_nan(df)
 
         df = self.filter_rs_id(df)
@@ -151,16 +276,68 @@ class PrepGWASData:
         return df
 
     @staticmethod
-    def read_data(file):
+    def read_header(file) -> pd.DataFrame:
         """
-        Read a tab seperated file into a pandas data frame
+        Read only the header of a tab seperated file.
 
         :parameter
         ----------
         file - Path
             GWAS summstats file
+
+        :returns
+        --------
+        header - pd.DataFrame
+            Data frame with the columns of the file and no rows
+        """
+        return pd.read_csv(file, sep="\t", nrows=0)
+
+    def get_columns(self, file) -> list:
+        """
+        Get the names of the SNP and p value columns using only the header of the file.
+        Automatically found columns are looked up in and added to the registry.
+
+        :parameter
+        ----------
+        file - Path
+            GWAS summstats file
+
+        :returns
+        --------
+        columns - list
+            Names of the SNP and p value columns
+        """
+        header = self.read_header(file)
+
+        if self.snp_col != 'None' and self.pval_col != 'None':
+            if {self.snp_col, self.pval_col}.issubset(header.columns):
+                return [self.snp_col, self.pval_col]
+            print("Specified column(s) are not found, trying to find them automatically...")
+
+        if self.registry is not None:
+            columns = self.registry.get(header.columns)
+            if columns is not None:
+                return columns
+
+        columns = list(self.select_columns(header).columns)
+        if self.registry is not None:
+            self.registry.add(header.columns, columns, self.vegas.get_scores())
+        return columns
+
+    @staticmethod
+    def read_data(file, columns):
         """
-        return pd.read_csv(file, sep="\t", low_memory=False)
+        Read the SNP and p value columns of a tab seperated file into a pandas data frame.
+        Both columns are read as text, see to_numeric.
+
+        :parameter
+        ----------
+        file - Path
+            GWAS summstats file
+        columns - list
+            Names of the SNP and p value columns
+        """
+        return pd.read_csv(file, sep="\t", usecols=columns, dtype=str)
 
     def select_columns(self, df):
         """
@@ -187,6 +364,26 @@ class PrepGWASData:
 
         return df
 
+    @staticmethod
+    def to_numeric(df):
+        """
+        Convert the p value column to numbers. Values that are not numeric (e.g. "NA"
+        written in another way or a truncated line) become NaN, so they are dropped
+        by drop_nan instead of aborting the whole file.
+
+        :parameter
+        ----------
+        df - pd.DataFrame
+            data frame with the SNP and p value columns
+
+        :returns
+        --------
+        df - pd.DataFrame
+            data frame with a float64 p value column
+        """
+        df[df.columns[1]] = pd.to_numeric(df.iloc[:, 1], errors="coerce")
+        return df
+
     @staticmethod
     def drop_nan(df):
         """
@@ -237,11 +434,182 @@ class PrepGWASData:
             Dataframe with the SNP column as the index
         """
         df.set_index(df.iloc[:,0], drop=True, inplace=True)
-        df.drop(columns=df.columns[0], axis=1, inplace=True)
-        df.sort_index(inplace=True)
+        df.drop(columns=df.columns[0], inplace=True)
+        # A stable sort keeps duplicated SNP IDs in file order, which makes the
+        # output independent of how the file was read (see StreamingPrepGWASData)
+        df.sort_index(inplace=True, kind="mergesort")
         return df
 
 
+class StreamingPrepGWASData(PrepGWASData):
+    """
+    Prepares GWAS data for VEGAS without loading the entire file into memory.
+
+    Only the SNP and p value columns are read, in chunks. Every chunk is filtered,
+    sorted and written to a temporary file (a sorted run), after which the runs are
+    merged into the output file (an external sort). The peak memory usage therefore
+    depends on the chunk size instead of the size of the file. The output is the same
+    as writing the data frame of PrepGWASData with write_out_df.
+    """
+
+    def __init__(self, file, vegas, snp_col, pval_col, registry=None,
+                 chunk_size=1_000_000, tmp_dir=None):
+        # The data is not read here, see write_out
+        self.file = Path(file)
+        self.snp_col = snp_col
+        self.pval_col = pval_col
+        self.vegas = vegas
+        self.registry = registry
+        self.chunk_size = chunk_size
+        self.tmp_dir = tmp_dir
+
+    def write_runs(self, columns: list, run_dir: Path) -> list:
+        """
+        Read the file in chunks and write every filtered and sorted chunk to a file.
+
+        :parameters
+        -----------
+        columns - list
+            Names of the SNP and p value columns
+        run_dir - Path
+            Directory to store the sorted runs
+
+        :returns
+        --------
+        runs - list
+            Files containing the sorted runs, in the order of the input file
+        """
+        runs = []
+        reader = pd.read_csv(self.file, sep="\t", usecols=columns, chunksize=self.chunk_size,
+                             dtype=str)
+        for index, chunk in enumerate(reader):
+            chunk = chunk.loc[:, columns]
+            chunk = self.to_numeric(chunk)
+            chunk = self.drop_nan(chunk)
+            chunk = self.filter_rs_id(chunk)
+            chunk = self.set_index(chunk)
+
+            run = run_dir / f"run_{index}.txt"
+            write_out_df(run, chunk)
+            runs.append(run)
+        return runs
+
+    @staticmethod
+    def merge_runs(runs: list, output_file: Path) -> None:
+        """
+        Merge sorted runs into a single sorted file. heapq.merge is stable, so
+        duplicated SNP IDs stay in the order of the input file.
+
+        :parameters
+        -----------
+        runs - list
+            Files containing the sorted runs, in the order of the input file
+        output_file - Path
+            Location of the output file
+        """
+        with ExitStack() as stack:
+            handles = [stack.enter_context(open(run, 'r', encoding="utf-8", newline=""))
+                       for run in runs]
+            with open(output_file, 'w', encoding="utf-8", newline="") as output:
+                output.writelines(heapq.merge(*handles,
+                                              key=lambda line: line.split("\t", 1)[0]))
+
+    def write_out(self, output_file) -> None:
+        """
+        Prepare the GWAS data and write it to the output file.
+
+        :parameters
+        -----------
+        output_file - Path
+            Location of the output file
+        """
+        columns = self.get_columns(self.file)
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as run_dir:
+            runs = self.write_runs(columns, Path(run_dir))
+            self.merge_runs(runs, Path(output_file))
+
+
+class ParallelPrepGWASData(StreamingPrepGWASData):
+    """
+    Prepares GWAS data for VEGAS using multiple processes.
+
+    The file is divided into blocks of lines (byte ranges that end at a line
+    boundary). Every block is parsed, filtered and sorted into a run by a worker
+    process, after which the runs are merged in the order of the file, the same as
+    StreamingPrepGWASData. The output is therefore the same as that of PrepGWASData.
+    """
+
+    def __init__(self, file, vegas, snp_col, pval_col, registry=None, n_workers=None,
+                 block_size=64 * 1024 ** 2, tmp_dir=None):
+        super().__init__(file, vegas, snp_col, pval_col, registry, tmp_dir=tmp_dir)
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.block_size = block_size
+
+    def write_runs(self, columns: list, run_dir: Path) -> list:
+        """
+        Divide the file into blocks and let the worker processes write every filtered
+        and sorted block to a file. At most two blocks per worker are kept in memory.
+
+        :parameters
+        -----------
+        columns - list
+            Names of the SNP and p value columns
+        run_dir - Path
+            Directory to store the sorted runs
+
+        :returns
+        --------
+        runs - list
+            Files containing the sorted runs, in the order of the input file
+        """
+        names = list(self.read_header(self.file).columns)
+        runs = []
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor, \
+                open_file(self.file) as stream:
+            # Skip the header
+            stream.readline()
+            for index, block in enumerate(read_blocks(stream, self.block_size)):
+                pending.append(executor.submit(write_run, block, names, columns,
+                                               run_dir / f"run_{index}.txt"))
+                if len(pending) >= 2 * self.n_workers:
+                    runs.append(pending.popleft().result())
+            runs.extend(future.result() for future in pending)
+        return runs
+
+
+def write_run(block, names, columns, run) -> Path:
+    """
+    Parse a block of lines, filter and sort it and write it to a file. Runs inside
+    a worker process of ParallelPrepGWASData.
+
+    :parameters
+    -----------
+    block - bytes
+        Lines of the GWAS summstats file without the header
+    names - list
+        Column names of the file
+    columns - list
+        Names of the SNP and p value columns
+    run - Path
+        Location of the output file
+
+    :returns
+    --------
+    run - Path
+        Location of the output file
+    """
+    chunk = pd.read_csv(io.BytesIO(block), sep="\t", header=None, names=names,
+                        usecols=columns, dtype=str)
+    chunk = chunk.loc[:, columns]
+    chunk = PrepGWASData.to_numeric(chunk)
+    chunk = PrepGWASData.drop_nan(chunk)
+    chunk = PrepGWASData.filter_rs_id(chunk)
+    chunk = PrepGWASData.set_index(chunk)
+    write_out_df(run, chunk)
+    return run
+
+
 def write_out_df(file, df):
     """
     Write out a data frame to a csv file.
@@ -266,6 +634,7 @@ def main():
     trait_data = validator.config
 
     vegas = ExtractVEGASColumns()
+    registry = ColumnRegistry(trait_data.get("column_registry", DEFAULT_REGISTRY))
 
     for trait, info in trait_data["traits"].items():
         print(f"Processing trait: {trait}")
@@ -277,10 +646,20 @@ def main():
         assert pval == "None" or isinstance(pval, str), "The pval column must be"\
             "either None or a string"
 
-        prep_gwas = PrepGWASData(info["file"], vegas, snp, pval)
-
         output_file = Path(trait_data["output"]) / (trait + "_vegas_input.txt")
-        write_out_df(output_file, prep_gwas.get_df())
+
+        if trait_data.get("workers", 1) > 1:
+            prep_gwas = ParallelPrepGWASData(info["file"], vegas, snp, pval, registry,
+                                             n_workers=trait_data["workers"],
+                                             block_size=trait_data.get("block_size", 64) * 1024 ** 2)
+            prep_gwas.write_out(output_file)
+        elif trait_data.get("chunk_size"):
+            prep_gwas = StreamingPrepGWASData(info["file"], vegas, snp, pval, registry,
+                                              chunk_size=trait_data["chunk_size"])
+            prep_gwas.write_out(output_file)
+        else:
+            prep_gwas = PrepGWASData(info["file"], vegas, snp, pval, registry)
+            write_out_df(output_file, prep_gwas.get_df())
 
 
 if __name__ == "__main__":
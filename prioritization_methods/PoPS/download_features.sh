@@ -44,9 +44,9 @@ do
     rm -r ${dir##*/}
 done
 
-gunzip -f *.gz
+# The features stay compressed, rename_file_contents.py reads and writes gzip and bgzip files
 
 cd ../../
 
 # Rename the files and columns by adding a prefix.
-python3 rename_file_contents.py -d gene_features/features/ --prefix pops_
\ No newline at end of file
+python3 rename_file_contents.py -d gene_features/features/ --prefix pops_ --header-only
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Reading and writing of (gzip or bgzip compressed) PoPS feature files.
+
+The (de)compression is shared with the other scripts, see utils/compressed_io.py in
+the results folder. This module adds the copying of the body of a feature file
+without reading it through python.
+"""
+
+import os
+import shutil
+import sys
+
+
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir,
+                  os.pardir,
+                  "results"))
+
+sys.path.insert(0, root_dir)
+
+from utils.compressed_io import (compress_bgzf_blocks, get_compression, open_output,
+                                 read_bgzf_block)
+from utils.compressed_io import open_file as open_feature_file
+
+
+def copy_body(source, destination, offset:int) -> None:
+    """
+    Copy a file from an offset to the current position of another file. The
+    copy is done by the kernel (copy_file_range or sendfile) when possible, so
+    the data is not copied through python.
+
+    :parameters
+    -----------
+    source - file object
+        File opened for reading in binary mode
+    destination - file object
+        File opened for writing in binary mode, which is flushed
+    offset - int
+        Position in the source file to start copying from
+    """
+    remaining = os.fstat(source.fileno()).st_size - offset
+    src, dst = source.fileno(), destination.fileno()
+    try:
+        while remaining > 0:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(src, dst, remaining, offset)
+            else:
+                copied = os.sendfile(dst, src, offset, remaining)
+            if copied == 0:
+                break
+            offset += copied
+            remaining -= copied
+    except (AttributeError, OSError):
+        # Not supported for these files (e.g. by the file system), copy the
+        # remaining data the normal way
+        pass
+    if remaining > 0:
+        source.seek(offset)
+        shutil.copyfileobj(source, destination)
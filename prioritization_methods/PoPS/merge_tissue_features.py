@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+"""
+Merge the feature files of multiple tissues into a single feature matrix.
+
+The feature files are joined on their gene IDs (first column) with a streaming
+sorted-merge join: the files are read line by line at the same time and only the
+rows of one block are kept in memory. The values are copied as they are, every
+column is prefixed with the name of its file (and optionally the tissue) and
+genes that are missing from a file get a missing value for its columns.
+
+The feature files need to be sorted on the gene IDs, unsorted files can be sorted
+first (externally, in blocks) with --sort.
+"""
+
+import argparse
+import heapq
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+from itertools import islice
+from pathlib import Path
+from feature_io import open_feature_file, open_output
+from rename_file_contents import MANIFEST, EditFeatureFiles
+
+__version__ = "V0.1"
+
+
+def get_gene(line:bytes) -> bytes:
+    """
+    Get the gene ID (first column) of a line.
+    """
+    return line.partition(b"\t")[0]
+
+
+def sort_feature_file(file:Path, tmp_dir:str, block_rows=100_000) -> Path:
+    """
+    Sort a feature file on its gene IDs with an external sort: blocks of rows
+    are sorted in memory and written to temporary files, which are merged.
+
+    :parameters
+    -----------
+    file - Path
+        A (compressed) feature file
+    tmp_dir - str
+        Directory for the temporary files
+    block_rows - int
+        Number of rows that are sorted in memory
+
+    :returns
+    --------
+    sorted_file - Path
+        Temporary file with the sorted rows
+    """
+    runs = []
+    with open_feature_file(file) as stream:
+        header = stream.readline()
+        while True:
+            lines = list(islice(stream, block_rows))
+            if not lines:
+                break
+            if not lines[-1].endswith(b"\n"):
+                lines[-1] += b"\n"
+            lines.sort(key=get_gene)
+            run = tempfile.NamedTemporaryFile(dir=tmp_dir, suffix=".run", delete=False)
+            with run:
+                run.writelines(lines)
+            runs.append(run.name)
+
+    sorted_file = tempfile.NamedTemporaryFile(dir=tmp_dir, suffix=".sorted", delete=False)
+    with sorted_file, ExitStack() as stack:
+        streams = [stack.enter_context(open(run, 'rb')) for run in runs]
+        sorted_file.write(header)
+        sorted_file.writelines(heapq.merge(*streams, key=get_gene))
+    for run in runs:
+        os.remove(run)
+    return Path(sorted_file.name)
+
+
+def read_rows(stream, file, n_cols:int):
+    """
+    Read the rows of a feature file that is sorted on its gene IDs.
+
+    :parameters
+    -----------
+    stream - file object
+        Binary stream of the feature file, after the header
+    file - Path
+        Name of the file, used in error messages
+    n_cols - int
+        Number of feature columns
+
+    :returns
+    --------
+    rows - generator
+        Tuples of the gene ID and the (tab separated) values as bytes
+    """
+    previous = None
+    for line in stream:
+        gene, _, values = line.rstrip(b"\r\n").partition(b"\t")
+        if previous is not None and gene == previous:
+            raise ValueError(f"{file} contains a duplicate gene ID: {gene.decode()}")
+        if previous is not None and gene < previous:
+            raise ValueError(f"{file} is not sorted on the gene IDs ({gene.decode()}), use "
+                             "--sort to sort the feature files first")
+        if values.count(b"\t") + 1 != n_cols:
+            raise ValueError(f"{file}: expected {n_cols} values for {gene.decode()}")
+        previous = gene
+        yield gene, values
+
+
+class MergeTissueFeatures:
+    """
+    Merge the feature files of multiple tissue directories on their gene IDs.
+    """
+
+    def __init__(self, directories, prefixes=None, separator=".", missing="NA",
+                 how="outer", sort=False, block_rows=100_000, tmp_dir=None):
+        if how not in ("outer", "inner"):
+            raise ValueError(f"Unknown join: {how}")
+        self.directories = [Path(directory) for directory in directories]
+        if prefixes is None:
+            prefixes = [""] * len(self.directories)
+        if len(prefixes) != len(self.directories):
+            raise ValueError("Give a prefix for every tissue directory")
+        self.prefixes = list(prefixes)
+        self.separator = separator.encode("utf-8")
+        self.missing = missing.encode("utf-8")
+        self.how = how
+        self.sort = sort
+        self.block_rows = block_rows
+        self.tmp_dir = tmp_dir
+
+    def get_feature_files(self) -> list:
+        """
+        Get the feature files of all tissues, in a fixed order.
+
+        :returns
+        --------
+        files - list
+            Tuples of the feature file and the prefix of its columns
+        """
+        files = []
+        for directory, prefix in zip(self.directories, self.prefixes):
+            for file in sorted(os.listdir(directory)):
+                if file.startswith(".") or file.endswith(".tmp") or file == MANIFEST \
+                        or not (directory / file).is_file():
+                    continue
+                name = prefix + EditFeatureFiles.get_base_name(file)
+                files.append((directory / file, name.encode("utf-8")))
+        return files
+
+    def get_header(self, header:bytes, name:bytes) -> tuple:
+        """
+        Get the prefixed feature names of a file.
+
+        :parameters
+        -----------
+        header - bytes
+            Header line of the feature file
+        name - bytes
+            Prefix of the columns
+
+        :returns
+        --------
+        gene_column - bytes
+            Name of the gene ID column
+        columns - list
+            Prefixed names of the features
+        """
+        columns = header.rstrip(b"\r\n").split(b"\t")
+        return columns[0], [name + self.separator + column for column in columns[1:]]
+
+    def merge(self, output, compression=None, n_threads=2) -> int:
+        """
+        Merge the feature files and write the combined matrix. The matrix is written
+        to a temporary file next to the output, which replaces the output when the
+        merge succeeds, so a failed merge never leaves a partial output behind.
+
+        :parameters
+        -----------
+        output - str
+            Output file
+        compression - str
+            None, "gzip" or "bgzip"
+        n_threads - int
+            Number of compression threads
+
+        :returns
+        --------
+        n_genes - int
+            Number of genes (rows) that are written
+        """
+        files = self.get_feature_files()
+        if not files:
+            raise ValueError("No feature files found")
+
+        tmp_output = EditFeatureFiles.get_tmp_file(Path(output))
+        try:
+            with ExitStack() as stack:
+                tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(dir=self.tmp_dir))
+                rows, fills, header = [], [], []
+                gene_column = None
+                for file, name in files:
+                    print(f"Reading {file}")
+                    feature_file = file
+                    if self.sort:
+                        feature_file = sort_feature_file(file, tmp_dir, self.block_rows)
+                    stream = stack.enter_context(open_feature_file(feature_file))
+                    file_gene_column, columns = self.get_header(stream.readline(), name)
+                    if gene_column is None:
+                        gene_column = file_gene_column
+                    elif file_gene_column != gene_column:
+                        raise ValueError(f"The gene ID column of {file} "
+                                         f"({file_gene_column.decode('utf-8')}) differs from "
+                                         f"the other feature files ({gene_column.decode('utf-8')})")
+                    header.extend(columns)
+                    rows.append(read_rows(stream, file, len(columns)))
+                    fills.append(b"\t".join([self.missing] * len(columns)))
+
+                if len(set(header)) != len(header):
+                    raise ValueError("The feature names are not unique, use --prefixes to add "
+                                     "the tissue to the names")
+
+                destination = stack.enter_context(open_output(tmp_output, compression, n_threads))
+                destination.write(b"\t".join([gene_column] + header) + b"\n")
+                n_genes = self.write_rows(rows, fills, destination)
+        except BaseException:
+            if tmp_output.exists():
+                tmp_output.unlink()
+            raise
+
+        os.replace(tmp_output, output)
+        return n_genes
+
+    def write_rows(self, rows:list, fills:list, destination) -> int:
+        """
+        Join the rows of the feature files on their gene IDs and write them in
+        blocks.
+
+        :parameters
+        -----------
+        rows - list
+            Generators of the (gene ID, values) of every feature file
+        fills - list
+            Missing values of every feature file
+        destination - file object
+            Binary stream to write to
+
+        :returns
+        --------
+        n_genes - int
+            Number of genes (rows) that are written
+        """
+        heads = []
+        for index, iterator in enumerate(rows):
+            row = next(iterator, None)
+            if row is not None:
+                heads.append((row[0], index, row[1]))
+        heapq.heapify(heads)
+
+        n_genes = 0
+        block = []
+        while heads:
+            gene = heads[0][0]
+            values = list(fills)
+            found = 0
+            while heads and heads[0][0] == gene:
+                _, index, row_values = heapq.heappop(heads)
+                values[index] = row_values
+                found += 1
+                row = next(rows[index], None)
+                if row is not None:
+                    heapq.heappush(heads, (row[0], index, row[1]))
+
+            if self.how == "inner" and found != len(rows):
+                continue
+            block.append(b"\t".join([gene] + values) + b"\n")
+            n_genes += 1
+            if len(block) >= self.block_rows:
+                destination.write(b"".join(block))
+                block = []
+        destination.write(b"".join(block))
+        return n_genes
+
+
+class ArgumentParser:
+    """
+    Class to parse the input arguments.
+    """
+
+    def __init__(self):
+        parser = self._create_argument_parser()
+        # Print help if no arguments are supplied and stop the program
+        if len(sys.argv) == 1:
+            parser.print_help(sys.stderr)
+            sys.exit(1)
+        self.arguments = parser.parse_args()
+
+    @staticmethod
+    def _create_argument_parser():
+        """
+        Create an argument parser.
+
+        :returns
+        --------
+        parser - ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog=os.path.basename(__file__),
+            description="Merge the feature files of multiple tissues on the gene IDs.",
+            epilog="Contact: stijnarend@live.nl")
+
+        # Set version
+        parser.version = __version__
+
+        parser.add_argument('-d', '--directories', dest='directories', nargs='+',
+            help='Directories containing the feature files of the tissues.')
+
+        parser.add_argument('-o', '--output', dest='output',
+            help='Output file, compressed with gzip if it ends with .gz')
+
+        parser.add_argument('--prefixes', dest='prefixes', nargs='+',
+            help='Prefix of the columns of every tissue directory, e.g. colon_ hbm_')
+
+        parser.add_argument('--separator', type=str, dest='separator', default=".",
+            help='Separator between the file name and the column name. Default = .')
+
+        parser.add_argument('--missing', type=str, dest='missing', default="NA",
+            help='Value of genes that are missing from a feature file. Default = NA')
+
+        parser.add_argument('--how', type=str, dest='how', default="outer",
+            choices=["outer", "inner"],
+            help='Keep all genes (outer) or only the genes in all files (inner). Default = outer')
+
+        parser.add_argument('--sort', dest='sort', action='store_true',
+            help='Sort the feature files on the gene IDs first.')
+
+        parser.add_argument('--block-rows', type=int, dest='block_rows', default=100_000,
+            help='Number of rows that are kept in memory while sorting and writing. '
+                 'Default = 100000')
+
+        parser.add_argument('--compression', type=str, dest='compression',
+            choices=["gzip", "bgzip"],
+            help='Compression of the output file. Default = gzip for .gz files')
+
+        parser.add_argument('-t', '--threads', type=int, dest='threads', default=2,
+            help='Number of compression threads. Default = 2')
+
+        parser.add_argument('--tmp-dir', dest='tmp_dir',
+            help='Directory for the temporary files used by --sort.')
+
+        parser.add_argument('-v',
+            '--version',
+            help='Displays the version number of the script and exitst',
+            action='version')
+
+        return parser
+
+    def get_argument(self, argument_key):
+        """
+        Method to get an input argument.
+        :parameters
+        -----------
+        argument_key - str
+            Full command line argument (so --config for the configuration file argument).
+
+        :returns
+        --------
+        value - List or boolean
+        """
+        if self.arguments is not None and argument_key in self.arguments:
+            value = getattr(self.arguments, argument_key)
+        else:
+            value = None
+        return value
+
+
+class CommandLineArgumentsValidator:
+    """
+    Class to check if arguments are valid.
+    """
+
+    def validate_input_paths(self, input_paths):
+        for input_path in input_paths or [None]:
+            self._validate_input_exists(input_path)
+
+    @staticmethod
+    def _validate_input_exists(input_path):
+        """
+        Check if a file exists.
+        :parameters
+        -----------
+        input_path - str
+            Path to a directory
+        """
+        if input_path is None or not Path(input_path).is_dir():
+            raise FileNotFoundError(f'Input directory does not exist: {input_path}')
+
+
+def main():
+
+    cla_parser = ArgumentParser()
+    directories = cla_parser.get_argument('directories')
+    output = cla_parser.get_argument('output')
+    compression = cla_parser.get_argument('compression')
+    if compression is None and output.endswith(".gz"):
+        compression = "gzip"
+
+    # Validate passed arguments
+    cla_validator = CommandLineArgumentsValidator()
+    cla_validator.validate_input_paths(directories)
+
+    merge_features = MergeTissueFeatures(directories,
+                                         prefixes=cla_parser.get_argument('prefixes'),
+                                         separator=cla_parser.get_argument('separator'),
+                                         missing=cla_parser.get_argument('missing'),
+                                         how=cla_parser.get_argument('how'),
+                                         sort=cla_parser.get_argument('sort'),
+                                         block_rows=cla_parser.get_argument('block_rows'),
+                                         tmp_dir=cla_parser.get_argument('tmp_dir'))
+    n_genes = merge_features.merge(output, compression, cla_parser.get_argument('threads'))
+    print(f"Wrote {n_genes} genes to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+"""
+Convert feature files into the chunked numpy matrices that are used by PoPs
+(the output of munge_feature_files.py of the PoPs repository).
+
+Every feature file is read once, its rows are aligned to the genes of the gene
+annotation and its columns are written as float32 directly into the matrix chunks.
+The column names get the same prefix as rename_file_contents.py would give them,
+so the feature files do not have to be renamed first.
+
+Output:
+    <save_prefix>.rows.txt - the genes (rows of the matrices)
+    <save_prefix>.cols.<i>.txt - the features (columns) of chunk i
+    <save_prefix>.mat.<i>.npy - float32 matrix (genes x features) of chunk i
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from feature_io import get_compression, open_feature_file
+from rename_file_contents import MANIFEST, EditFeatureFiles
+
+__version__ = "V0.1"
+
+NAN_POLICIES = ("raise", "ignore", "mean", "zero")
+
+
+class MungeFeatureFiles:
+    """
+    Convert the feature files in a directory into chunked float32 matrices.
+    """
+
+    def __init__(self, folder, genes, save_prefix, prefix="pops_", max_cols=5000,
+                 nan_policy="raise"):
+        if nan_policy not in NAN_POLICIES:
+            raise ValueError(f"Unknown nan policy: {nan_policy}")
+        self.folder = Path(folder)
+        self.genes = pd.Index(genes)
+        self.save_prefix = str(save_prefix)
+        self.prefix = prefix
+        self.max_cols = max_cols
+        self.nan_policy = nan_policy
+        self.edit_files = EditFeatureFiles(folder, prefix)
+
+    def get_feature_files(self) -> list:
+        """
+        Get the feature files in the directory, in a fixed order.
+
+        :returns
+        --------
+        files - list
+            Names of the feature files
+        """
+        return [file for file in sorted(os.listdir(self.folder))
+                if not file.startswith(".") and not file.endswith(".tmp")
+                and file != MANIFEST and (self.folder / file).is_file()]
+
+    def get_columns(self, file:str) -> list:
+        """
+        Get the (renamed) feature names of a file from its header. Files that
+        do not start with the prefix get the prefix that rename_file_contents.py
+        would add to them.
+
+        :parameters
+        -----------
+        file - str
+            Name of a feature file
+
+        :returns
+        --------
+        columns - list
+            Names of the features
+        """
+        with open_feature_file(self.folder / file) as stream:
+            header = stream.readline()
+        if not file.startswith(self.prefix):
+            header = self.edit_files.rename_header(header, self.prefix + file)
+        return header.rstrip(b"\r\n").decode("utf-8").split("\t")[1:]
+
+    def get_chunk_file(self, chunk:int) -> str:
+        """
+        Get the name of the matrix file of a chunk.
+
+        :parameters
+        -----------
+        chunk - int
+            Index of the chunk
+
+        :returns
+        --------
+        file - str
+            Name of the matrix file
+        """
+        return f"{self.save_prefix}.mat.{chunk}.npy"
+
+    def read_file(self, file:str) -> np.ndarray:
+        """
+        Read a feature file and align its rows to the genes. Values of genes
+        that are missing from the file (or that are NaN) are handled according
+        to the nan policy.
+
+        :parameters
+        -----------
+        file - str
+            Name of a feature file
+
+        :returns
+        --------
+        values - np.ndarray
+            float32 matrix of genes x features
+        """
+        path = self.folder / file
+        with open_feature_file(path) as stream:
+            header = stream.readline().rstrip(b"\r\n").decode("utf-8").split("\t")
+        dtypes = {column: np.float32 for column in header[1:]}
+        dtypes[header[0]] = str
+        compression = "gzip" if get_compression(path) is not None else None
+        df = pd.read_csv(path, sep="\t", header=0, dtype=dtypes, compression=compression,
+                         engine="c")
+
+        positions = self.genes.get_indexer(df.iloc[:, 0])
+        found = positions >= 0
+        values = np.full((len(self.genes), df.shape[1] - 1), np.nan, dtype=np.float32)
+        values[positions[found]] = df.iloc[:, 1:].to_numpy(dtype=np.float32)[found]
+
+        missing = np.isnan(values)
+        if self.nan_policy == "raise" and missing.any():
+            raise ValueError(f"{file} is missing values for {missing.any(axis=1).sum()} genes, "
+                             "use another nan policy to impute them")
+        if self.nan_policy == "mean":
+            values = np.where(missing, np.nanmean(values, axis=0), values)
+        elif self.nan_policy == "zero":
+            values[missing] = 0
+        return values.astype(np.float32, copy=False)
+
+    def munge_file(self, file:str, offset:int) -> tuple:
+        """
+        Write the features of a file into the matrix chunks.
+
+        :parameters
+        -----------
+        file - str
+            Name of a feature file
+        offset - int
+            Index of the first column of the file in the complete matrix
+
+        :returns
+        --------
+        file - str
+            Name of the feature file
+        seconds - float
+            Time it took to process the file
+        """
+        start = time.perf_counter()
+        values = self.read_file(file)
+        end = offset + values.shape[1]
+        first_chunk = offset // self.max_cols
+        last_chunk = (end - 1) // self.max_cols if end > offset else first_chunk - 1
+        for chunk in range(first_chunk, last_chunk + 1):
+            first = max(offset, chunk * self.max_cols)
+            last = min(end, (chunk + 1) * self.max_cols)
+            matrix = np.load(self.get_chunk_file(chunk) + ".tmp", mmap_mode='r+')
+            matrix[:, first - chunk * self.max_cols:last - chunk * self.max_cols] = \
+                values[:, first - offset:last - offset]
+            matrix.flush()
+            del matrix
+        return file, time.perf_counter() - start
+
+    def munge(self, n_workers=None) -> None:
+        """
+        Convert all feature files. The layout of the chunks is determined from
+        the headers of the files, after which the files are read by a pool of
+        processes that write their columns directly into the (memory-mapped)
+        chunks. The chunks are moved in place when all files are processed.
+
+        :parameters
+        -----------
+        n_workers - int
+            Number of processes
+        """
+        files = self.get_feature_files()
+        columns = [self.get_columns(file) for file in files]
+        offsets = np.cumsum([0] + [len(names) for names in columns])
+        all_columns = [name for names in columns for name in names]
+        if len(set(all_columns)) != len(all_columns):
+            raise ValueError("The feature names are not unique")
+        n_chunks = -(-len(all_columns) // self.max_cols)
+        print(f"Munging {len(files)} files: {len(self.genes)} genes x {len(all_columns)} "
+              f"features in {n_chunks} chunks")
+
+        Path(self.save_prefix).parent.mkdir(parents=True, exist_ok=True)
+        for chunk in range(n_chunks):
+            n_cols = min(self.max_cols, len(all_columns) - chunk * self.max_cols)
+            matrix = np.lib.format.open_memmap(self.get_chunk_file(chunk) + ".tmp", mode='w+',
+                                               dtype=np.float32,
+                                               shape=(len(self.genes), n_cols))
+            del matrix
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(self.munge_file, file, int(offset))
+                       for file, offset in zip(files, offsets)]
+            for future in as_completed(futures):
+                file, seconds = future.result()
+                print(f"Processed {file} in {seconds:.2f} s")
+
+        for chunk in range(n_chunks):
+            names = all_columns[chunk * self.max_cols:(chunk + 1) * self.max_cols]
+            self.write_names(names, f"{self.save_prefix}.cols.{chunk}.txt")
+            os.replace(self.get_chunk_file(chunk) + ".tmp", self.get_chunk_file(chunk))
+        self.write_names(self.genes, f"{self.save_prefix}.rows.txt")
+
+    @staticmethod
+    def write_names(names, file:str) -> None:
+        """
+        Write names to a file, one per line.
+
+        :parameters
+        -----------
+        names - list
+            Names
+        file - str
+            Output file
+        """
+        with open(file, 'w', encoding="utf-8") as stream:
+            stream.writelines(f"{name}\n" for name in names)
+
+
+def read_genes(file, gene_column="ENSGID") -> list:
+    """
+    Read the genes of a gene annotation file (as used by PoPs).
+
+    :parameters
+    -----------
+    file - str
+        Gene annotation file (tab separated)
+    gene_column - str
+        Name of the column containing the gene IDs
+
+    :returns
+    --------
+    genes - list
+        Unique gene IDs in the order of the file
+    """
+    genes = pd.read_csv(file, sep="\t", usecols=[gene_column], dtype=str,
+                        engine="c")[gene_column]
+    return list(dict.fromkeys(genes))
+
+
+class ArgumentParser:
+    """
+    Class to parse the input arguments.
+    """
+
+    def __init__(self):
+        parser = self._create_argument_parser()
+        # Print help if no arguments are supplied and stop the program
+        if len(sys.argv) == 1:
+            parser.print_help(sys.stderr)
+            sys.exit(1)
+        self.arguments = parser.parse_args()
+
+    @staticmethod
+    def _create_argument_parser():
+        """
+        Create an argument parser.
+
+        :returns
+        --------
+        parser - ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog=os.path.basename(__file__),
+            description="Convert feature files into the chunked numpy matrices used by PopS.",
+            epilog="Contact: stijnarend@live.nl")
+
+        # Set version
+        parser.version = __version__
+
+        parser.add_argument('-d',
+            '--directory', dest='directory',
+            help='Location of the directory containing the features.')
+
+        parser.add_argument('-g', '--gene-annot', dest='gene_annot',
+            help='Gene annotation file, the genes are the rows of the matrices.')
+
+        parser.add_argument('--gene-column', type=str, dest="gene_column", default="ENSGID",
+            help='Column of the gene annotation file containing the gene IDs. Default = ENSGID')
+
+        parser.add_argument('-o', '--save-prefix', dest='save_prefix',
+            help='Prefix of the output files.')
+
+        parser.add_argument('--prefix', type=str, dest="prefix",
+            help='Prefix to use when renaming the columns. Default = pops_',
+            default="pops_")
+
+        parser.add_argument('--max-cols', type=int, dest="max_cols", default=5000,
+            help='Maximum number of features in a chunk. Default = 5000')
+
+        parser.add_argument('--nan-policy', type=str, dest="nan_policy", default="raise",
+            choices=NAN_POLICIES,
+            help='What to do with genes that are missing from a feature file: raise an error, '
+                 'ignore (keep NaN), impute the mean of the feature or impute zero. Default = raise')
+
+        parser.add_argument('-w', '--workers', type=int, dest="workers",
+            help='Number of processes. Default = number of CPUs')
+
+        parser.add_argument('-v',
+            '--version',
+            help='Displays the version number of the script and exitst',
+            action='version')
+
+        return parser
+
+    def get_argument(self, argument_key):
+        """
+        Method to get an input argument.
+        :parameters
+        -----------
+        argument_key - str
+            Full command line argument (so --config for the configuration file argument).
+
+        :returns
+        --------
+        value - List or boolean
+        """
+        if self.arguments is not None and argument_key in self.arguments:
+            value = getattr(self.arguments, argument_key)
+        else:
+            value = None
+        return value
+
+
+class CommandLineArgumentsValidator:
+    """
+    Class to check if arguments are valid.
+    """
+
+    def validate_input_path(self, input_path):
+        self._validate_input_exists(input_path)
+
+    def validate_input_file(self, input_file):
+        if input_file is None or not Path(input_file).is_file():
+            raise FileNotFoundError('Gene annotation file does not exist!')
+
+    @staticmethod
+    def _validate_input_exists(input_path):
+        """
+        Check if a file exists.
+        :parameters
+        -----------
+        input_path - str
+            Path to a directory
+        """
+        if input_path is None or not Path(input_path).is_dir():
+            raise FileNotFoundError('Input directory does not exist!')
+
+
+def main():
+
+    cla_parser = ArgumentParser()
+    folder = cla_parser.get_argument('directory')
+    gene_annot = cla_parser.get_argument('gene_annot')
+    save_prefix = cla_parser.get_argument('save_prefix')
+
+    # Validate passed arguments
+    cla_validator = CommandLineArgumentsValidator()
+    cla_validator.validate_input_path(folder)
+    cla_validator.validate_input_file(gene_annot)
+
+    genes = read_genes(gene_annot, cla_parser.get_argument('gene_column'))
+    munge_files = MungeFeatureFiles(folder, genes, save_prefix,
+                                    prefix=cla_parser.get_argument('prefix'),
+                                    max_cols=cla_parser.get_argument('max_cols'),
+                                    nan_policy=cla_parser.get_argument('nan_policy'))
+    munge_files.munge(cla_parser.get_argument('workers'))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,41 +8,218 @@ Author - Stijn Arends
 Date - 15-6-2022
 """
 
+import gzip
 import multiprocessing as mp
 import pandas as pd
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 import argparse
 import sys
+from feature_io import (compress_bgzf_blocks, copy_body, get_compression, open_output,
+                        read_bgzf_block)
 
 __version__ = "V0.1"
 
+# Default number of files that are processed at the same time per storage type.
+# Renaming is bound by the I/O, local disks are saturated by a few streams while
+# network file systems need more concurrent requests to hide their latency.
+STORAGE_THREADS = {"local": 8, "network": 32}
+
+MANIFEST = ".rename_manifest.tsv"
+
 class EditFeatureFiles:
 
-    def __init__(self, folder, prefix):
+    def __init__(self, folder, prefix, header_only=False, n_threads=2):
         self.folder = Path(folder)
         self.prefix = prefix
+        self.header_only = header_only
+        self.n_threads = n_threads
 
-    def edit_file(self, file:str) -> None:
+    def edit_file(self, file:str) -> tuple:
         """
         Edit a file by adding a prefix to the file name, and 
         column names.
 
+        Compressed (gzip or bgzip) files stay compressed in the same format.
+        The new file is first written to a temporary file, which is moved in
+        place when it is complete, after which the old file is removed. An
+        interrupted run therefore never leaves a partially written file
+        behind.
+
         :parameters
         file - str
             Name of a file
+
+        :returns
+        --------
+        new_name - str
+            Name of the renamed file
+        size - int
+            Size of the file in bytes
+        seconds - float
+            Time it took to process the file
         """
-        print(f"Processing: {file}")
+        start = time.perf_counter()
         old_file = self.folder / file
         new_name = (self.prefix + file)
         new_file = self.folder / new_name
+        tmp_file = self.get_tmp_file(new_file)
+        size = old_file.stat().st_size
+        compression = get_compression(old_file)
+
+        if self.header_only:
+            self.rewrite_header(old_file, tmp_file, new_name, compression)
+        else:
+            df = self.read_data(old_file)
+            df = self.rename_col_names(df, new_name)
+            self.write_data(df, tmp_file, compression)
+
+        self.rename_file(tmp_file, new_file)
+        os.remove(old_file)
+        return new_name, size, time.perf_counter() - start
+
+    @staticmethod
+    def get_tmp_file(file:Path) -> Path:
+        """
+        Get the temporary file that is used while writing a file.
+
+        :parameters
+        -----------
+        file - Path
+            A file
+
+        :returns
+        --------
+        tmp_file - Path
+            Temporary file next to the file
+        """
+        return file.with_name(file.name + ".tmp")
+
+    def get_pending_files(self, done:dict) -> list:
+        """
+        Get the files that still need to be renamed. Files that already start
+        with the prefix or that are renamed according to the manifest are
+        skipped, so running the renaming twice does not add the prefix twice.
+        Temporary files of an interrupted run are removed.
+
+        :parameters
+        -----------
+        done - dict
+            Files that are renamed according to the manifest
+
+        :returns
+        --------
+        files - list
+            Names of the files to rename
+        """
+        files = []
+        for file in sorted(os.listdir(self.folder)):
+            path = self.folder / file
+            if file.startswith(".") or not path.is_file():
+                continue
+            if file.startswith(self.prefix):
+                if file.endswith(".tmp"):
+                    os.remove(path)
+                continue
+            if file in done:
+                print(f"Skipping {file}, already renamed to {done[file]}")
+                continue
+            files.append(file)
+        return files
+
+    def rewrite_header(self, old:Path, new:Path, name:str, compression=None) -> None:
+        """
+        Write the renamed file by only rewriting the header line, the rest
+        of the file is copied as raw bytes. The values are therefore not
+        parsed and stay bit-identical.
+
+        For bgzip files only the blocks containing the header are recompressed,
+        the other blocks are copied as they are. gzip files are decompressed and
+        compressed again (in parallel blocks), as the header can not be separated
+        from the rest of the data.
+
+        :parameters
+        -----------
+        old - Path
+            Old file name
+        new - Path
+            File to write
+        name - str
+            Name of the file to use as prefix of the columns
+        compression - str
+            None, "gzip" or "bgzip"
+        """
+        if compression == "gzip":
+            with gzip.open(old, 'rb') as source, \
+                    open_output(new, compression, self.n_threads) as destination:
+                destination.write(self.rename_header(source.readline(), name))
+                shutil.copyfileobj(source, destination, 1024 ** 2)
+            return
+
+        with open(old, 'rb') as source, open(new, 'wb') as destination:
+            if compression == "bgzip":
+                data = b""
+                while b"\n" not in data:
+                    block = read_bgzf_block(source)
+                    if not block:
+                        break
+                    data += gzip.decompress(block)
+                header, newline, rest = data.partition(b"\n")
+                destination.write(compress_bgzf_blocks(
+                    self.rename_header(header + newline, name) + rest))
+            else:
+                header = source.readline()
+                destination.write(self.rename_header(header, name))
+            destination.flush()
+            copy_body(source, destination, source.tell())
+
+    def rename_header(self, header:bytes, name:str) -> bytes:
+        """
+        Rename the columns in the header line of a feature file by adding the
+        file name to the front of the columns. The first column (the genes)
+        and the line ending are kept as they are.
+
+        :parameters
+        -----------
+        header - bytes
+            Header line of a feature file
+        name - str
+            Name of the file to use as prefix of the columns
 
-        self.rename_file(old_file, new_file)
+        :returns
+        --------
+        header - bytes
+            Renamed header line
+        """
+        line = header.rstrip(b"\r\n")
+        ending = header[len(line):]
+        base_name = self.get_base_name(name).encode("utf-8")
 
-        df = self.read_data(new_file)
-        df = self.rename_col_names(df, new_name)
+        columns = line.split(b"\t")
+        new_cols = [base_name + b"_" + column for column in columns[1:]]
+        return b"\t".join([columns[0]] + new_cols) + ending
+
+    @staticmethod
+    def get_base_name(name) -> str:
+        """
+        Get the name of a file without any extensions.
 
-        self.write_data(df, new_file)
+        :parameters
+        -----------
+        name - Path
+            Name of the file
+
+        :returns
+        --------
+        base_name - str
+            Name of the file up to the first '.'
+        """
+        filename = Path(name)
+        base, _, _ = filename.name.partition('.')
+        return str(filename.with_name(base))
 
     @staticmethod
     def rename_file(old:Path, new:Path) -> None:
@@ -60,21 +237,20 @@ class EditFeatureFiles:
 
     def read_data(self, file:Path) -> pd.DataFrame:
         """
-        Read in the feature data as either a gz file or normal txt file.
+        Read in the feature data as either a gz (or bgzip) file or normal txt file.
 
         :parameters
         -----------
         file - Path
             A file
-        gz -bool
-            If the file is gziped or not
 
         :returns
         --------
         df - pd.DataFrame
             data in a pandas data frame
         """
-        df = pd.read_csv(file, sep="\t", header=0)
+        compression = "gzip" if get_compression(file) is not None else None
+        df = pd.read_csv(file, sep="\t", header=0, compression=compression)
         return df
 
     def rename_col_names(self, df: pd.DataFrame, name:Path) -> pd.DataFrame:
@@ -94,15 +270,14 @@ class EditFeatureFiles:
         df - pd.DataFrame
             data with renamed columns
         """
-        filename = Path(name)
-        base, _, _ = filename.name.partition('.')
-        base_name = str(filename.with_name(base))
+        base_name = self.get_base_name(name)
 
         new_cols = [base_name + "_" + column for column in df.columns[1:].values]
         df.columns.values[1:] = new_cols
         return df
 
-    def write_data(self, df:pd.DataFrame, file_name: Path) -> None:
+    def write_data(self, df:pd.DataFrame, file_name: Path, compression=None,
+                   chunk_size=100_000) -> None:
         """
         Overwrite the old data with the new data.
 
@@ -112,10 +287,114 @@ class EditFeatureFiles:
             Data in a data frame
         file_name - Path
             A file
-        gz -bool
-            If the file is gziped or not
+        compression - str
+            None, "gzip" or "bgzip". Compressed files are written in chunks
+            of rows that are compressed in parallel
+        chunk_size - int
+            Number of rows that are converted to text at once
         """
-        df.to_csv(file_name, sep="\t", index=False, mode="w+")
+        if compression is None:
+            df.to_csv(file_name, sep="\t", index=False, mode="w+")
+            return
+
+        with open_output(file_name, compression, self.n_threads) as stream:
+            for start in range(0, max(len(df), 1), chunk_size):
+                chunk = df.iloc[start:start + chunk_size]
+                stream.write(chunk.to_csv(sep="\t", index=False,
+                                          header=start == 0).encode("utf-8"))
+
+
+class RenameManifest:
+    """
+    Manifest of the renamed files in a directory. Every file is appended as a
+    single line (old name, new name, size and seconds) that is flushed to disk
+    after the file is renamed, so an interrupted run can be resumed. A line that
+    was not written completely is ignored.
+    """
+
+    def __init__(self, file):
+        self.file = Path(file)
+
+    def read(self) -> dict:
+        """
+        Read the renamed files.
+
+        :returns
+        --------
+        done - dict
+            The old names of the renamed files with their new names
+        """
+        done = {}
+        if not self.file.exists():
+            return done
+        with open(self.file, 'r', encoding="utf-8") as stream:
+            for line in stream:
+                fields = line.split("\t")
+                if not line.endswith("\n") or len(fields) != 4:
+                    continue
+                done[fields[0]] = fields[1]
+        return done
+
+    def add(self, old:str, new:str, size:int, seconds:float) -> None:
+        """
+        Add a renamed file to the manifest.
+
+        :parameters
+        -----------
+        old - str
+            Old file name
+        new - str
+            New file name
+        size - int
+            Size of the file in bytes
+        seconds - float
+            Time it took to process the file
+        """
+        with open(self.file, 'a', encoding="utf-8") as stream:
+            stream.write(f"{old}\t{new}\t{size}\t{seconds:.3f}\n")
+            stream.flush()
+            os.fsync(stream.fileno())
+
+
+def rename_files(edit_files:EditFeatureFiles, n_workers:int) -> None:
+    """
+    Rename all files in the directory that are not renamed yet, and record
+    every renamed file in the manifest.
+
+    Rewriting only the headers is bound by the I/O and is done by a pool of
+    threads, parsing the whole files is done by a pool of processes.
+
+    :parameters
+    -----------
+    edit_files - EditFeatureFiles
+        Object used to rename the files
+    n_workers - int
+        Number of files that are processed at the same time
+    """
+    manifest = RenameManifest(edit_files.folder / MANIFEST)
+    files = edit_files.get_pending_files(manifest.read())
+    print(f"Renaming {len(files)} files")
+
+    if edit_files.header_only:
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(n_workers, mp.cpu_count()))
+
+    start = time.perf_counter()
+    total = 0
+    with executor:
+        futures = {executor.submit(edit_files.edit_file, file): file for file in files}
+        for future in as_completed(futures):
+            file = futures[future]
+            new_name, size, seconds = future.result()
+            manifest.add(file, new_name, size, seconds)
+            total += size
+            print(f"Renamed {file} -> {new_name}: {size / 1e6:.1f} MB in {seconds:.2f} s "
+                  f"({size / 1e6 / max(seconds, 1e-9):.1f} MB/s)")
+
+    seconds = time.perf_counter() - start
+    print(f"Renamed {len(files)} files ({total / 1e6:.1f} MB) in {seconds:.2f} s "
+          f"({total / 1e6 / max(seconds, 1e-9):.1f} MB/s)")
 
 
 class ArgumentParser:
@@ -155,6 +434,22 @@ class ArgumentParser:
             help='Prefix to use when renaming the files and columns. Default = pops_',
             default="pops_")
 
+        parser.add_argument('--header-only', dest="header_only", action='store_true',
+            help='Only rewrite the header line of the files and copy the data as it is, '
+                 'instead of parsing and rewriting the whole file.')
+
+        parser.add_argument('--storage', type=str, dest="storage",
+            choices=list(STORAGE_THREADS), default="local",
+            help='Type of storage the features are located on, used to choose the number of '
+                 'files that are processed at the same time. Default = local')
+
+        parser.add_argument('-t', '--threads', type=int, dest="threads",
+            help='Number of files that are processed at the same time, overrides --storage.')
+
+        parser.add_argument('--compression-threads', type=int, dest="compression_threads",
+            default=2, help='Number of threads used to compress every gzip or bgzip '
+                            'compressed file. Default = 2')
+
         parser.add_argument('-v',
             '--version',
             help='Displays the version number of the script and exitst',
@@ -207,17 +502,19 @@ def main():
     cla_parser = ArgumentParser()
     folder = cla_parser.get_argument('directory')
     prefix = cla_parser.get_argument('prefix')
+    header_only = cla_parser.get_argument('header_only')
+    storage = cla_parser.get_argument('storage')
+    threads = cla_parser.get_argument('threads')
+    compression_threads = cla_parser.get_argument('compression_threads')
 
     # Validate passed arguments
     cla_validator = CommandLineArgumentsValidator()
     cla_validator.validate_input_path(folder)
 
-    edit_files = EditFeatureFiles(folder=folder, prefix=prefix)
+    edit_files = EditFeatureFiles(folder=folder, prefix=prefix, header_only=header_only,
+                                  n_threads=compression_threads)
 
-    files = os.listdir(folder)
-    
-    with mp.Pool(mp.cpu_count()) as p:
-        p.map(edit_files.edit_file, files)
+    rename_files(edit_files, threads or STORAGE_THREADS[storage])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""
+Benchmark the vectorized fisher's exact test engine against the loop over
+scipy.stats.fisher_exact that was used before.
+
+The contingency tables are generated the same way perform_fisher_exact_tests
+builds them: a fixed gene universe and number of significant genes, and one
+table per HPO term.
+
+Example:
+    python benchmark_fisher_exact.py --genes 20000 --significant 500 --terms 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from scipy import stats
+
+
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir))
+
+sys.path.insert(0, root_dir)
+
+from utils.hypergeometric import HypergeometricEngine
+
+
+def simulate_tables(n_genes: int, n_significant: int, n_terms: int, seed: int) -> np.ndarray:
+    """
+    Simulate a 2x2 contingency table for a number of HPO terms.
+
+    :parameters
+    -----------
+    n_genes - int
+        Number of genes in the gene universe
+    n_significant - int
+        Number of significant genes
+    n_terms - int
+        Number of HPO terms
+    seed - int
+        Seed of the random number generator
+
+    :returns
+    --------
+    tables - np.ndarray
+        Array of shape (n_terms, 2, 2)
+    """
+    rng = np.random.default_rng(seed)
+    term_sizes = np.minimum(rng.geometric(1 / 200, size=n_terms), n_genes)
+    # Number of significant genes that are annotated to every HPO term
+    yes_yes = rng.hypergeometric(n_significant, n_genes - n_significant, term_sizes)
+
+    tables = np.empty((n_terms, 2, 2), dtype=np.int64)
+    tables[:, 1, 1] = yes_yes
+    tables[:, 0, 1] = term_sizes - yes_yes
+    tables[:, 1, 0] = n_significant - yes_yes
+    tables[:, 0, 0] = n_genes - n_significant - tables[:, 0, 1]
+    return tables
+
+
+def loop_fisher_exact(tables: np.ndarray):
+    """
+    Perform the fisher's exact tests one table at a time with scipy.
+
+    :parameters
+    -----------
+    tables - np.ndarray
+        Array of shape (n, 2, 2)
+
+    :returns
+    --------
+    odds_ratios - np.ndarray
+        Odds ratios
+    p_values - np.ndarray
+        P values
+    """
+    results = np.array([stats.fisher_exact(table) for table in tables], dtype=np.float64)
+    return results[:, 0], results[:, 1]
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__),
+        description="Benchmark the vectorized fisher's exact test engine.")
+    parser.add_argument("--genes", type=int, default=20000, help="Number of genes")
+    parser.add_argument("--significant", type=int, default=500,
+                        help="Number of significant genes")
+    parser.add_argument("--terms", type=int, default=5000, help="Number of HPO terms")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    tables = simulate_tables(args.genes, args.significant, args.terms, args.seed)
+
+    start = time.perf_counter()
+    loop_odds, loop_pvals = loop_fisher_exact(tables)
+    loop_time = time.perf_counter() - start
+
+    engine = HypergeometricEngine()
+    start = time.perf_counter()
+    odds, pvals, _ = engine.fisher_exact(tables)
+    engine_time = time.perf_counter() - start
+
+    np.testing.assert_allclose(odds, loop_odds, rtol=1e-12)
+    # P values that are subnormal in scipy lose precision, so only compare normal numbers
+    normal = loop_pvals > np.finfo(np.float64).tiny
+    np.testing.assert_allclose(pvals[normal], loop_pvals[normal], rtol=1e-6)
+
+    print(f"tables: {args.terms}, genes: {args.genes}, significant genes: {args.significant}")
+    print(f"scipy.stats.fisher_exact loop: {loop_time:.3f}s")
+    print(f"HypergeometricEngine: {engine_time:.3f}s ({loop_time / engine_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Benchmark suite for the performance critical parts of the fisher exact tests:
+loading the HPO database, the overlap with the HPO database, the contingency tables,
+the fisher's exact tests, reading and filtering the output of every prioritization
+method and preparing the GWAS summary statistics for VEGAS.
+
+The benchmarks run on synthetic data (see synthetic_data.py) of a given scale. For
+every benchmark the wall time (median of a number of repeats) and the peak memory
+allocated by python and numpy (tracemalloc) are stored as JSON, which can be
+compared with a saved baseline.
+
+Example:
+    python benchmark_suite.py --scale small -o baseline.json
+    python benchmark_suite.py --scale small -o current.json --baseline baseline.json
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import pandas as pd
+
+
+root_dir = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir))
+
+gwas_dir = os.path.abspath(os.path.join(
+                  root_dir,
+                  os.pardir,
+                  "prioritization_methods",
+                  "NetWAS",
+                  "process_GWAS_data"))
+
+sys.path.insert(0, root_dir)
+sys.path.insert(0, gwas_dir)
+
+from utils.fisher import HPO, FisherTest
+from utils.prioritization_methods import Depict, Downstreamer, Magma, NetWAS, PoPs
+from process_GWAS_data import ExtractVEGASColumns, PrepGWASData
+from synthetic_data import SCALES, Scale, SyntheticData
+
+
+METHODS = {"NetWAS": NetWAS, "PoPs": PoPs, "DEPICT": Depict,
+           "Downstreamer": Downstreamer, "MAGMA": Magma}
+
+# Differences in wall time below this number of seconds are not seen as a regression
+NOISE_FLOOR = 0.005
+
+
+@dataclass
+class Benchmark:
+    """
+    A benchmark.
+
+    :attributes
+    -----------
+    name - str
+        Name of the benchmark, <group>/<name>
+    run - Callable
+        Function that is timed, it should give the same result every time it is called
+    """
+
+    name: str
+    run: Callable[[], object]
+
+
+def measure(function: Callable[[], object], repeat: int) -> dict:
+    """
+    Measure the wall time and peak memory of a function. The function is timed
+    repeat times, after which it is run once more with tracemalloc, so the tracing
+    does not slow down the timed runs.
+
+    :parameters
+    -----------
+    function - Callable
+        Function to measure
+    repeat - int
+        Number of timed runs
+
+    :returns
+    --------
+    result - dict
+        seconds (median), min_seconds, repeat and peak_memory_mb
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(times), "min_seconds": min(times),
+            "repeat": repeat, "peak_memory_mb": peak / 1024 ** 2}
+
+
+class BenchmarkSuite:
+    """
+    Benchmarks of the fisher exact test scripts on a set of synthetic input files.
+    """
+
+    def __init__(self, data: SyntheticData, files: dict) -> None:
+        self.data = data
+        self.files = files
+        self.fisher = FisherTest()
+        # The HPO cache is built once, the benchmarks of the later steps use the
+        # memory-mapped HPO data like the scripts do
+        self.hpo = HPO(files["hpo_database"])
+        self.hpo_info = pd.read_csv(files["hpo_info"], sep=",")
+        self.methods = {name: method(self.hpo, self.fisher) for name, method in METHODS.items()}
+        self.method_data = {name: [self.methods[name].read_data(file)
+                                   for file in files["methods"][name].values()]
+                            for name in METHODS}
+
+        magma = self.methods["MAGMA"]
+        data, genes = self.method_data["MAGMA"][0]
+        self.overlap_hpo, self.overlap_genes, _ = magma.get_overlap(self.hpo.hpo_data, genes,
+                                                                    self.hpo_info["HPO ID"])
+        overlap_data = magma.get_overlap_genes(data, self.overlap_genes)
+        _, self.significant_genes = magma.filter_data(overlap_data)
+
+    def get_benchmarks(self) -> List[Benchmark]:
+        """
+        Get all benchmarks.
+        """
+        benchmarks = [
+            Benchmark("hpo/load_database", lambda: HPO(self.files["hpo_database"],
+                                                      use_cache=False)),
+            Benchmark("hpo/load_cached", lambda: HPO(self.files["hpo_database"])),
+            Benchmark("fisher/get_overlap", self.get_overlap),
+            Benchmark("fisher/create_fisher_table", self.create_fisher_tables),
+            Benchmark("fisher/perform_fisher_exact_tests", self.perform_fisher_exact_tests),
+        ]
+        for name in METHODS:
+            benchmarks.append(Benchmark(f"read_data/{name}",
+                                        lambda name=name: self.read_data(name)))
+            benchmarks.append(Benchmark(f"filter_data/{name}",
+                                        lambda name=name: self.filter_data(name)))
+        benchmarks.append(Benchmark("prep_gwas/PrepGWASData", self.prep_gwas))
+        return benchmarks
+
+    def get_overlap(self) -> None:
+        """
+        Get the overlap of the output of every method with the HPO database.
+        """
+        for name, method in self.methods.items():
+            for _, genes in self.method_data[name]:
+                method.get_overlap(self.hpo.hpo_data, genes)
+
+    def create_fisher_tables(self) -> None:
+        """
+        Create the contingency table of every HPO term of the HPO info file one at
+        a time, like the single test script.
+        """
+        for hpo_term in self.hpo_info["HPO ID"]:
+            _, hpo_genes = self.hpo.get_data_hpo_term(self.overlap_hpo, hpo_term)
+            self.fisher.create_fisher_table(self.overlap_genes, self.significant_genes,
+                                            hpo_genes)
+
+    def perform_fisher_exact_tests(self) -> None:
+        """
+        Perform the fisher's exact tests of all HPO terms of the HPO info file.
+        """
+        self.fisher.perform_fisher_exact_tests(self.overlap_hpo, self.significant_genes,
+                                               self.hpo_info)
+
+    def read_data(self, name: str) -> None:
+        """
+        Read the output files of a method for all traits.
+        """
+        method = self.methods[name]
+        for file in self.files["methods"][name].values():
+            method.read_data(file)
+
+    def filter_data(self, name: str) -> None:
+        """
+        Filter the output of a method for all traits with the default threshold.
+        """
+        method = self.methods[name]
+        for data, _ in self.method_data[name]:
+            method.filter_data(data)
+
+    def prep_gwas(self) -> None:
+        """
+        Prepare the GWAS summary statistics of all traits for VEGAS.
+        """
+        vegas = ExtractVEGASColumns()
+        for file in self.files["gwas"].values():
+            PrepGWASData(file, vegas, "SNP", "P")
+
+    def run(self, patterns: Optional[List[str]] = None, repeat: int = 3) -> Dict[str, dict]:
+        """
+        Run the benchmarks.
+
+        :parameters
+        -----------
+        patterns - List[str]
+            Only run the benchmarks matching one of these patterns (e.g. 'read_data/*')
+        repeat - int
+            Number of timed runs of every benchmark
+
+        :returns
+        --------
+        results - Dict[str, dict]
+            Name of the benchmark -> result of measure
+        """
+        results = {}
+        for benchmark in self.get_benchmarks():
+            if patterns and not any(fnmatch.fnmatch(benchmark.name, pattern)
+                                    for pattern in patterns):
+                continue
+            results[benchmark.name] = measure(benchmark.run, repeat)
+            result = results[benchmark.name]
+            print(f"{benchmark.name:<40} {result['seconds']:>10.4f} s "
+                  f"{result['peak_memory_mb']:>10.1f} MB")
+        return results
+
+
+def prepare_data(directory: Path, scale: Scale, seed: int) -> tuple:
+    """
+    Write the synthetic data, or reuse it if the directory contains the data of
+    the same scale and seed.
+
+    :parameters
+    -----------
+    directory - Path
+        Directory of the synthetic data
+    scale - Scale
+        Size of the data
+    seed - int
+        Seed of the random number generator
+
+    :returns
+    --------
+    data - SyntheticData
+        The synthetic data
+    files - dict
+        The input files (see SyntheticData.write)
+    """
+    data = SyntheticData(directory, scale, seed)
+    marker = Path(directory) / "scale.json"
+    settings = {"scale": scale.to_dict(), "seed": seed}
+    try:
+        with open(marker, 'r', encoding="utf-8") as stream:
+            reuse = json.load(stream) == settings
+    except (OSError, ValueError):
+        reuse = False
+
+    if reuse:
+        files = {"hpo_database": data.hpo_database, "hpo_info": data.hpo_info,
+                 "methods": {method: {trait: data.get_method_file(method, trait)
+                                      for trait in data.traits}
+                             for method in METHODS},
+                 "gwas": {trait: data.get_gwas_file(trait) for trait in data.traits}}
+        return data, files
+
+    print(f"Writing synthetic data to {directory}: {settings['scale']}")
+    start = time.perf_counter()
+    files = data.write()
+    with open(marker, 'w', encoding="utf-8") as stream:
+        json.dump(settings, stream)
+    print(f"Wrote synthetic data in {time.perf_counter() - start:.1f} s")
+    return data, files
+
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compare the results with a baseline and print the ratios.
+
+    :parameters
+    -----------
+    results - Dict[str, dict]
+        Results of the benchmarks
+    baseline - dict
+        Saved output of an earlier run
+    tolerance - float
+        Allowed relative increase of the wall time and peak memory
+
+    :returns
+    --------
+    regressions - List[str]
+        Names of the benchmarks that got slower or use more memory
+    """
+    print(f"\n{'benchmark':<40} {'time':>10} {'memory':>10}")
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"{name:<40} {'new':>10}")
+            continue
+        time_ratio = result["seconds"] / max(previous["seconds"], 1e-9)
+        memory_ratio = result["peak_memory_mb"] / max(previous["peak_memory_mb"], 1e-9)
+        slower = time_ratio > 1 + tolerance \
+            and result["seconds"] - previous["seconds"] > NOISE_FLOOR
+        larger = memory_ratio > 1 + tolerance \
+            and result["peak_memory_mb"] - previous["peak_memory_mb"] > 1
+        flag = " <- regression" if slower or larger else ""
+        print(f"{name:<40} {time_ratio:>9.2f}x {memory_ratio:>9.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    """
+    Run the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__),
+        description="Benchmark the fisher exact test scripts on synthetic data.")
+    parser.add_argument("--scale", choices=SCALES, default="small",
+                        help="Size of the synthetic data, default = small")
+    parser.add_argument("--genes", type=int, help="Number of genes, overrides the scale")
+    parser.add_argument("--terms", type=int, help="Number of HPO terms, overrides the scale")
+    parser.add_argument("--snps", type=int, help="Number of SNPs, overrides the scale")
+    parser.add_argument("--traits", type=int, help="Number of traits, overrides the scale")
+    parser.add_argument("-b", "--benchmarks", nargs="+",
+                        help="Only run the benchmarks matching these patterns, e.g. 'hpo/*'")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of timed runs of every benchmark, default = 3")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative increase compared to the baseline, default = 0.2")
+    parser.add_argument("--data-dir",
+                        help="Directory to keep the synthetic data in, so it can be reused. "
+                             "Default = a temporary directory")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+
+    overrides = {key: getattr(args, key) for key in ("genes", "terms", "snps", "traits")
+                 if getattr(args, key) is not None}
+    scale = replace(SCALES[args.scale], **overrides)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding="utf-8") as stream:
+            baseline = json.load(stream)
+
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp())
+    try:
+        data, files = prepare_data(data_dir, scale, args.seed)
+        suite = BenchmarkSuite(data, files)
+        results = suite.run(args.benchmarks, args.repeat)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = {"date": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "pandas": pd.__version__,
+              "platform": platform.platform(),
+              "scale": scale.to_dict(),
+              "seed": args.seed,
+              "repeat": args.repeat,
+              "results": results}
+    if args.output is not None:
+        with open(args.output, 'w', encoding="utf-8") as stream:
+            json.dump(output, stream, indent=2)
+
+    if baseline is not None:
+        if baseline.get("scale") != output["scale"]:
+            print("Warning: the baseline was run at another scale")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed more than "
+                  f"{args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
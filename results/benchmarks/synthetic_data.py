@@ -0,0 +1,225 @@
+"""
+Generate synthetic input files for the benchmarks, in the same layout as the real
+inputs: the gzipped HPO database, the HPO info file, the output files of every
+prioritization method and GWAS summary statistics.
+
+The size of the data is set by a Scale (number of genes, HPO terms, SNPs and
+traits), so the benchmarks can be run from a quick check up to the size of the
+real data.
+"""
+
+import gzip
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Scale:
+    """
+    Size of the synthetic data.
+
+    :attributes
+    -----------
+    genes - int
+        Number of genes in the HPO database
+    terms - int
+        Number of HPO terms in the HPO database
+    snps - int
+        Number of SNPs in every GWAS summary statistics file
+    traits - int
+        Number of traits, every trait has an output file per method and a GWAS
+        summary statistics file
+    """
+
+    genes: int
+    terms: int
+    snps: int
+    traits: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+SCALES = {
+    "small": Scale(genes=2_000, terms=500, snps=100_000, traits=2),
+    "medium": Scale(genes=10_000, terms=2_000, snps=1_000_000, traits=4),
+    "large": Scale(genes=20_000, terms=10_000, snps=5_000_000, traits=8),
+}
+
+# Output file of every prioritization method, see utils/readers.py
+METHOD_FILES = {
+    "NetWAS": "{trait}_netwas.csv",
+    "PoPs": "{trait}.preds",
+    "DEPICT": "{trait}_genenetwork_enrichment.txt",
+    "Downstreamer": "{trait}_enrichtments.xlsx",
+    "MAGMA": "{trait}.genes.out",
+}
+
+
+def get_gene_ids(numbers: np.ndarray) -> np.ndarray:
+    """
+    Create ensembl gene IDs from numbers.
+    """
+    return np.char.add("ENSG", np.char.zfill(numbers.astype(str), 11))
+
+
+class SyntheticData:
+    """
+    Writes the synthetic input files of one scale to a directory.
+    """
+
+    def __init__(self, directory: Path, scale: Scale, seed: int = 42) -> None:
+        self.directory = Path(directory)
+        self.scale = scale
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        # The methods also report genes that are not inside the HPO database
+        self.genes = get_gene_ids(np.arange(scale.genes))
+        self.method_genes = get_gene_ids(np.arange(int(scale.genes * 1.2)))
+        self.terms = np.char.add("HP:", np.char.zfill(np.arange(scale.terms).astype(str), 7))
+
+    @property
+    def hpo_database(self) -> Path:
+        return self.directory / "hpo_database.txt.gz"
+
+    @property
+    def hpo_info(self) -> Path:
+        return self.directory / "hpo_info.csv"
+
+    @property
+    def traits(self) -> List[str]:
+        return [f"trait_{index}" for index in range(self.scale.traits)]
+
+    def get_method_file(self, method: str, trait: str) -> Path:
+        return self.directory / method / METHOD_FILES[method].format(trait=trait)
+
+    def get_gwas_file(self, trait: str) -> Path:
+        return self.directory / "GWAS" / f"{trait}_sumstats.txt"
+
+    def write(self) -> Dict[str, object]:
+        """
+        Write all the input files.
+
+        :returns
+        --------
+        files - Dict[str, object]
+            hpo_database, hpo_info, methods (method -> trait -> file) and
+            gwas (trait -> file)
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.write_hpo_database()
+        self.write_hpo_info()
+        methods = {method: {} for method in METHOD_FILES}
+        gwas = {}
+        for trait in self.traits:
+            for method in METHOD_FILES:
+                file = self.get_method_file(method, trait)
+                file.parent.mkdir(exist_ok=True)
+                self.write_method_file(method, file)
+                methods[method][trait] = file
+            gwas[trait] = self.get_gwas_file(trait)
+            gwas[trait].parent.mkdir(exist_ok=True)
+            self.write_gwas_file(gwas[trait])
+        return {"hpo_database": self.hpo_database, "hpo_info": self.hpo_info,
+                "methods": methods, "gwas": gwas}
+
+    def write_hpo_database(self) -> None:
+        """
+        Write the gzipped gene x term matrix of the HPO database. Every term is
+        annotated to a geometrically distributed number of genes, like the real
+        database most terms have few genes. The lines have a fixed width, so the
+        text is created as one byte array instead of formatting every value.
+        """
+        n_genes, n_terms = self.scale.genes, self.scale.terms
+        term_sizes = np.minimum(self.rng.geometric(1 / 50, size=n_terms), n_genes)
+        matrix = np.zeros((n_genes, n_terms), dtype=np.uint8)
+        for term, size in enumerate(term_sizes):
+            matrix[self.rng.choice(n_genes, size, replace=False), term] = 1
+
+        gene_width = len(self.genes[0])
+        lines = np.full((n_genes, gene_width + 2 * n_terms + 1), ord("\t"), dtype=np.uint8)
+        lines[:, :gene_width] = np.frombuffer(self.genes.astype(f"S{gene_width}").tobytes(),
+                                              dtype=np.uint8).reshape(n_genes, gene_width)
+        lines[:, gene_width + 1:-1:2] = matrix + ord("0")
+        lines[:, -1] = ord("\n")
+
+        with gzip.open(self.hpo_database, 'wb', compresslevel=1) as stream:
+            stream.write(("\t".join(["-"] + list(self.terms)) + "\n").encode("utf-8"))
+            stream.write(lines.tobytes())
+
+    def write_hpo_info(self) -> None:
+        """
+        Write the HPO info file: a number of HPO terms per trait.
+        """
+        n_rows = min(self.scale.terms, 50)
+        terms = self.rng.choice(self.terms, n_rows, replace=False)
+        hpo_info = pd.DataFrame({"GWAS trait": [self.traits[index % len(self.traits)]
+                                                for index in range(n_rows)],
+                                 "Related HPO term": [f"term {term}" for term in terms],
+                                 "HPO ID": terms})
+        hpo_info.to_csv(self.hpo_info, index=False)
+
+    def write_method_file(self, method: str, file: Path) -> None:
+        """
+        Write the output file of a prioritization method for one trait.
+
+        :parameters
+        -----------
+        method - str
+            Name of the prioritization method (key of METHOD_FILES)
+        file - Path
+            Output file
+        """
+        genes = self.rng.permutation(self.method_genes)
+        p_values = self.rng.beta(0.3, 1, size=len(genes))
+        scores = self.rng.normal(size=len(genes))
+
+        if method == "NetWAS":
+            data = pd.DataFrame({"gene_symbol": np.char.add("SYMBOL", genes.astype(str)),
+                                 "ensemble_id": genes, "netwas_score": self.rng.random(len(genes))})
+            data.to_csv(file, index=False)
+        elif method == "PoPs":
+            data = pd.DataFrame({"ENSGID": genes, "PoPS_Score": scores,
+                                 "projection": scores})
+            data.to_csv(file, sep="\t", index=False)
+        elif method == "DEPICT":
+            data = pd.DataFrame({"Ensembl Gene ID": genes, "Gene symbol": genes,
+                                 "Nominal P value": p_values,
+                                 "False discovery rate < 5%": np.where(p_values < 0.01,
+                                                                        "Yes", "No")})
+            # The real DEPICT output has whitespace around its column names
+            data.columns = [f"{name} " for name in data.columns]
+            data.to_csv(file, sep="\t", index=False)
+        elif method == "Downstreamer":
+            data = pd.DataFrame({"Gene ID": genes, "Gene symbol": genes,
+                                 "Enrichment Z-score": scores,
+                                 "FDR 5% significant": scores > 2})
+            with pd.ExcelWriter(file, engine="openpyxl") as writer:
+                data.to_excel(writer, sheet_name="GenePrioritization", index=False)
+        elif method == "MAGMA":
+            data = pd.DataFrame({"GENE": genes, "CHR": self.rng.integers(1, 23, len(genes)),
+                                 "NSNPS": self.rng.integers(1, 500, len(genes)),
+                                 "ZSTAT": scores, "P": p_values})
+            file.write_text(data.to_string(index=False) + "\n", encoding="utf-8")
+        else:
+            raise KeyError(f"Unknown prioritization method: {method}")
+
+    def write_gwas_file(self, file: Path) -> None:
+        """
+        Write GWAS summary statistics. Some SNPs have no rs ID or p value, so
+        they are removed by PrepGWASData.
+        """
+        n_snps = self.scale.snps
+        snps = np.char.add("rs", self.rng.integers(1, 10 ** 9, n_snps).astype(str))
+        other = self.rng.random(n_snps) < 0.05
+        snps[other] = np.char.add("chr1:", np.arange(np.count_nonzero(other)).astype(str))
+        p_values = self.rng.random(n_snps)
+        p_values[self.rng.random(n_snps) < 0.01] = np.nan
+        data = pd.DataFrame({"SNP": snps, "CHR": self.rng.integers(1, 23, n_snps),
+                             "BP": self.rng.integers(1, 2.5e8, n_snps),
+                             "EA": "A", "NEA": "G", "BETA": self.rng.normal(size=n_snps),
+                             "P": p_values})
+        data.to_csv(file, sep="\t", index=False)
@@ -47,14 +47,48 @@ class ArgumentParser:
                            help="Location of the configuration file.")
 
         parser.add_argument("-m", "--method", action="store",
-                           dest="m", required=True, choices=["NetWAS", "PoPs", "DEPICT",
-                           "MAGMA", "Downstreamer"],
-                           help="Name of the prioritization method")
+                           dest="m", required=True,
+                           help="Name of the prioritization method: NetWAS, PoPs, DEPICT,"\
+                               " MAGMA, Downstreamer or a method from the readers section of"\
+                               " the config file. 'all' processes every method in the"\
+                               " results_methods section of the config file")
+
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                           help="Number of (method, trait) combinations processed in parallel,"\
+                               " default = 1")
 
         parser.add_argument("-o", '--output', dest='o',
                         help="Location where the output files need to be stored.",
                         required=True)
 
+        parser.add_argument("--permutations", dest="permutations", type=int, default=0,
+                        help="Number of random gene sets used to calculate empirical p values,"\
+                            " default = 0 (no empirical p values)")
+
+        parser.add_argument("--seed", dest="seed", type=int, default=None,
+                        help="Seed used to draw the random gene sets, default = None")
+
+        parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="Number of processes used to draw the random gene sets, only used"\
+                            " when --jobs is 1, default = 1")
+
+        parser.add_argument("--sweep", dest="sweep", choices=["top_k", "threshold"], default=None,
+                        help="Also evaluate many cutoffs of the method at once, either the number"\
+                            " of top ranked genes or score thresholds, default = None")
+
+        parser.add_argument("--sweep-points", dest="sweep_points", type=int, default=1000,
+                        help="Number of cutoffs evaluated by the sweep, default = 1000")
+
+        parser.add_argument("--no-cache", dest="no_cache", action="store_true",
+                        help="Do not use the result cache, recompute all results.")
+
+        parser.add_argument("--cache-dir", dest="cache_dir",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "benchmark-gwas-prio"),
+                        help="Location of the result cache, default = ~/.cache/benchmark-gwas-prio")
+
+        parser.add_argument("--cache-size", dest="cache_size", type=int, default=1024,
+                        help="Maximum size of the result cache in MB, default = 1024")
+
         parser.add_argument('-v',
             '--version',
             help='Displays the version number of the script and exitst',
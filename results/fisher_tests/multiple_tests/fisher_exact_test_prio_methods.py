@@ -4,9 +4,10 @@ Perform multiple fisher exact tests for a number of prioritization methods.
 
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 # from dataclasses import dataclass
 from pathlib import Path
-# import numpy as np
+import numpy as np
 import pandas as pd
 # from scipy import stats
 # import scipy.stats as stats
@@ -20,8 +21,12 @@ root_dir = os.path.abspath(os.path.join(
 
 sys.path.insert(0, root_dir)
 
-from utils.prioritization_methods import Downstreamer, Magma, Depict, PoPs, NetWAS
+from utils.prioritization_methods import Downstreamer, Magma, Depict, PoPs, NetWAS, SchemaMethod
+from utils.readers import READERS, ReaderSchema, register_reader
 from utils.fisher import HPO, FisherTest
+from utils.gene_mapping import SymbolIndex
+from utils.permutation import PermutationTest
+from utils.result_cache import ResultCache
 from arg_parser import ArgumentParser, CLIArgValidator
 
 
@@ -30,6 +35,14 @@ __version__ = "v0.1"
 __data__ = "9-8-2022"
 
 
+METHODS = {"NetWAS": NetWAS, "PoPs": PoPs, "DEPICT": Depict,
+           "Downstreamer": Downstreamer, "MAGMA": Magma}
+
+# HPO database and gene symbol index of a worker process, see init_worker
+WORKER_HPO = None
+WORKER_SYMBOL_INDEX = None
+
+
 def get_config(file: Path) -> dict:
     """
     Read in config file and return it as a dictionary.
@@ -53,6 +66,52 @@ def get_config(file: Path) -> dict:
     return config
 
 
+def register_readers(readers: dict) -> None:
+    """
+    Add the prioritization methods from the readers section of the config file to
+    the reader registry.
+
+    :parameter
+    ----------
+    readers - dict
+        Name of the method -> arguments of ReaderSchema
+    """
+    for name, spec in readers.items():
+        spec = dict(spec)
+        if spec.get("columns") is not None:
+            spec["columns"] = tuple(spec["columns"])
+        register_reader(name, ReaderSchema(**spec))
+
+
+def get_method(method: str, hpo, fisher, symbol_index=None):
+    """
+    Create a prioritization method, methods without their own class are created from
+    their reader schema.
+
+    :parameter
+    ----------
+    method - str
+        Name of the prioritization method
+    hpo - HPO
+        HPO database
+    fisher - FisherTest
+        Fisher test
+    symbol_index - SymbolIndex
+        Index used to map the gene symbols of the NetWAS results, None if the
+        results already contain ensembl gene IDs
+
+    :returns
+    --------
+    method_instance - PrioritizationMethod
+        The prioritization method
+    """
+    if method == "NetWAS":
+        return NetWAS(hpo=hpo, fisher=fisher, symbol_index=symbol_index)
+    if method in METHODS:
+        return METHODS[method](hpo=hpo, fisher=fisher)
+    return SchemaMethod(hpo=hpo, fisher=fisher, schema=method)
+
+
 def read_hpo_info(hpo_info: pd.DataFrame) -> pd.DataFrame:
     """
     Read in a CSV file containing information about HPO terms
@@ -67,6 +126,51 @@ def read_hpo_info(hpo_info: pd.DataFrame) -> pd.DataFrame:
     return hpo_info_data
 
 
+def read_covariate(file: Path) -> pd.Series:
+    """
+    Read in a tab seperated file containing a covariate (e.g. gene length) per gene.
+    The first column should contain the ensembl gene IDs and the second column the values.
+
+    :parameter
+    ----------
+    file - Path
+        File containing the covariate
+
+    :returns
+    --------
+    covariate - pd.Series
+        Covariate values indexed by ensembl gene ID
+    """
+    covariate = pd.read_csv(file, sep="\t", index_col=0).iloc[:, 0]
+    return covariate
+
+
+def get_sweep_cutoffs(data: pd.DataFrame, method_instance, sweep: str, n_points: int) -> dict:
+    """
+    Get evenly spaced cutoffs for a sweep over the results of a prioritization method.
+
+    :parameters
+    -----------
+    data - pd.DataFrame
+        Results of a prioritization method
+    method_instance - PrioritizationMethod
+        The prioritization method
+    sweep - str
+        Type of sweep: 'top_k' or 'threshold'
+    n_points - int
+        Maximum number of cutoffs
+
+    :returns
+    --------
+    cutoffs - dict
+        Keyword argument (top_k or thresholds) for PrioritizationMethod.sweep
+    """
+    if sweep == "top_k":
+        return {"top_k": np.unique(np.linspace(1, data.shape[0], n_points).round().astype(int))}
+    scores = data[method_instance.score_column].dropna()
+    return {"thresholds": np.unique(np.quantile(scores, np.linspace(0, 1, n_points)))}
+
+
 def make_out_dir(path: Path) -> None:
     """
     Create a directory (if it does not exsit yet) to store the
@@ -102,6 +206,233 @@ def write_out_data(data: pd.DataFrame, file: Path) -> None:
     data.to_csv(file, sep="\t")
 
 
+def get_cache_key(method_instance, file: Path, hpo_info_data: pd.DataFrame,
+                  options: dict):
+    """
+    Create the key of the results of a prioritization method for one trait inside
+    the result cache.
+
+    :parameters
+    -----------
+    method_instance - PrioritizationMethod
+        The prioritization method
+    file - Path
+        Results of the prioritization method for a trait
+    hpo_info_data - pd.DataFrame
+        Information about the HPO terms that should be tested
+    options - dict
+        Settings of the permutation test and the sweep
+
+    :returns
+    --------
+    key - str or None
+        Cache key, None if the results can not be cached (random permutations without seed)
+    """
+    permutation_test = options["permutation_test"]
+    if permutation_test is not None and permutation_test.seed is None:
+        return None
+
+    covariate = options["covariate"]
+    return ResultCache.make_key(
+        method=type(method_instance).__name__,
+        schema=repr(method_instance.schema),
+        gene_mapping=None if getattr(method_instance, "symbol_index", None) is None else
+            method_instance.symbol_index.get_checksum(),
+        method_file=ResultCache.hash_file(file),
+        hpo_data=method_instance.hpo.get_checksum(),
+        threshold=method_instance.get_default_threshold(),
+        hpo_info=ResultCache.hash_data_frame(hpo_info_data),
+        permutations=None if permutation_test is None else
+            [permutation_test.n_permutations, permutation_test.seed],
+        covariate=None if covariate is None else
+            ResultCache.hash_data_frame(covariate.reset_index()),
+        sweep=[options["sweep"], options["sweep_points"]] if options["sweep"] else None)
+
+
+def process_trait(method_instance, file: Path, hpo_info_data: pd.DataFrame,
+                  out_dir: Path, options: dict) -> None:
+    """
+    Perform the fisher exact tests for the results of a prioritization method
+    on one trait and write out the results. Results of unchanged inputs are
+    taken from the result cache (if enabled).
+
+    :parameters
+    -----------
+    method_instance - PrioritizationMethod
+        The prioritization method
+    file - Path
+        Results of the prioritization method for a trait
+    hpo_info_data - pd.DataFrame
+        Information about the HPO terms that should be tested
+    out_dir - Path
+        Directory where the results are written to
+    options - dict
+        Settings of the permutation test (permutation_test, covariate), the
+        sweep (sweep, sweep_points) and the result cache (result_cache)
+    """
+    result_cache = options["result_cache"]
+    key = None
+    cached = None
+    if result_cache is not None:
+        key = get_cache_key(method_instance, file, hpo_info_data, options)
+        if key is not None:
+            cached = result_cache.get(key)
+
+    if cached is not None:
+        print(f"Using cached results for: {file}")
+        fish_results, sweep_results = cached
+    else:
+        fish_results, sweep_results = compute_trait(method_instance, file,
+                                                    hpo_info_data, options)
+        if key is not None:
+            result_cache.put(key, (fish_results, sweep_results))
+
+    out_file = out_dir / ("fisher_result_" + file.stem + ".csv")
+
+    write_out_data(fish_results, out_file)
+
+    if sweep_results is not None:
+        write_out_data(sweep_results, out_dir / ("sweep_result_" + file.stem + ".csv"))
+
+
+def compute_trait(method_instance, file: Path, hpo_info_data: pd.DataFrame,
+                  options: dict):
+    """
+    Perform the fisher exact tests (and optionally the sweep) for the results
+    of a prioritization method on one trait.
+
+    :parameters
+    -----------
+    method_instance - PrioritizationMethod
+        The prioritization method
+    file - Path
+        Results of the prioritization method for a trait
+    hpo_info_data - pd.DataFrame
+        Information about the HPO terms that should be tested
+    options - dict
+        Settings of the permutation test and the sweep
+
+    :returns
+    --------
+    fish_results - pd.DataFrame
+        Results of the fisher exact tests
+    sweep_results - pd.DataFrame or None
+        Results of the sweep, None if no sweep was requested
+    """
+    hpo = method_instance.hpo
+
+    method_data, genes = method_instance.read_data(file)
+
+    overlap_hpo, overlap_genes, _ = method_instance.get_overlap(hpo.hpo_data, genes,
+                                                                hpo_info_data["HPO ID"])
+
+    overlap_method = method_instance.get_overlap_genes(method_data, overlap_genes)
+
+    _, sig_genes = method_instance.filter_data(overlap_method)
+
+    fish_results = method_instance.fisher.perform_fisher_exact_tests(overlap_hpo,
+                                sig_genes, hpo_info_data, options["permutation_test"],
+                                options["covariate"])
+
+    sweep_results = None
+    if options["sweep"]:
+        cutoffs = get_sweep_cutoffs(overlap_method, method_instance, options["sweep"],
+                                    options["sweep_points"])
+        sweep_results = method_instance.sweep(overlap_method, overlap_hpo,
+                                              hpo_info_data["HPO ID"], **cutoffs)
+    return fish_results, sweep_results
+
+
+def get_jobs(config: dict, method: str) -> list:
+    """
+    Get all combinations of prioritization methods and traits that need to be processed.
+
+    :parameters
+    -----------
+    config - dict
+        Configuration file in dictionary form
+    method - str
+        Name of the prioritization method, or 'all' to process all methods
+        specified in the results_methods section of the config file
+
+    :returns
+    --------
+    jobs - list
+        Tuples of (method, trait, file)
+    """
+    if method != "all":
+        if method not in READERS:
+            raise ValueError(f"Unknown prioritization method: {method}")
+        return [(method, trait, Path(file)) for trait, file in config["traits"].items()]
+
+    method_names = {name.lower(): name for name in READERS}
+    jobs = []
+    for trait, results in config["results_methods"].items():
+        for name, file in results.items():
+            if name.lower() not in method_names:
+                raise ValueError(f"Unknown prioritization method in the config file: {name}")
+            jobs.append((method_names[name.lower()], trait, Path(file)))
+    return jobs
+
+
+def get_symbol_index(config: dict):
+    """
+    Load the gene symbol index of the mapping dump in the gene_mapping section of
+    the config file.
+
+    :parameters
+    -----------
+    config - dict
+        Configuration file in dictionary form
+
+    :returns
+    --------
+    symbol_index - SymbolIndex or None
+        The loaded index, None if no mapping dump is specified
+    """
+    gene_mapping = config.get("gene_mapping")
+    if not gene_mapping:
+        return None
+    if isinstance(gene_mapping, str):
+        gene_mapping = {"source": gene_mapping}
+    return SymbolIndex(**gene_mapping).load()
+
+
+def init_worker(hpo_data: str, readers: dict, config: dict) -> None:
+    """
+    Load the HPO database once inside a worker process. The database is memory-mapped
+    from the HPO cache, so all workers share the same read-only copy.
+
+    :parameters
+    -----------
+    hpo_data - str
+        Location of the HPO database
+    readers - dict
+        Readers section of the config file
+    config - dict
+        Configuration file in dictionary form, used to load the gene symbol index
+    """
+    global WORKER_HPO, WORKER_SYMBOL_INDEX
+    register_readers(readers)
+    WORKER_HPO = HPO(database=hpo_data)
+    WORKER_SYMBOL_INDEX = get_symbol_index(config)
+
+
+def run_job(method: str, trait: str, file: Path, hpo_info_data: pd.DataFrame,
+            out_dir: Path, options: dict) -> str:
+    """
+    Process a single (method, trait) combination inside a worker process.
+
+    :returns
+    --------
+    job - str
+        Description of the processed job
+    """
+    method_instance = get_method(method, WORKER_HPO, FisherTest(), WORKER_SYMBOL_INDEX)
+    process_trait(method_instance, file, hpo_info_data, out_dir / method, options)
+    return f"{method} - {trait}"
+
+
 def main():
     """
     Run the program.
@@ -111,45 +442,59 @@ def main():
     config_file = arg_parse.get_argument("c")
     method = arg_parse.get_argument("m")
     output_dir = arg_parse.get_argument("o")
+    n_permutations = arg_parse.get_argument("permutations")
+    n_jobs = arg_parse.get_argument("jobs")
 
     cli_validator = CLIArgValidator()
     cli_validator.validate_input_file(config_file)
 
     config = get_config(Path(config_file))
+    register_readers(config.get("readers", {}))
 
-    out_dir = Path(output_dir) / method
+    jobs = get_jobs(config, method)
 
-    make_out_dir(out_dir)
+    for job_method in sorted({job[0] for job in jobs}):
+        make_out_dir(Path(output_dir) / job_method)
 
     hpo_data = config["hpo_data"]
     hpo_info_data = read_hpo_info(Path(config["hpo_info"]))
 
-    methods = {"NetWAS": NetWAS, "PoPs": PoPs, "DEPICT": Depict,
-                "Downstreamer": Downstreamer, "MAGMA":Magma}
-
+    # Load the HPO database once, this also builds the HPO cache used by the workers
     hpo = HPO(database=hpo_data)
-    fisher = FisherTest()
-
-    method_instance = methods[method](hpo=hpo, fisher=fisher)
-
-    for trait, file in config["traits"].items():
-        print(f"Processing trait: {trait}")
-        file = Path(file)
-
-        method_data, genes = method_instance.read_data(file)
-
-        overlap_hpo, overlap_genes, _ = method_instance.get_overlap(hpo.hpo_data, genes)
-
-        overlap_method = method_instance.get_overlap_genes(method_data, overlap_genes)
-
-        _, sig_genes = method_instance.filter_data(overlap_method)
-
-        fish_results = method_instance.fisher.perform_fisher_exact_tests(overlap_hpo,
-                                    sig_genes, hpo_info_data)
-
-        out_file = out_dir / ("fisher_result_" + file.stem + ".csv")
-
-        write_out_data(fish_results, out_file)
+    # Also builds the index of the gene mapping used by the workers
+    symbol_index = get_symbol_index(config)
+
+    options = {"permutation_test": None, "covariate": None,
+               "sweep": arg_parse.get_argument("sweep"),
+               "sweep_points": arg_parse.get_argument("sweep_points"),
+               "result_cache": None}
+    if not arg_parse.get_argument("no_cache"):
+        options["result_cache"] = ResultCache(Path(arg_parse.get_argument("cache_dir")),
+                                              arg_parse.get_argument("cache_size") * 1024 ** 2)
+    if n_permutations > 0:
+        # Worker processes can not start their own pool of processes
+        n_workers = arg_parse.get_argument("workers") if n_jobs == 1 else 1
+        options["permutation_test"] = PermutationTest(n_permutations=n_permutations,
+                                                      seed=arg_parse.get_argument("seed"),
+                                                      n_workers=n_workers)
+        if config.get("covariate"):
+            options["covariate"] = read_covariate(Path(config["covariate"]))
+
+    if n_jobs == 1:
+        for job_method, trait, file in jobs:
+            print(f"Processing trait: {trait} ({job_method})")
+            method_instance = get_method(job_method, hpo, FisherTest(), symbol_index)
+            process_trait(method_instance, file, hpo_info_data,
+                          Path(output_dir) / job_method, options)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker,
+                                 initargs=(hpo_data, config.get("readers", {}),
+                                           config)) as executor:
+            futures = [executor.submit(run_job, job_method, trait, file, hpo_info_data,
+                                       Path(output_dir), options)
+                       for job_method, trait, file in jobs]
+            for future in as_completed(futures):
+                print(f"Processed: {future.result()}")
 
 
 if __name__ == "__main__":
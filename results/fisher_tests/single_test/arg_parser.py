@@ -55,6 +55,16 @@ class ArgumentParser:
                         help="Location where the output files need to be stored.",
                         required=False, default=False)
 
+        parser.add_argument("--no-cache", dest="no_cache", action="store_true",
+                        help="Do not use the result cache, recompute all results.")
+
+        parser.add_argument("--cache-dir", dest="cache_dir",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "benchmark-gwas-prio"),
+                        help="Location of the result cache, default = ~/.cache/benchmark-gwas-prio")
+
+        parser.add_argument("--cache-size", dest="cache_size", type=int, default=1024,
+                        help="Maximum size of the result cache in MB, default = 1024")
+
         parser.add_argument('-v',
             '--version',
             help='Displays the version number of the script and exit',
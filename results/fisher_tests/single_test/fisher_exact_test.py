@@ -22,6 +22,8 @@ sys.path.insert(0, root_dir)
 from fisher_tests.single_test.arg_parser import ArgumentParser, CLIArgValidator
 from utils.prioritization_methods import Downstreamer, Magma, Depict, PoPs, NetWAS
 from utils.fisher import HPO, FisherTest
+from utils.result_cache import ResultCache
+
 
 
 class VennDiagram:
@@ -182,6 +184,52 @@ def calculate_recall_precision(true_positives, false_positives, false_negatives)
     return precision, recall
 
 
+def compute_fisher_result(method_instance, file: Path, hpo_term: str) -> dict:
+    """
+    Perform the fisher's exact test on the results of a prioritization method for
+    a single HPO term.
+
+    :parameters
+    -----------
+    method_instance - PrioritizationMethod
+        The prioritization method
+    file - Path
+        Results of the prioritization method for a trait
+    hpo_term - str
+        ID of the HPO term (e.g. HP:0000002)
+
+    :returns
+    --------
+    result - dict
+        The contingency table (fisher_data), odds_ratio, pval, precision, recall and the
+        number of significant genes and HPO term genes (n_sig_genes, n_hpo_term_genes)
+    """
+    hpo = method_instance.hpo
+    fisher = method_instance.fisher
+
+    method_data, genes = method_instance.read_data(file)
+
+    _, overlap_genes, _ = method_instance.get_overlap(hpo.hpo_data, genes, [hpo_term])
+
+    overlap_method = method_instance.get_overlap_genes(method_data, overlap_genes)
+
+    _, sig_genes = method_instance.filter_data(overlap_method)
+
+    _, genes_hpo_term = hpo.get_data_hpo_term(hpo.hpo_data, hpo_term)
+
+    fisher_data = fisher.create_fisher_table(overlap_genes, sig_genes, genes_hpo_term)
+
+    true_positives, false_positives, false_negatives = fisher_data.iloc[1, 1], fisher_data.iloc[1, 0], fisher_data.iloc[0, 1]
+
+    odds_ratio, pval = fisher.fishers_exact_test(fisher_data.iloc[0:2, 0:2].values)
+
+    precision, recall = calculate_recall_precision(true_positives, false_positives, false_negatives)
+
+    return {"fisher_data": fisher_data, "odds_ratio": odds_ratio, "pval": pval,
+            "precision": precision, "recall": recall,
+            "n_sig_genes": len(sig_genes), "n_hpo_term_genes": len(genes_hpo_term)}
+
+
 def main():
     """
     Run the entire program
@@ -214,33 +262,38 @@ def main():
 
     method_instance = methods[method](hpo=hpo, fisher=fisher)
 
+    result_cache = None
+    if not arg_parse.get_argument("no_cache"):
+        result_cache = ResultCache(Path(arg_parse.get_argument("cache_dir")),
+                                   arg_parse.get_argument("cache_size") * 1024 ** 2)
+
     for trait, info in config["traits"].items():
         print(f"Processing trait: {trait}")
         file = Path(info["file"])
         hpo_term = info["hpo_term"]
-        method_data, genes = method_instance.read_data(file)
-
-        _, overlap_genes, _ = method_instance.get_overlap(hpo.hpo_data, genes)
-
-        overlap_method = method_instance.get_overlap_genes(method_data, overlap_genes)
 
-        _, sig_genes = method_instance.filter_data(overlap_method)
+        result = None
+        if result_cache is not None:
+            key = ResultCache.make_key(method=method, schema=repr(method_instance.schema),
+                                       method_file=ResultCache.hash_file(file),
+                                       hpo_data=hpo.get_checksum(), hpo_term=hpo_term,
+                                       threshold=method_instance.get_default_threshold())
+            result = result_cache.get(key)
 
-        _, genes_hpo_term = hpo.get_data_hpo_term(hpo.hpo_data, hpo_term)
+        if result is None:
+            result = compute_fisher_result(method_instance, file, hpo_term)
+            if result_cache is not None:
+                result_cache.put(key, result)
 
-        fisher_data = fisher.create_fisher_table(overlap_genes, sig_genes, genes_hpo_term)
-
-        true_positives, false_positives, false_negatives = fisher_data.iloc[1, 1], fisher_data.iloc[1, 0], fisher_data.iloc[0, 1]
+        fisher_data = result["fisher_data"]
+        odds_ratio, pval = result["odds_ratio"], result["pval"]
+        precision, recall = result["precision"], result["recall"]
 
         fisher_table = fisher_data.to_string()
 
-        odds_ratio, pval = fisher.fishers_exact_test(fisher_data.iloc[0:2, 0:2].values)
-
-        precision, recall = calculate_recall_precision(true_positives, false_positives, false_negatives)
-
         # Create venn diagram
-        n_significant_genes = len(sig_genes)
-        n_hpo_term_genes = len(genes_hpo_term)
+        n_significant_genes = result["n_sig_genes"]
+        n_hpo_term_genes = result["n_hpo_term_genes"]
         overlap_sig_hpo = fisher_data.iloc[1, 1]
         venn_diagram = VennDiagram(n_significant_genes, n_hpo_term_genes, overlap_sig_hpo)
 
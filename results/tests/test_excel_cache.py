@@ -0,0 +1,58 @@
+"""
+Tests that reading an Excel sheet from the columnar cache gives the same data as
+the first read of the workbook.
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+import pandas as pd
+import pytest
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root_dir)
+
+from utils.excel_cache import ExcelSheetCache
+from utils.prioritization_methods import Downstreamer
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """
+    Downstreamer-like workbook with text, numeric and boolean columns that contain
+    missing values.
+    """
+    data = pd.DataFrame({"Gene ID": ["ENSG01", "ENSG02", None, "ENSG04", "ENSG05"],
+                         "Enrichment Z-score": [3.1, -0.5, 2.4, None, 5.0],
+                         "Count": [1, 2, 3, 4, 5],
+                         "FDR 5% significant": [True, False, None, False, True],
+                         "Complete": [True, False, True, True, False],
+                         "Mixed": ["a", 1, None, 2.5, "b"]})
+    file = tmp_path / "trait_enrichtments.xlsx"
+    with pd.ExcelWriter(file, engine="openpyxl") as writer:
+        data.to_excel(writer, sheet_name="GenePrioritization", index=False)
+    return file
+
+
+def test_cached_read_matches_first_read(workbook):
+    first = ExcelSheetCache(workbook, "GenePrioritization").load()
+    cache = ExcelSheetCache(workbook, "GenePrioritization")
+    assert cache.is_valid()
+    cached = cache.load()
+
+    # Copy the memory-mapped columns, the comparison also checks the array type
+    columns = ["Gene ID", "Enrichment Z-score", "Count", "FDR 5% significant", "Complete"]
+    pd.testing.assert_frame_equal(cached[columns].copy(), first[columns], check_dtype=False)
+    assert cached["FDR 5% significant"].tolist() == [True, False, None, False, True]
+    assert cache.read_meta()["kinds"][3] == "boolean"
+
+
+def test_cached_read_keeps_significant_genes(workbook):
+    method = Downstreamer(hpo=None, fisher=None)
+    first, _ = method.read_data(workbook)
+    cached, _ = method.read_data(workbook)
+
+    first_genes = method.filter_data(first)[1].tolist()
+    assert first_genes == ["ENSG01", "ENSG05"]
+    assert method.filter_data(cached)[1].tolist() == first_genes
@@ -0,0 +1,233 @@
+"""
+Module that provides reading and writing of (gzip or bgzip compressed) text files,
+used by the scripts that prepare the input of the prioritization methods.
+
+The compression of a file is detected from its first bytes, and compressed output is
+compressed in blocks by background threads. bgzip (BGZF) files consist of independent
+blocks, which allows parts of a file to be copied without decompressing them.
+"""
+
+import gzip
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Marks the end of a bgzip file, see the SAM/BAM specification
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Maximum number of uncompressed bytes in a BGZF block
+BGZF_BLOCK_SIZE = 65280
+
+
+def get_compression(file):
+    """
+    Detect the compression of a file from its first bytes.
+
+    :parameters
+    -----------
+    file - Path
+        A file
+
+    :returns
+    --------
+    compression - str
+        None, "gzip" or "bgzip"
+    """
+    with open(file, 'rb') as stream:
+        start = stream.read(18)
+    if start[:2] != b"\x1f\x8b":
+        return None
+    # bgzip files are gzip files with an extra field (FLG.FEXTRA) containing the
+    # size of the block (BC subfield)
+    if len(start) == 18 and start[3] & 4 and start[12:14] == b"BC":
+        return "bgzip"
+    return "gzip"
+
+
+def compress_gzip_member(data, level=6) -> bytes:
+    """
+    Compress data into an independent gzip member, a gzip file can consist of
+    multiple members.
+    """
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_bgzf_blocks(data, level=6) -> bytes:
+    """
+    Compress data into bgzip (BGZF) blocks of at most 65280 uncompressed bytes.
+    """
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        chunk = data[start:start + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(chunk) + compressor.flush()
+        # The BC extra field contains the total size of the block - 1
+        header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" \
+            + struct.pack("<H", len(compressed) + 25)
+        blocks.append(header + compressed + struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+    return b"".join(blocks)
+
+
+def read_bgzf_block(stream) -> bytes:
+    """
+    Read the next (compressed) block of a bgzip file.
+
+    :parameters
+    -----------
+    stream - file object
+        bgzip file opened in binary mode
+
+    :returns
+    --------
+    block - bytes
+        The compressed block, empty at the end of the file
+    """
+    header = stream.read(12)
+    if not header:
+        return b""
+    extra_length, = struct.unpack("<H", header[10:12])
+    extra = stream.read(extra_length)
+    position = 0
+    while position < extra_length:
+        subfield, length = extra[position:position + 2], struct.unpack(
+            "<H", extra[position + 2:position + 4])[0]
+        if subfield == b"BC":
+            block_size, = struct.unpack("<H", extra[position + 4:position + 6])
+            return header + extra + stream.read(block_size + 1 - 12 - extra_length)
+        position += 4 + length
+    raise ValueError("Not a bgzip file, missing the block size (BC) field")
+
+
+class CompressedWriter:
+    """
+    Writes a gzip or bgzip compressed file while the data is compressed by
+    background threads.
+
+    The written data is collected into blocks that are compressed independently and
+    written in order. zlib releases the GIL, so the threads compress in parallel with
+    each other and with the thread producing the data. For gzip every block becomes
+    a gzip member, for bgzip it is divided into BGZF blocks.
+    """
+
+    def __init__(self, file, compression="gzip", n_threads=2, block_size=1024 ** 2, level=6):
+        if compression not in ("gzip", "bgzip"):
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compress = compress_gzip_member if compression == "gzip" else compress_bgzf_blocks
+        self.compression = compression
+        self.n_threads = n_threads
+        self.block_size = block_size
+        self.level = level
+        self.buffer = []
+        self.buffer_size = 0
+        self.pending = deque()
+        self.stream = open(file, "wb")
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+
+    def write(self, data) -> None:
+        """
+        Write bytes to the file.
+        """
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        if self.buffer_size > 0:
+            self.pending.append(self.executor.submit(self.compress, b"".join(self.buffer),
+                                                     self.level))
+            self.buffer = []
+            self.buffer_size = 0
+        # Keep at most two blocks per thread in memory
+        while len(self.pending) > 2 * self.n_threads:
+            self.stream.write(self.pending.popleft().result())
+
+    def close(self) -> None:
+        """
+        Compress the remaining data and close the file.
+        """
+        try:
+            self._submit()
+            while self.pending:
+                self.stream.write(self.pending.popleft().result())
+            if self.compression == "bgzip":
+                self.stream.write(BGZF_EOF)
+        finally:
+            self.executor.shutdown()
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_file(file):
+    """
+    Open a (gzip or bgzip compressed) file in binary mode.
+
+    :parameters
+    -----------
+    file - Path
+        Location of the file
+
+    :returns
+    --------
+    stream - file object
+        Binary stream of the uncompressed contents
+    """
+    if get_compression(file) is None:
+        return open(file, 'rb')
+    return gzip.open(file, 'rb')
+
+
+def open_output(file, compression=None, n_threads=2):
+    """
+    Open an output file in binary mode, optionally compressed in the background.
+
+    :parameters
+    -----------
+    file - Path
+        Location of the file
+    compression - str
+        None, "gzip" or "bgzip"
+    n_threads - int
+        Number of compression threads
+
+    :returns
+    --------
+    stream - file object
+        Binary stream to write to
+    """
+    if compression is None:
+        return open(file, 'wb')
+    return CompressedWriter(file, compression, n_threads)
+
+
+def read_blocks(stream, block_size):
+    """
+    Read a binary stream in blocks of at least block_size bytes that end at a line
+    boundary.
+
+    :parameters
+    -----------
+    stream - file object
+        Binary stream
+    block_size - int
+        Minimum number of bytes in a block
+
+    :returns
+    --------
+    blocks - generator
+        Blocks of complete lines
+    """
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        if not block.endswith(b"\n"):
+            block += stream.readline()
+        yield block
@@ -0,0 +1,241 @@
+"""
+Module that provides streaming ingestion of Excel sheets with a columnar cache.
+
+Parsing an Excel workbook (e.g. the Downstreamer enrichment workbooks) with
+pandas takes tens of seconds, while only a few columns of a single sheet are used.
+The sheet is streamed row by row with openpyxl in read-only mode, only the needed
+columns are kept, and the result is stored next to the workbook as one numpy
+array per column. Later reads memory-map these arrays.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Sequence
+import numpy as np
+import openpyxl
+import pandas as pd
+from .hpo_cache import HPOCache
+
+
+CACHE_VERSION = 2
+
+
+def read_excel_sheet(workbook: Path, sheet_name: str,
+                     columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Read columns of an Excel sheet by streaming its rows.
+
+    :parameters
+    -----------
+    workbook - Path
+        Excel workbook (.xlsx)
+    sheet_name - str
+        Name of the sheet
+    columns - Sequence[str]
+        Names of the columns to read, None to read all columns
+
+    :returns
+    --------
+    data - pd.DataFrame
+        The columns of the sheet, rows without any value are skipped
+    """
+    book = openpyxl.load_workbook(workbook, read_only=True, data_only=True)
+    try:
+        rows = book[sheet_name].iter_rows(values_only=True)
+        header = [str(name) if name is not None else "" for name in next(rows, ())]
+        if columns is None:
+            columns = [name for name in header if name]
+        missing = set(columns) - set(header)
+        if missing:
+            raise KeyError(f"Columns not found in {workbook} ({sheet_name}): {sorted(missing)}")
+
+        positions = [header.index(name) for name in columns]
+        values = [[] for _ in positions]
+        for row in rows:
+            selected = [row[position] if position < len(row) else None
+                        for position in positions]
+            if all(value is None for value in selected):
+                continue
+            for column, value in zip(values, selected):
+                column.append(value)
+    finally:
+        book.close()
+
+    return pd.DataFrame({name: column for name, column in zip(columns, values)},
+                        columns=list(columns))
+
+
+class ExcelSheetCache:
+    """
+    Columnar cache of the needed columns of an Excel sheet.
+
+    Every (sheet, columns) combination has its own directory inside the cache
+    directory of the workbook, containing:
+        column_<i>.npy - values of the i-th column
+        missing_<i>.npy - mask of the missing values of text and boolean columns (optional)
+        meta.json - the columns, their types and information about the workbook used
+                    to invalidate the cache
+    """
+
+    meta_file = "meta.json"
+
+    def __init__(self, workbook: Path, sheet_name: str,
+                 columns: Optional[Sequence[str]] = None,
+                 cache_dir: Optional[Path] = None) -> None:
+        self.workbook = Path(workbook)
+        self.sheet_name = sheet_name
+        self.columns = None if columns is None else list(columns)
+        if cache_dir is None:
+            cache_dir = self.workbook.parent / (self.workbook.name + ".cache")
+        selection = json.dumps([sheet_name, self.columns])
+        self.cache_dir = Path(cache_dir) / hashlib.sha256(selection.encode("utf-8")).hexdigest()[:16]
+
+    def load(self) -> pd.DataFrame:
+        """
+        Load the columns from the cache, building the cache first if it does not
+        exist yet or is out of date. If the cache can not be written the sheet is
+        read directly.
+
+        :returns
+        --------
+        data - pd.DataFrame
+            The columns of the sheet
+        """
+        if self.is_valid():
+            return self.read()
+        data = read_excel_sheet(self.workbook, self.sheet_name, self.columns)
+        try:
+            self.build(data)
+        except OSError as error:
+            print(f"[{ExcelSheetCache.__name__}] Could not write the cache: {error}")
+        return data
+
+    def is_valid(self) -> bool:
+        """
+        Check if the cache exists and matches the current workbook. The size and
+        modification time are checked first, the hash of the workbook is only
+        computed if these differ.
+
+        :returns
+        --------
+        valid - bool
+            True if the cache can be used
+        """
+        meta = self.read_meta()
+        if meta is None or meta.get("version") != CACHE_VERSION:
+            return False
+
+        stat = self.workbook.stat()
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        if meta["size"] != stat.st_size or meta["sha256"] != HPOCache.hash_file(self.workbook):
+            return False
+
+        meta["mtime_ns"] = stat.st_mtime_ns
+        self.write_meta(meta)
+        return True
+
+    def read_meta(self) -> Optional[dict]:
+        """
+        Read the meta data of the cache.
+
+        :returns
+        --------
+        meta - dict or None
+            Meta data or None if the cache does not exist or is corrupt
+        """
+        try:
+            with open(self.cache_dir / self.meta_file, 'r', encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, meta: dict) -> None:
+        """
+        Atomically write the meta data of the cache.
+
+        :parameters
+        -----------
+        meta - dict
+            Meta data
+        """
+        tmp_file = self.cache_dir / f"{self.meta_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding="utf-8") as stream:
+            json.dump(meta, stream)
+        os.replace(tmp_file, self.cache_dir / self.meta_file)
+
+    def build(self, data: pd.DataFrame) -> None:
+        """
+        Write the columns of a sheet to the cache. Numeric and boolean columns are
+        stored as they are. Boolean columns with missing values are stored as booleans
+        with a mask of the missing values, so they are read back as True, False and
+        None instead of text. Other columns are stored as text with a mask of the
+        missing values.
+
+        :parameters
+        -----------
+        data - pd.DataFrame
+            The columns of the sheet
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            (self.cache_dir / self.meta_file).unlink()
+        except FileNotFoundError:
+            pass
+
+        stat = self.workbook.stat()
+        suffix = f".{os.getpid()}.tmp"
+        kinds = []
+        for index, name in enumerate(data.columns):
+            column = data[name]
+            arrays = {}
+            missing = column.isna().values
+            if column.dtype.kind in "biuf":
+                kinds.append("values")
+                arrays[f"column_{index}.npy"] = column.values
+            elif missing.any() and column[~missing].map(type).isin([bool, np.bool_]).all():
+                kinds.append("boolean")
+                arrays[f"column_{index}.npy"] = np.array(column.where(~missing, False).values,
+                                                         dtype=bool)
+                arrays[f"missing_{index}.npy"] = missing
+            else:
+                kinds.append("text")
+                arrays[f"column_{index}.npy"] = np.array(
+                    column.where(~missing, "").astype(str).values, dtype=str)
+                arrays[f"missing_{index}.npy"] = missing
+            for file, values in arrays.items():
+                with open(self.cache_dir / (file + suffix), 'wb') as stream:
+                    np.save(stream, values)
+                os.replace(self.cache_dir / (file + suffix), self.cache_dir / file)
+
+        self.write_meta({"version": CACHE_VERSION,
+                         "source": str(self.workbook.resolve()),
+                         "sheet_name": self.sheet_name,
+                         "size": stat.st_size,
+                         "mtime_ns": stat.st_mtime_ns,
+                         "sha256": HPOCache.hash_file(self.workbook),
+                         "columns": list(map(str, data.columns)),
+                         "kinds": kinds})
+
+    def read(self) -> pd.DataFrame:
+        """
+        Read the columns from the cache. Numeric and boolean columns without missing
+        values are backed by read-only memory maps.
+
+        :returns
+        --------
+        data - pd.DataFrame
+            The columns of the sheet
+        """
+        meta = self.read_meta()
+        columns = {}
+        for index, (name, kind) in enumerate(zip(meta["columns"], meta["kinds"])):
+            values = np.load(self.cache_dir / f"column_{index}.npy", mmap_mode='r')
+            if kind in ("text", "boolean"):
+                values = values.astype(object)
+                values[np.load(self.cache_dir / f"missing_{index}.npy")] = None
+            columns[name] = values
+        return pd.DataFrame(columns, columns=meta["columns"], copy=False)
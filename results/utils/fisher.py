@@ -5,25 +5,60 @@ specifically on results of gene prioritization methods.
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import special, stats
+from .genes import GeneSet, gene_dictionary
+from .hpo_cache import HPOCache
+from .hypergeometric import HypergeometricEngine
+from .permutation import PermutationTest
 
 
 @dataclass
 class HPO:
     """
     Dataclass containing a HPO database.
+
+    By default the database is compiled into a memory-mapped cache (see
+    utils.hpo_cache) on the first load, which is reused by later loads.
     """
     database: Path
+    cache_dir: Optional[Path] = None
+    use_cache: bool = True
 
     def __post_init__(self) -> None:
         """
         Read in the HPO database and the HPO info.
         """
-        self.hpo_data = pd.read_csv(self.database, compression='gzip', sep="\t")
-        self.hpo_data.set_index('-', inplace=True)
+        self.hpo_data = None
+        self.checksum = None
+        if self.use_cache:
+            try:
+                cache = HPOCache(self.database, self.cache_dir)
+                self.hpo_data = cache.load()
+                self.checksum = cache.read_meta()["sha256"]
+            except OSError as error:
+                print(f"[{HPO.__name__}] Could not use the HPO cache ({error}), " \
+                    "reading the database directly.")
+        if self.hpo_data is None:
+            self.hpo_data = HPOCache.read_database(self.database)
+
+        self.gene_codes = gene_dictionary.encode(self.hpo_data.index)
+        self.genes = GeneSet.from_codes(self.gene_codes)
+
+    def get_checksum(self) -> str:
+        """
+        Get the sha256 hash of the HPO database, taken from the HPO cache if possible.
+
+        :returns
+        --------
+        checksum - str
+            Hex digest of the HPO database
+        """
+        if self.checksum is None:
+            self.checksum = HPOCache.hash_file(self.database)
+        return self.checksum
 
     @staticmethod
     def get_data_hpo_term(hpo_data: pd.DataFrame,
@@ -58,6 +93,8 @@ class FisherTest:
     data generated by gene prioritization methods.
     """
 
+    engine = HypergeometricEngine()
+
     @staticmethod
     def create_fisher_table(overlap_genes: pd.Series, gwas_genes: pd.Series,
                             hpo_genes: pd.Series) -> pd.DataFrame:
@@ -78,10 +115,14 @@ class FisherTest:
         metrix - pd.DataFrame
             2x2 contingency table
         """
-        top_left = overlap_genes[~overlap_genes.isin(gwas_genes) & ~overlap_genes.isin(hpo_genes)].shape[0]
-        bottom_left = overlap_genes[overlap_genes.isin(gwas_genes) & ~overlap_genes.isin(hpo_genes)].shape[0]
-        top_right = overlap_genes[~overlap_genes.isin(gwas_genes) & overlap_genes.isin(hpo_genes)].shape[0]
-        bottom_right = overlap_genes[overlap_genes.isin(gwas_genes) & overlap_genes.isin(hpo_genes)].shape[0]
+        overlap_codes = gene_dictionary.encode(overlap_genes)
+        is_gwas = GeneSet.from_ids(gwas_genes).isin(overlap_codes)
+        is_hpo = GeneSet.from_ids(hpo_genes).isin(overlap_codes)
+
+        top_left = int(np.count_nonzero(~is_gwas & ~is_hpo))
+        bottom_left = int(np.count_nonzero(is_gwas & ~is_hpo))
+        top_right = int(np.count_nonzero(~is_gwas & is_hpo))
+        bottom_right = int(np.count_nonzero(is_gwas & is_hpo))
 
         total = top_left + bottom_left + top_right + bottom_right
 
@@ -112,8 +153,132 @@ class FisherTest:
         odds_ratio, p_val = stats.fisher_exact(fisher_data)
         return odds_ratio, p_val
 
+    def fishers_exact_tests(self, tables: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Perform the fisher's exact test on an array of 2x2 contingency tables at once.
+        Tables containing NaN values get a NaN odds ratio and p value.
+
+        :parameters
+        -----------
+        tables - np.ndarray
+            Array of shape (n, 2, 2) containing 2x2 contingency tables
+
+        :returns
+        --------
+        odds_ratios - np.ndarray
+            Odds ratios of the fisher's exact tests
+        p_values - np.ndarray
+            P values of the fisher's exact tests
+        log_p_values - np.ndarray
+            Natural logarithm of the p values
+        """
+        tables = np.asarray(tables, dtype=np.float64)
+        missing = np.isnan(tables).any(axis=(1, 2))
+
+        odds_ratios = np.full(tables.shape[0], np.nan)
+        p_values = np.full(tables.shape[0], np.nan)
+        log_p_values = np.full(tables.shape[0], np.nan)
+
+        odds_ratios[~missing], p_values[~missing], log_p_values[~missing] = \
+            self.engine.fisher_exact(tables[~missing].astype(np.int64))
+        return odds_ratios, p_values, log_p_values
+
+    @staticmethod
+    def create_fisher_tables(hpo_data: pd.DataFrame, gene_data: pd.Series,
+                             hpo_terms: pd.Series, block_size: int = 1024) -> np.ndarray:
+        """
+        Create the 2x2 contingency tables for a number of HPO terms at once.
+
+        Instead of building every table separately, the indicator vector of the
+        significant genes is multiplied with the gene x term matrix, which gives
+        the number of significant HPO genes for every term in a single
+        matrix-vector product. The remaining cells follow from the column sums
+        of the matrix and the number of significant genes.
+
+        :parameters
+        -----------
+        hpo_data - pd.DataFrame
+            HPO metric inside a pandas data frame, the index is used as the gene universe
+        gene_data - pd.Series
+            List of significant genes
+        hpo_terms - pd.Series
+            IDs of the HPO terms (e.g. HP:00002)
+        block_size - int
+            Number of HPO terms processed at a time, limits the memory used
+
+        :returns
+        --------
+        tables - np.ndarray
+            Array of shape (len(hpo_terms), 2, 2) where each table has the same layout as
+            the first two rows and columns of create_fisher_table. Tables of HPO terms that
+            are not inside the HPO data are filled with NaN.
+        """
+        significant = GeneSet.from_ids(gene_data).contains_ids(hpo_data.index).astype(np.float32)
+        n_significant = significant.sum()
+        n_genes = hpo_data.shape[0]
+
+        term_index = hpo_data.columns.get_indexer(pd.Index(hpo_terms))
+        tables = np.full((term_index.shape[0], 2, 2), np.nan)
+        found = np.flatnonzero(term_index >= 0)
+        values = hpo_data.values
+
+        for start in range(0, found.shape[0], block_size):
+            block = found[start:start + block_size]
+            matrix = (values[:, term_index[block]] == 1).astype(np.float32)
+
+            yes_hpo = matrix.sum(axis=0, dtype=np.float64)
+            yes_gwas_yes_hpo = significant @ matrix
+
+            tables[block, 0, 1] = yes_hpo - yes_gwas_yes_hpo
+            tables[block, 1, 1] = yes_gwas_yes_hpo
+            tables[block, 1, 0] = n_significant - yes_gwas_yes_hpo
+            tables[block, 0, 0] = n_genes - n_significant - tables[block, 0, 1]
+
+        return np.round(tables)
+
+    @staticmethod
+    def empirical_pvalues(hpo_data: pd.DataFrame, gene_data: pd.Series, hpo_terms: pd.Series,
+                          permutation_test: PermutationTest,
+                          covariate: Optional[pd.Series] = None) -> np.ndarray:
+        """
+        Calculate empirical enrichment p values by comparing the significant genes with
+        random gene sets of the same size drawn from the genes inside the HPO data.
+
+        :parameters
+        -----------
+        hpo_data - pd.DataFrame
+            HPO metric inside a pandas data frame, the index is used as the gene universe
+        gene_data - pd.Series
+            List of significant genes
+        hpo_terms - pd.Series
+            IDs of the HPO terms (e.g. HP:00002)
+        permutation_test - PermutationTest
+            Settings of the permutations (number, seed, workers)
+        covariate - pd.Series
+            Optional covariate (e.g. gene length) indexed by gene ID, the random gene sets
+            are matched on the distribution of this covariate
+
+        :returns
+        --------
+        p_values - np.ndarray
+            Empirical p value of every HPO term, NaN for terms not inside the HPO data
+        """
+        significant = GeneSet.from_ids(gene_data).contains_ids(hpo_data.index)
+        term_index = hpo_data.columns.get_indexer(pd.Index(hpo_terms))
+        found = np.flatnonzero(term_index >= 0)
+        term_matrix = hpo_data.values[:, term_index[found]] == 1
+
+        if covariate is not None:
+            covariate = covariate.reindex(hpo_data.index).values
+
+        p_values = np.full(term_index.shape[0], np.nan)
+        p_values[found] = permutation_test.empirical_pvalues(term_matrix, significant, covariate)
+        return p_values
+
     def perform_fisher_exact_tests(self, hpo_data: pd.DataFrame, gene_data: pd.Series,
-                                    hpo_info: pd.DataFrame) -> pd.DataFrame:
+                                    hpo_info: pd.DataFrame,
+                                    permutation_test: Optional[PermutationTest] = None,
+                                    covariate: Optional[pd.Series] = None) -> pd.DataFrame:
         """
         Perform fisher's exact test on the intersect of the HPO genes, and
         genes produced by a gene prioritization method.
@@ -126,32 +291,31 @@ class FisherTest:
             List of genes
         hpo_info - pd.DataFrame
             A data frame containing the name of the GWAS trait, Related HPO term, and HPO ID
+        permutation_test - PermutationTest
+            If supplied, empirical p values are calculated as well
+        covariate - pd.Series
+            Optional covariate indexed by gene ID to match the random gene sets on
 
         :returns
         --------
         hpo_scores - pd.DataFrame
             The original hpo_info data frame with some additional information:
             OR and p values from the fisher exact test and zscores from the p values.
+            When a permutation test is supplied also the empirical p values.
         """
         hpo_scores = hpo_info.copy()
-        odds_ratios = []
-        p_values = []
-        for hpo in hpo_info["HPO ID"]:
 
-            try:
-                hpo_genes = hpo_data.loc[hpo_data[hpo] == 1, hpo].index
-                fisher_data = self.create_fisher_table(hpo_data.index, gene_data, hpo_genes).iloc[0:2, 0:2].values
-
-                odds_ratio, p_val = self.fishers_exact_test(fisher_data)
-            except KeyError:
-                odds_ratio, p_val = np.nan, np.nan
-
-            odds_ratios.append(odds_ratio)
-            p_values.append(p_val)
+        tables = self.create_fisher_tables(hpo_data, gene_data, hpo_info["HPO ID"])
+        odds_ratios, p_values, log_p_values = self.fishers_exact_tests(tables)
 
         hpo_scores["OR"] = odds_ratios
         hpo_scores["pvalues"] = p_values
-        zscores = stats.norm.ppf(p_values)
+        # Use the log p values so p values that underflow to 0 still get a finite zscore
+        zscores = special.ndtri_exp(log_p_values)
         hpo_scores["zscores"] = np.where(zscores == np.inf, 4, zscores)
 
+        if permutation_test is not None:
+            hpo_scores["empirical_pvalues"] = self.empirical_pvalues(
+                hpo_data, gene_data, hpo_info["HPO ID"], permutation_test, covariate)
+
         return hpo_scores
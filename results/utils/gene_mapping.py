@@ -0,0 +1,310 @@
+"""
+Module that maps gene symbols to ensembl gene IDs without network access.
+
+A local mapping dump (e.g. the HGNC complete set, or a BioMart export) is read once
+and compiled into a compact index next to the dump: the approved symbols, previous
+symbols and aliases are sorted and every symbol points to its best ensembl gene ID.
+Later loads memory-map the index and symbols are mapped with a vectorized binary
+search.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from .hpo_cache import HPOCache
+
+
+CACHE_VERSION = 1
+
+# Types of matches, a lower value is preferred when a symbol matches multiple genes
+MATCH_TYPES = ("symbol", "previous", "alias")
+
+
+class SymbolIndex:
+    """
+    Compiled index of a gene symbol -> ensembl gene ID mapping dump.
+
+    The index directory contains the following files:
+        symbols.npy - the symbols (upper case), sorted
+        ensembl.npy - the ensembl gene ID of every symbol
+        match.npy - the type of match of every symbol (index in MATCH_TYPES)
+        candidates.npy - all ensembl gene IDs of the best match type ('|' separated)
+        meta.json - information about the dump used to invalidate the index
+
+    The default columns are those of the HGNC complete set, for other dumps the
+    columns can be changed (previous_column and alias_column can be None).
+    """
+
+    files = ("symbols.npy", "ensembl.npy", "match.npy", "candidates.npy")
+    meta_file = "meta.json"
+
+    def __init__(self, source: Path, cache_dir: Optional[Path] = None,
+                 symbol_column: str = "symbol", ensembl_column: str = "ensembl_gene_id",
+                 previous_column: Optional[str] = "prev_symbol",
+                 alias_column: Optional[str] = "alias_symbol", separator: str = "|") -> None:
+        self.source = Path(source)
+        if cache_dir is None:
+            cache_dir = self.source.parent / (self.source.name + ".index")
+        self.cache_dir = Path(cache_dir)
+        self.columns = {"symbol": symbol_column, "previous": previous_column,
+                        "alias": alias_column}
+        self.ensembl_column = ensembl_column
+        self.separator = separator
+        self.symbols = None
+        self.ensembl = None
+        self.match = None
+        self.candidates = None
+
+    def load(self) -> "SymbolIndex":
+        """
+        Load the index, building it first if it does not exist yet or is out of date.
+
+        :returns
+        --------
+        index - SymbolIndex
+            The loaded index
+        """
+        if not self.is_valid():
+            self.build()
+        self.symbols, self.ensembl, self.match, self.candidates = (
+            np.load(self.cache_dir / file, mmap_mode='r') for file in self.files)
+        return self
+
+    def get_settings(self) -> dict:
+        """
+        Get the settings used to read the dump, the index is rebuilt when these change.
+        """
+        return {"columns": self.columns, "ensembl_column": self.ensembl_column,
+                "separator": self.separator}
+
+    def is_valid(self) -> bool:
+        """
+        Check if the index exists and matches the current dump. The size and
+        modification time are checked first, the hash of the dump is only
+        computed if these differ.
+
+        :returns
+        --------
+        valid - bool
+            True if the index can be used
+        """
+        meta = self.read_meta()
+        if meta is None or meta.get("version") != CACHE_VERSION \
+                or meta.get("settings") != self.get_settings():
+            return False
+
+        stat = self.source.stat()
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        if meta["size"] != stat.st_size or meta["sha256"] != HPOCache.hash_file(self.source):
+            return False
+
+        meta["mtime_ns"] = stat.st_mtime_ns
+        self.write_meta(meta)
+        return True
+
+    def read_meta(self) -> Optional[dict]:
+        """
+        Read the meta data of the index.
+
+        :returns
+        --------
+        meta - dict or None
+            Meta data or None if the index does not exist or is corrupt
+        """
+        try:
+            with open(self.cache_dir / self.meta_file, 'r', encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, meta: dict) -> None:
+        """
+        Atomically write the meta data of the index.
+
+        :parameters
+        -----------
+        meta - dict
+            Meta data
+        """
+        tmp_file = self.cache_dir / f"{self.meta_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding="utf-8") as stream:
+            json.dump(meta, stream)
+        os.replace(tmp_file, self.cache_dir / self.meta_file)
+
+    def get_checksum(self) -> str:
+        """
+        Get the sha256 hash of the dump the index was built from.
+        """
+        meta = self.read_meta()
+        if meta is None:
+            return HPOCache.hash_file(self.source)
+        return meta["sha256"]
+
+    def read_source(self) -> pd.DataFrame:
+        """
+        Read the symbols of the mapping dump.
+
+        :returns
+        --------
+        mapping - pd.DataFrame
+            Columns: symbol (upper case), ensembl_id and match (index in MATCH_TYPES)
+        """
+        header = pd.read_csv(self.source, sep="\t", nrows=0).columns
+        columns = {match: column for match, column in self.columns.items()
+                   if column is not None and column in header}
+        if "symbol" not in columns or self.ensembl_column not in header:
+            raise KeyError(f"{self.source} should contain the columns "
+                           f"{self.columns['symbol']} and {self.ensembl_column}")
+
+        dump = pd.read_csv(self.source, sep="\t", usecols=list(columns.values())
+                           + [self.ensembl_column], dtype=str, engine="c")
+        dump = dump[dump[self.ensembl_column].notna()]
+
+        mappings = []
+        for match, column in columns.items():
+            symbols = dump[column].str.strip('"').str.split(self.separator, regex=False)
+            mapping = pd.DataFrame({"symbol": symbols, "ensembl_id": dump[self.ensembl_column]})
+            mapping = mapping.explode("symbol")
+            mapping["symbol"] = mapping.symbol.str.strip().str.upper()
+            mapping = mapping[mapping.symbol.notna() & (mapping.symbol != "")]
+            mapping["match"] = MATCH_TYPES.index(match)
+            mappings.append(mapping)
+        return pd.concat(mappings, ignore_index=True)
+
+    def build(self) -> None:
+        """
+        Read the mapping dump and write the index. Every symbol keeps only the
+        genes of its best type of match (approved symbol, then previous symbol,
+        then alias); when this is still more than one gene the symbol is ambiguous
+        and the first ensembl gene ID is used.
+        """
+        mapping = self.read_source()
+        mapping = mapping.drop_duplicates().sort_values(["symbol", "match", "ensembl_id"],
+                                                        kind="mergesort")
+        best = mapping.groupby("symbol", sort=False).match.transform("min")
+        mapping = mapping[mapping.match == best]
+        grouped = mapping.groupby("symbol", sort=True)
+        index = pd.DataFrame({"ensembl_id": grouped.ensembl_id.first(),
+                              "match": grouped.match.first(),
+                              "candidates": grouped.ensembl_id.agg("|".join)})
+        if index.empty:
+            raise ValueError(f"No gene symbols with an ensembl gene ID found in {self.source}")
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            (self.cache_dir / self.meta_file).unlink()
+        except FileNotFoundError:
+            pass
+
+        arrays = (np.array(index.index, dtype=str), np.array(index.ensembl_id, dtype=str),
+                  np.array(index.match, dtype=np.int8), np.array(index.candidates, dtype=str))
+        suffix = f".{os.getpid()}.tmp"
+        for file, values in zip(self.files, arrays):
+            with open(self.cache_dir / (file + suffix), 'wb') as stream:
+                np.save(stream, values)
+            os.replace(self.cache_dir / (file + suffix), self.cache_dir / file)
+
+        stat = self.source.stat()
+        self.write_meta({"version": CACHE_VERSION,
+                         "source": str(self.source.resolve()),
+                         "settings": self.get_settings(),
+                         "size": stat.st_size,
+                         "mtime_ns": stat.st_mtime_ns,
+                         "sha256": HPOCache.hash_file(self.source),
+                         "n_symbols": len(index)})
+
+    def map_symbols(self, symbols: Sequence[str]) -> pd.DataFrame:
+        """
+        Map gene symbols to ensembl gene IDs.
+
+        :parameters
+        -----------
+        symbols - Sequence[str]
+            Gene symbols
+
+        :returns
+        --------
+        mapped - pd.DataFrame
+            Columns: gene_symbol, ensemble_id (NaN if the symbol is unknown), match
+            (symbol, previous or alias) and candidates (all ensembl gene IDs if the
+            symbol is ambiguous), in the order of the symbols
+        """
+        if self.symbols is None:
+            self.load()
+        symbols = pd.Series(symbols, dtype=str)
+        keys = symbols.str.strip().str.upper().fillna("").values.astype(str)
+
+        positions = np.searchsorted(self.symbols, keys)
+        positions[positions == len(self.symbols)] = 0
+        found = self.symbols[positions] == keys
+
+        mapped = pd.DataFrame({"gene_symbol": symbols.values})
+        mapped["ensemble_id"] = np.where(found, self.ensembl[positions], None)
+        mapped["match"] = np.where(found, np.array(MATCH_TYPES)[self.match[positions]], None)
+        candidates = np.where(found, self.candidates[positions], "")
+        mapped["candidates"] = np.where(np.char.find(candidates.astype(str), "|") >= 0,
+                                        candidates, None)
+        return mapped
+
+    def map_table(self, data: pd.DataFrame, symbol_column: str,
+                  drop_ambiguous: bool = False) -> Tuple[pd.DataFrame, dict]:
+        """
+        Add the ensembl gene IDs to a table with gene symbols in one vectorized
+        join. Unmapped symbols are removed.
+
+        :parameters
+        -----------
+        data - pd.DataFrame
+            Table containing gene symbols
+        symbol_column - str
+            Name of the column containing the gene symbols
+        drop_ambiguous - bool
+            Remove symbols that match multiple genes instead of using the first gene
+
+        :returns
+        --------
+        data - pd.DataFrame
+            Table with the column ensemble_id after the symbol column
+        report - dict
+            mapped: number of mapped rows, ambiguous: symbols matching multiple genes
+            (symbol -> candidates), unmapped: symbols without ensembl gene ID
+        """
+        mapped = self.map_symbols(data[symbol_column])
+        ambiguous = mapped.candidates.notna().values
+        unmapped = mapped.ensemble_id.isna().values
+        keep = ~unmapped & ~(ambiguous & drop_ambiguous)
+
+        position = data.columns.get_loc(symbol_column) + 1
+        data = data.copy()
+        data.insert(position, "ensemble_id", mapped.ensemble_id.values)
+        report = {"mapped": int(keep.sum()),
+                  "ambiguous": dict(zip(mapped.gene_symbol[ambiguous],
+                                        mapped.candidates[ambiguous])),
+                  "unmapped": list(mapped.gene_symbol[unmapped])}
+        return data[keep].reset_index(drop=True), report
+
+
+def print_report(report: dict, name: str = "") -> None:
+    """
+    Print a summary of the mapping of gene symbols.
+
+    :parameters
+    -----------
+    report - dict
+        Report returned by SymbolIndex.map_table
+    name - str
+        Name of the mapped data
+    """
+    print(f"[{name}] mapped: {report['mapped']}, ambiguous: {len(report['ambiguous'])}, "
+          f"unmapped: {len(report['unmapped'])}")
+    if report["ambiguous"]:
+        print("  ambiguous: " + ", ".join(f"{symbol} ({candidates})" for symbol, candidates
+                                          in list(report["ambiguous"].items())[:20]))
+    if report["unmapped"]:
+        # Rows without a gene symbol are unmapped as well, these are shown as nan
+        print("  unmapped: " + ", ".join(map(str, report["unmapped"][:20])))
@@ -0,0 +1,231 @@
+"""
+Module that provides a process-wide dictionary of gene IDs and a bitmap backed set of genes.
+
+Comparing lists of ensembl gene IDs as strings means that every overlap rebuilds a
+hash set of strings. Instead every gene ID is interned once into an int32 code, after
+which a set of genes is a bitmap and intersections, differences and counts are
+word-level operations.
+"""
+
+from typing import Iterable, Optional
+import numpy as np
+import pandas as pd
+
+
+# Number of set bits for every possible byte
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class GeneDictionary:
+    """
+    Dictionary that interns gene IDs (e.g. ENSG00000000003) into int32 codes.
+    Codes are assigned in order of first appearance and never change.
+    """
+
+    def __init__(self) -> None:
+        self._index = pd.Index([], dtype=object)
+
+    def __len__(self) -> int:
+        return self._index.shape[0]
+
+    def encode(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Get the codes of a list of gene IDs, adding unknown IDs to the dictionary.
+
+        :parameters
+        -----------
+        ids - Iterable[str]
+            Gene IDs
+
+        :returns
+        --------
+        codes - np.ndarray
+            int32 code of every gene ID
+        """
+        values = np.asarray(ids, dtype=object)
+        codes = self._index.get_indexer(values)
+        new = codes < 0
+        if new.any():
+            self._index = self._index.append(pd.Index(pd.unique(values[new]), dtype=object))
+            codes[new] = self._index.get_indexer(values[new])
+        return codes.astype(np.int32)
+
+    def lookup(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Get the codes of a list of gene IDs without adding unknown IDs to the dictionary.
+
+        :parameters
+        -----------
+        ids - Iterable[str]
+            Gene IDs
+
+        :returns
+        --------
+        codes - np.ndarray
+            int32 code of every gene ID, -1 for IDs that are not in the dictionary
+        """
+        return self._index.get_indexer(np.asarray(ids, dtype=object)).astype(np.int32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Get the gene IDs belonging to a list of codes.
+
+        :parameters
+        -----------
+        codes - np.ndarray
+            Codes of genes
+
+        :returns
+        --------
+        ids - np.ndarray
+            Gene IDs
+        """
+        return self._index.values[np.asarray(codes, dtype=np.int64)]
+
+
+gene_dictionary = GeneDictionary()
+
+
+class GeneSet:
+    """
+    Set of genes stored as a bitmap over the codes of a GeneDictionary.
+    """
+
+    def __init__(self, bitmap: np.ndarray, dictionary: Optional[GeneDictionary] = None) -> None:
+        self.bitmap = bitmap
+        self.dictionary = gene_dictionary if dictionary is None else dictionary
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray,
+                   dictionary: Optional[GeneDictionary] = None) -> "GeneSet":
+        """
+        Create a set of genes from gene codes.
+
+        :parameters
+        -----------
+        codes - np.ndarray
+            Codes of genes
+        dictionary - GeneDictionary
+            Dictionary the codes belong to, default is the process-wide dictionary
+
+        :returns
+        --------
+        gene_set - GeneSet
+            Set of genes
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        indicator = np.zeros(codes.max() + 1 if codes.shape[0] > 0 else 0, dtype=bool)
+        indicator[codes] = True
+        return cls(np.packbits(indicator, bitorder='little'), dictionary)
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[str],
+                 dictionary: Optional[GeneDictionary] = None) -> "GeneSet":
+        """
+        Create a set of genes from gene IDs.
+
+        :parameters
+        -----------
+        ids - Iterable[str]
+            Gene IDs
+        dictionary - GeneDictionary
+            Dictionary used to intern the IDs, default is the process-wide dictionary
+
+        :returns
+        --------
+        gene_set - GeneSet
+            Set of genes
+        """
+        dictionary = gene_dictionary if dictionary is None else dictionary
+        return cls.from_codes(dictionary.encode(ids), dictionary)
+
+    def isin(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Check for a list of gene codes whether they are inside the set.
+
+        :parameters
+        -----------
+        codes - np.ndarray
+            Codes of genes
+
+        :returns
+        --------
+        mask - np.ndarray
+            Boolean array that is True for codes inside the set
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        in_range = (codes >= 0) & (codes < self.bitmap.shape[0] * 8)
+        mask = np.zeros(codes.shape[0], dtype=bool)
+        valid = codes[in_range]
+        mask[in_range] = (self.bitmap[valid >> 3] >> (valid & 7)) & 1
+        return mask
+
+    def contains_ids(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Check for a list of gene IDs whether they are inside the set. Gene IDs that
+        are not in the dictionary are not inside the set and are not added to it.
+
+        :parameters
+        -----------
+        ids - Iterable[str]
+            Gene IDs
+
+        :returns
+        --------
+        mask - np.ndarray
+            Boolean array that is True for gene IDs inside the set
+        """
+        return self.isin(self.dictionary.lookup(ids))
+
+    def codes(self) -> np.ndarray:
+        """
+        Get the sorted codes of the genes inside the set.
+
+        :returns
+        --------
+        codes - np.ndarray
+            int32 codes of the genes
+        """
+        return np.flatnonzero(np.unpackbits(self.bitmap, bitorder='little')).astype(np.int32)
+
+    def ids(self) -> np.ndarray:
+        """
+        Get the gene IDs of the genes inside the set.
+
+        :returns
+        --------
+        ids - np.ndarray
+            Gene IDs
+        """
+        return self.dictionary.decode(self.codes())
+
+    def _aligned(self, other: "GeneSet") -> tuple:
+        """
+        Pad the bitmaps of two sets to the same length.
+        """
+        if self.dictionary is not other.dictionary:
+            raise ValueError("Gene sets must use the same gene dictionary.")
+        size = max(self.bitmap.shape[0], other.bitmap.shape[0])
+        left = np.zeros(size, dtype=np.uint8)
+        right = np.zeros(size, dtype=np.uint8)
+        left[:self.bitmap.shape[0]] = self.bitmap
+        right[:other.bitmap.shape[0]] = other.bitmap
+        return left, right
+
+    def __and__(self, other: "GeneSet") -> "GeneSet":
+        left, right = self._aligned(other)
+        return GeneSet(left & right, self.dictionary)
+
+    def __or__(self, other: "GeneSet") -> "GeneSet":
+        left, right = self._aligned(other)
+        return GeneSet(left | right, self.dictionary)
+
+    def __sub__(self, other: "GeneSet") -> "GeneSet":
+        left, right = self._aligned(other)
+        return GeneSet(left & ~right, self.dictionary)
+
+    def __len__(self) -> int:
+        return int(_POPCOUNT[self.bitmap].sum(dtype=np.int64))
+
+    def __contains__(self, gene_id: str) -> bool:
+        return bool(self.contains_ids([gene_id])[0])
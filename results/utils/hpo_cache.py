@@ -0,0 +1,247 @@
+"""
+Module that provides a compiled, memory-mapped cache of the HPO gene x term matrix.
+
+Parsing the gzipped HPO matrix with pandas is slow and every process ends up
+holding its own copy of the data. The first time a HPO database is loaded the
+matrix is written to disk as a uint8 numpy array together with the gene and
+term index files; later loads memory-map that array so concurrent jobs share a
+single page-cached copy.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 1
+
+
+class HPOCache:
+    """
+    Compiled cache of a HPO database.
+
+    The cache directory contains the following files:
+        matrix.npy - uint8 matrix of shape (terms, genes)
+        genes.txt - ensembl gene IDs, one per line
+        terms.txt - HPO term IDs, one per line
+        meta.json - information about the source file used to invalidate the cache
+    """
+
+    matrix_file = "matrix.npy"
+    genes_file = "genes.txt"
+    terms_file = "terms.txt"
+    meta_file = "meta.json"
+
+    def __init__(self, database: Path, cache_dir: Optional[Path] = None) -> None:
+        self.database = Path(database)
+        if cache_dir is None:
+            cache_dir = self.database.parent / (self.database.name + ".cache")
+        self.cache_dir = Path(cache_dir)
+
+    def load(self) -> pd.DataFrame:
+        """
+        Load the HPO matrix from the cache, building the cache first if it
+        does not exist yet or is out of date.
+
+        :returns
+        --------
+        hpo_data - pd.DataFrame
+            HPO matrix with ensembl gene IDs as index and HPO terms as columns,
+            backed by a read-only memory map.
+        """
+        if not self.is_valid():
+            self.build()
+        return self.read()
+
+    def is_valid(self) -> bool:
+        """
+        Check if the cache exists and matches the current source file. The
+        size and modification time are checked first, the (more expensive)
+        hash of the source file is only computed if these differ.
+
+        :returns
+        --------
+        valid - bool
+            True if the cache can be used
+        """
+        meta = self.read_meta()
+        if meta is None or meta.get("version") != CACHE_VERSION:
+            return False
+
+        stat = self.database.stat()
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        if meta["size"] != stat.st_size or meta["sha256"] != self.hash_file(self.database):
+            return False
+
+        # Contents are unchanged (e.g. the file was copied), record the new mtime.
+        meta["mtime_ns"] = stat.st_mtime_ns
+        self.write_meta(meta)
+        return True
+
+    def read_meta(self) -> Optional[dict]:
+        """
+        Read the meta data of the cache.
+
+        :returns
+        --------
+        meta - dict or None
+            Meta data or None if the cache does not exist or is corrupt
+        """
+        try:
+            with open(self.cache_dir / self.meta_file, 'r', encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, meta: dict) -> None:
+        """
+        Atomically write the meta data of the cache.
+
+        :parameters
+        -----------
+        meta - dict
+            Meta data
+        """
+        tmp_file = self.cache_dir / f"{self.meta_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding="utf-8") as stream:
+            json.dump(meta, stream)
+        os.replace(tmp_file, self.cache_dir / self.meta_file)
+
+    def build(self) -> None:
+        """
+        Parse the HPO database and write the compiled cache to disk.
+
+        Every file is written to a temporary name and moved in place, with the
+        meta data written last, so that concurrent jobs never read a partially
+        written cache.
+        """
+        print(f"[{HPOCache.__name__}] Building HPO cache in: {self.cache_dir}")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Invalidate the old cache before replacing any of its files
+        try:
+            (self.cache_dir / self.meta_file).unlink()
+        except FileNotFoundError:
+            pass
+
+        stat = self.database.stat()
+        hpo_data = self.read_database(self.database)
+        suffix = f".{os.getpid()}.tmp"
+
+        tmp_matrix = self.cache_dir / (self.matrix_file + suffix)
+        with open(tmp_matrix, 'wb') as stream:
+            np.save(stream, np.ascontiguousarray(hpo_data.values.T, dtype=np.uint8))
+        os.replace(tmp_matrix, self.cache_dir / self.matrix_file)
+
+        for name, values in ((self.genes_file, hpo_data.index), (self.terms_file, hpo_data.columns)):
+            tmp_file = self.cache_dir / (name + suffix)
+            with open(tmp_file, 'w', encoding="utf-8") as stream:
+                stream.write("\n".join(map(str, values)) + "\n")
+            os.replace(tmp_file, self.cache_dir / name)
+
+        self.write_meta({"version": CACHE_VERSION,
+                         "source": str(self.database.resolve()),
+                         "size": stat.st_size,
+                         "mtime_ns": stat.st_mtime_ns,
+                         "sha256": self.hash_file(self.database),
+                         "shape": [len(hpo_data.index), len(hpo_data.columns)]})
+
+    def read(self) -> pd.DataFrame:
+        """
+        Memory-map the compiled cache into a data frame.
+
+        :returns
+        --------
+        hpo_data - pd.DataFrame
+            HPO matrix with ensembl gene IDs as index and HPO terms as columns
+        """
+        matrix, genes, terms = self.read_arrays()
+        # The matrix is stored term-major so the transpose gives pandas a
+        # column-contiguous block without copying the memory map.
+        hpo_data = pd.DataFrame(matrix.T, index=pd.Index(genes, name="-"),
+                                columns=terms, copy=False)
+        return hpo_data
+
+    def read_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Read the raw arrays of the compiled cache.
+
+        :returns
+        --------
+        matrix - np.ndarray
+            Read-only memory-mapped uint8 matrix of shape (terms, genes)
+        genes - np.ndarray
+            Ensembl gene IDs
+        terms - np.ndarray
+            HPO term IDs
+        """
+        matrix = np.load(self.cache_dir / self.matrix_file, mmap_mode='r')
+        genes = self.read_index(self.cache_dir / self.genes_file)
+        terms = self.read_index(self.cache_dir / self.terms_file)
+        return matrix, genes, terms
+
+    @staticmethod
+    def read_index(file: Path) -> np.ndarray:
+        """
+        Read an index file containing one ID per line.
+
+        :parameters
+        -----------
+        file - Path
+            Index file
+
+        :returns
+        --------
+        ids - np.ndarray
+            IDs inside the file
+        """
+        with open(file, 'r', encoding="utf-8") as stream:
+            return np.array(stream.read().splitlines(), dtype=object)
+
+    @staticmethod
+    def read_database(database: Path) -> pd.DataFrame:
+        """
+        Read in the original gzipped HPO database.
+
+        :parameters
+        -----------
+        database - Path
+            HPO database
+
+        :returns
+        --------
+        hpo_data - pd.DataFrame
+            HPO matrix with ensembl gene IDs as index and HPO terms as columns
+        """
+        hpo_data = pd.read_csv(database, compression='gzip', sep="\t")
+        hpo_data.set_index('-', inplace=True)
+        return hpo_data
+
+    @staticmethod
+    def hash_file(file: Path, block_size: int = 1 << 20) -> str:
+        """
+        Calculate the sha256 hash of a file.
+
+        :parameters
+        -----------
+        file - Path
+            A file
+        block_size - int
+            Number of bytes read at a time
+
+        :returns
+        --------
+        digest - str
+            Hex digest of the file
+        """
+        sha = hashlib.sha256()
+        with open(file, 'rb') as stream:
+            for block in iter(lambda: stream.read(block_size), b""):
+                sha.update(block)
+        return sha.hexdigest()
@@ -0,0 +1,164 @@
+"""
+Module that provides a vectorized engine to perform many fisher's exact tests at once.
+
+scipy.stats.fisher_exact handles one 2x2 contingency table per call, which becomes
+the bottleneck when all HPO terms are tested for every trait and method. This engine
+takes arrays of tables and computes the hypergeometric null distribution of every
+unique set of margins only once, in log space so very small p values do not
+underflow to 0.
+"""
+
+from functools import lru_cache
+from typing import Tuple
+import numpy as np
+from scipy import special
+
+
+class HypergeometricEngine:
+    """
+    Vectorized two-sided fisher's exact test on arrays of 2x2 contingency tables.
+
+    The results are the same as those of scipy.stats.fisher_exact (two-sided). Tables
+    are layed out as [[a, b], [c, d]], the same layout that is used by scipy.
+    """
+
+    # Relative tolerance used to decide whether the probability of a table is equal to
+    # the probability of the observed table (the same tolerance R's fisher.test uses).
+    relative_tolerance = 1e-7
+
+    _log_factorial = np.zeros(1)
+
+    @classmethod
+    def log_factorial(cls, n: int) -> np.ndarray:
+        """
+        Get the shared table of log(k!) for k = 0..n, growing it when needed.
+
+        :parameters
+        -----------
+        n - int
+            Largest value the table should contain
+
+        :returns
+        --------
+        log_factorial - np.ndarray
+            Array where element k is log(k!)
+        """
+        if cls._log_factorial.shape[0] <= n:
+            cls._log_factorial = special.gammaln(np.arange(max(n + 1, 1024), dtype=np.float64) + 1)
+        return cls._log_factorial
+
+    @classmethod
+    @lru_cache(maxsize=4096)
+    def margin_distribution(cls, n1: int, n2: int, n: int) -> Tuple[int, np.ndarray,
+                                                                     np.ndarray, np.ndarray]:
+        """
+        Compute the (log) hypergeometric distribution of the top left cell for a set of
+        margins. The result is memoized, since many tables share the same margins.
+
+        :parameters
+        -----------
+        n1 - int
+            Sum of the first row
+        n2 - int
+            Sum of the second row
+        n - int
+            Sum of the first column
+
+        :returns
+        --------
+        low - int
+            Smallest possible value of the top left cell
+        log_pmf - np.ndarray
+            Log probability of every possible value of the top left cell, starting at low
+        sorted_log_pmf - np.ndarray
+            log_pmf sorted in ascending order
+        cumulative - np.ndarray
+            Log of the cumulative sum of the probabilities in sorted_log_pmf
+        """
+        log_fact = cls.log_factorial(n1 + n2)
+        low = max(0, n - n2)
+        x = np.arange(low, min(n, n1) + 1)
+
+        log_pmf = (log_fact[n1] - log_fact[x] - log_fact[n1 - x]
+                   + log_fact[n2] - log_fact[n - x] - log_fact[n2 - n + x]
+                   - log_fact[n1 + n2] + log_fact[n] + log_fact[n1 + n2 - n])
+
+        sorted_log_pmf = np.sort(log_pmf)
+        cumulative = np.logaddexp.accumulate(sorted_log_pmf)
+        return low, log_pmf, sorted_log_pmf, cumulative
+
+    @staticmethod
+    def odds_ratios(tables: np.ndarray) -> np.ndarray:
+        """
+        Calculate the (sample) odds ratios of an array of 2x2 contingency tables.
+
+        :parameters
+        -----------
+        tables - np.ndarray
+            Integer array of shape (n, 2, 2)
+
+        :returns
+        --------
+        odds_ratios - np.ndarray
+            Odds ratio of every table, inf if the bottom left or top right cell is 0
+        """
+        numerator = (tables[:, 0, 0] * tables[:, 1, 1]).astype(np.float64)
+        denominator = (tables[:, 1, 0] * tables[:, 0, 1]).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator > 0, numerator / denominator, np.inf)
+
+    def fisher_exact(self, tables: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Perform the two-sided fisher's exact test on an array of 2x2 contingency tables.
+
+        :parameters
+        -----------
+        tables - np.ndarray
+            Array of shape (n, 2, 2) containing non-negative integer counts
+
+        :returns
+        --------
+        odds_ratios - np.ndarray
+            Odds ratio of every table
+        p_values - np.ndarray
+            Two-sided p value of every table
+        log_p_values - np.ndarray
+            Natural logarithm of the p values, which remains finite when the
+            p values underflow to 0
+        """
+        tables = np.asarray(tables, dtype=np.int64).reshape(-1, 2, 2)
+        if np.any(tables < 0):
+            raise ValueError("All values in the contingency tables must be nonnegative.")
+
+        odds_ratios = self.odds_ratios(tables)
+        log_p_values = np.zeros(tables.shape[0])
+
+        rows = tables.sum(axis=2)
+        cols = tables.sum(axis=1)
+        degenerate = (rows == 0).any(axis=1) | (cols == 0).any(axis=1)
+        odds_ratios[degenerate] = np.nan
+
+        margins = np.column_stack([rows[:, 0], rows[:, 1], cols[:, 0]])
+        valid = np.flatnonzero(~degenerate)
+        if valid.shape[0] > 0:
+            unique_margins, inverse = np.unique(margins[valid], axis=0, return_inverse=True)
+            # Group the tables by their margins
+            order = np.argsort(inverse.reshape(-1), kind="stable")
+            group_ends = np.cumsum(np.bincount(inverse.reshape(-1),
+                                               minlength=unique_margins.shape[0]))
+            group_starts = group_ends - np.bincount(inverse.reshape(-1),
+                                                    minlength=unique_margins.shape[0])
+            for (n1, n2, n), start, end in zip(unique_margins, group_starts, group_ends):
+                members = valid[order[start:end]]
+                low, log_pmf, sorted_log_pmf, cumulative = self.margin_distribution(
+                    int(n1), int(n2), int(n))
+
+                observed = log_pmf[tables[members, 0, 0] - low]
+                threshold = observed + np.log1p(self.relative_tolerance)
+                n_extreme = np.searchsorted(sorted_log_pmf, threshold, side='right')
+                log_p_values[members] = np.minimum(cumulative[n_extreme - 1], 0.0)
+                # If every table is as extreme as the observed one (i.e. it is the mode) the p
+                # value is exactly 1, the sum in log space may differ from 0 by rounding errors
+                log_p_values[members[n_extreme == sorted_log_pmf.shape[0]]] = 0.0
+
+        return odds_ratios, np.exp(log_p_values), log_p_values
@@ -0,0 +1,187 @@
+"""
+Module that provides empirical (permutation based) enrichment p values for HPO terms.
+
+The fisher's exact test assumes that genes are exchangeable, which is not the case for
+the output of gene prioritization methods. As an alternative, random gene sets with the
+same size as the set of significant genes are drawn from the gene universe (optionally
+matched on a covariate such as gene length) and the number of HPO genes inside the
+random sets is compared with the observed number.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+
+
+def _draw_indicators(rng: np.random.Generator, bins: list, bin_sizes: np.ndarray,
+                     n_genes: int, batch_size: int) -> np.ndarray:
+    """
+    Draw a batch of random gene sets as indicator matrices.
+
+    :parameters
+    -----------
+    rng - np.random.Generator
+        Random number generator
+    bins - list
+        Indices of the genes inside every covariate bin
+    bin_sizes - np.ndarray
+        Number of genes to draw from every bin
+    n_genes - int
+        Number of genes in the gene universe
+    batch_size - int
+        Number of random gene sets
+
+    :returns
+    --------
+    indicators - np.ndarray
+        float32 matrix of shape (batch_size, n_genes)
+    """
+    indicators = np.zeros((batch_size, n_genes), dtype=np.float32)
+    rows = np.arange(batch_size)[:, None]
+    for genes, size in zip(bins, bin_sizes):
+        if size == 0:
+            continue
+        # The positions of the 'size' smallest random keys are a uniform random subset
+        keys = rng.random((batch_size, genes.shape[0]))
+        chosen = np.argpartition(keys, size - 1, axis=1)[:, :size]
+        indicators[rows, genes[chosen]] = 1
+    return indicators
+
+
+def _count_exceedances(term_matrix: np.ndarray, observed: np.ndarray, bins: list,
+                       bin_sizes: np.ndarray, n_permutations: int, batch_size: int,
+                       seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Count for every HPO term how often a random gene set contains at least as many
+    HPO genes as the significant genes. Runs inside a worker process.
+
+    :parameters
+    -----------
+    term_matrix - np.ndarray
+        float32 gene x term indicator matrix
+    observed - np.ndarray
+        Observed number of significant genes annotated to every HPO term
+    bins - list
+        Indices of the genes inside every covariate bin
+    bin_sizes - np.ndarray
+        Number of genes to draw from every bin
+    n_permutations - int
+        Number of random gene sets
+    batch_size - int
+        Number of random gene sets that are evaluated at a time
+    seed - np.random.SeedSequence
+        Seed of this chunk of permutations
+
+    :returns
+    --------
+    exceedances - np.ndarray
+        Number of random gene sets with a count higher or equal to the observed count
+    """
+    rng = np.random.default_rng(seed)
+    exceedances = np.zeros(term_matrix.shape[1], dtype=np.int64)
+    for start in range(0, n_permutations, batch_size):
+        size = min(batch_size, n_permutations - start)
+        indicators = _draw_indicators(rng, bins, bin_sizes, term_matrix.shape[0], size)
+        counts = indicators @ term_matrix
+        exceedances += (counts >= observed - 0.5).sum(axis=0)
+    return exceedances
+
+
+class PermutationTest:
+    """
+    Calculate empirical enrichment p values for HPO terms by drawing random gene sets.
+
+    The permutations are divided into chunks of a fixed size, each with its own seed
+    derived from the main seed. This makes the results reproducible regardless of the
+    number of worker processes.
+    """
+
+    def __init__(self, n_permutations: int = 10000, seed: Optional[int] = None,
+                 n_workers: int = 1, batch_size: int = 256,
+                 chunk_size: int = 2048, n_bins: int = 10) -> None:
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.n_bins = n_bins
+
+    def covariate_bins(self, significant: np.ndarray,
+                       covariate: Optional[np.ndarray]) -> tuple:
+        """
+        Divide the gene universe into bins of similar covariate values and count the
+        number of significant genes per bin. Without a covariate a single bin is used.
+
+        :parameters
+        -----------
+        significant - np.ndarray
+            Boolean array indicating which genes of the universe are significant
+        covariate - np.ndarray
+            Covariate value of every gene in the universe, or None
+
+        :returns
+        --------
+        bins - list
+            Indices of the genes inside every bin
+        bin_sizes - np.ndarray
+            Number of significant genes inside every bin
+        """
+        if covariate is None:
+            labels = np.zeros(significant.shape[0], dtype=np.int64)
+        else:
+            covariate = np.asarray(covariate, dtype=np.float64)
+            edges = np.nanquantile(covariate, np.linspace(0, 1, self.n_bins + 1)[1:-1])
+            labels = np.searchsorted(edges, covariate, side='right')
+            # Genes without a covariate value get their own bin
+            labels[np.isnan(covariate)] = self.n_bins
+
+        bins = []
+        bin_sizes = []
+        for label in np.unique(labels):
+            genes = np.flatnonzero(labels == label)
+            bins.append(genes)
+            bin_sizes.append(int(np.count_nonzero(significant[genes])))
+        return bins, np.array(bin_sizes)
+
+    def empirical_pvalues(self, term_matrix: np.ndarray, significant: np.ndarray,
+                          covariate: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Calculate the empirical enrichment p value of every HPO term.
+
+        :parameters
+        -----------
+        term_matrix - np.ndarray
+            Gene x term indicator matrix of the gene universe
+        significant - np.ndarray
+            Boolean array indicating which genes of the universe are significant
+        covariate - np.ndarray
+            Covariate value of every gene in the universe to match the random gene
+            sets on, or None to draw them uniformly
+
+        :returns
+        --------
+        p_values - np.ndarray
+            (1 + number of random sets with at least the observed count) / (1 + n_permutations)
+        """
+        term_matrix = np.ascontiguousarray(term_matrix, dtype=np.float32)
+        significant = np.asarray(significant, dtype=bool)
+        observed = significant.astype(np.float32) @ term_matrix
+        bins, bin_sizes = self.covariate_bins(significant, covariate)
+
+        n_chunks = -(-self.n_permutations // self.chunk_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(n_chunks)
+        chunks = [min(self.chunk_size, self.n_permutations - index * self.chunk_size)
+                  for index in range(n_chunks)]
+        arguments = [(term_matrix, observed, bins, bin_sizes, size, self.batch_size, seed)
+                     for size, seed in zip(chunks, seeds)]
+
+        exceedances = np.zeros(term_matrix.shape[1], dtype=np.int64)
+        if self.n_workers > 1:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+                for result in executor.map(_count_exceedances, *zip(*arguments)):
+                    exceedances += result
+        else:
+            for args in arguments:
+                exceedances += _count_exceedances(*args)
+
+        return (1 + exceedances) / (1 + self.n_permutations)
@@ -3,41 +3,98 @@ Module that contains functionality to process data from
 different prioritization methods to be able to perform fisher exact tests.
 """
 
-from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
 from scipy import stats
+from .genes import GeneSet, gene_dictionary
+from .gene_mapping import print_report
+from .readers import get_reader
+from .sweep import ThresholdSweep
 
 
-class PrioritizationMethod(ABC):
+class PrioritizationMethod:
     """
     Base class for a prioritization method.
+
+    Subclasses define the reader schema of the output files of the method, which
+    contains the column containing the gene IDs, the column containing the scores,
+    whether a lower score is more significant (ascending) and how the significant
+    genes are selected (default threshold, top K or a significant column).
     """
 
-    @abstractmethod
+    schema = None
+
+    @property
+    def gene_column(self):
+        return self.schema.gene_column
+
+    @property
+    def score_column(self):
+        return self.schema.score_column
+
+    @property
+    def ascending(self):
+        return self.schema.ascending
+
     def read_data(self, data):
         """
-        Read in data from a CSV file.
+        Read in data from a file using the reader schema of the method.
 
         :parameters
         -----------
         data - Path
             File containing the data
+
+        :returns
+        --------
+        method_data - pd.DataFrame
+            Data in a data frame
+        genes - pd.Series
+            Gene IDs
         """
+        method_data = self.schema.read(data)
+        genes = method_data[self.gene_column]
+        return method_data, genes
 
-    @abstractmethod
-    def filter_data(self, data, threshold):
+    def filter_data(self, data, threshold=None):
         """
-        Filter the data by only keeping the 'significant' genes.
+        Filter the data by only keeping the 'significant' genes. Without a threshold
+        the default threshold of the schema is used, or its significant column when
+        the schema has no default threshold.
 
         :parameters
         -----------
         data - pd.DataFrame
             Data
         threshold - float
-            Threshold to determine what significant is.
+            Threshold to determine what significant is, or the number of top genes
+            for methods with a top_k schema.
+
+        :returns
+        --------
+        significant_data - pd.DataFrame
+            Data containing only the significant genes
+        significant_genes - pd.Series
+            Gene IDs of the significant genes
         """
+        if threshold is None:
+            threshold = self.schema.default_threshold
+
+        if threshold is None:
+            if self.schema.significant_column is None:
+                raise ValueError("The schema has no default threshold or significant column.")
+            column = data[self.schema.significant_column]
+            significant_data = data[column == self.schema.significant_value]
+        elif self.schema.top_k:
+            significant_data = data.sort_values(self.score_column, ascending=self.ascending)
+            significant_data = significant_data.iloc[0:int(threshold), :]
+        elif self.ascending:
+            significant_data = data[data[self.score_column] < threshold]
+        else:
+            significant_data = data[data[self.score_column] > threshold]
+        significant_genes = significant_data[self.gene_column]
+        return significant_data, significant_genes
 
-    @abstractmethod
     def get_overlap_genes(self, data, genes):
         """
         Get the data that overlaps with a list of specified genes.
@@ -48,18 +105,32 @@ class PrioritizationMethod(ABC):
             Data
         genes - pd.Series
             List of gene IDs
+
+        :returns
+        --------
+        overlap_data - pd.DataFrame
+            Data overlapping with specified genes
         """
+        overlap_data = data[self.genes_in(data[self.gene_column], genes)]
+        return overlap_data
 
-    def get_overlap(self, hpo_data, genes):
+    def get_overlap(self, hpo_data, genes, hpo_terms=None):
         """
         Get the genes overlapping with the HPO database.
 
+        Selecting the overlapping rows copies them out of the memory-mapped HPO data,
+        which for every HPO term is a few hundred MB per process and trait. When the
+        HPO terms of the trait are supplied only these columns are copied.
+
         :parameters
         -----------
         hpo_data - pd.DataFrame
             HPO data inside a pandas dataframe
         genes - pd.Series
             Series of gene IDs
+        hpo_terms - pd.Series
+            IDs of the HPO terms that are tested, HPO terms that are not inside the
+            HPO data are left out. By default all HPO terms are kept.
 
         :returns
         --------
@@ -70,101 +141,101 @@ class PrioritizationMethod(ABC):
         total_overlap - int
             Total number of overlapping genes
         """
-        overlapping_genes_data = hpo_data[hpo_data.index.isin(genes)]
-        overlapping_genes = overlapping_genes_data.index
-        total_overlap = overlapping_genes.shape[0]
+        gene_codes = gene_dictionary.encode(genes)
+        hpo_codes = gene_dictionary.encode(hpo_data.index)
+
+        overlapping = GeneSet.from_codes(gene_codes).isin(hpo_codes)
+        total_overlap = int(np.count_nonzero(overlapping))
 
         # Only keep the genes that overlap with HPO
-        overlap_genes = genes[genes.isin(overlapping_genes)]
+        overlap_genes = genes[GeneSet.from_codes(hpo_codes[overlapping]).isin(gene_codes)]
 
         # Only keep releveant HPO data
-        overlap_hpo = hpo_data[hpo_data.index.isin(overlapping_genes)]
+        rows = np.flatnonzero(overlapping)
+        if hpo_terms is None:
+            overlap_hpo = hpo_data.iloc[rows]
+        else:
+            columns = hpo_data.columns.get_indexer(pd.Index(hpo_terms).unique())
+            overlap_hpo = hpo_data.iloc[rows, columns[columns >= 0]]
         return overlap_hpo, overlap_genes, total_overlap
 
-
-class NetWAS(PrioritizationMethod):
-    """
-    Subclass for the gene prioritization method NetWAS.
-    """
-
-    def __init__(self, hpo, fisher):
-        self.hpo = hpo
-        self.fisher = fisher
-
-    def read_data(self, data):
+    def get_default_threshold(self):
         """
-        Read in data from a CSV file.
-
-        :parameters
-        -----------
-        data - Path
-            File containing the data
+        Get the default threshold used by filter_data.
 
         :returns
         --------
-        netwas_data - pd.DataFrame
-            Data in a data frame
-        genes - pd.Series
-            Gene IDs
+        threshold - float or None
+            Default threshold of the method
         """
-        netwas_data = pd.read_csv(data, sep=",")
-        genes = netwas_data.ensemble_id
-        return netwas_data, genes
+        return self.schema.default_threshold
 
-    def get_overlap_genes(self, data, genes):
+    def sweep(self, data, hpo_data, hpo_terms, thresholds=None, top_k=None):
         """
-        Get the data that overlaps with a list of specified genes.
+        Evaluate many score thresholds or top K cutoffs at once instead of the single
+        cutoff used by filter_data.
 
         :parameters
         -----------
         data - pd.DataFrame
-            Data
-        genes - pd.Series
-            List of gene IDs
+            Data overlapping with the HPO data
+        hpo_data - pd.DataFrame
+            HPO data overlapping with the data
+        hpo_terms - pd.Series
+            IDs of the HPO terms
+        thresholds - list
+            Score thresholds to evaluate
+        top_k - list
+            Number of top ranked genes to evaluate, used instead of thresholds
 
         :returns
         --------
-        overlap_netwas - pd.DataFrame
-            Data overlapping with specified genes
+        results - pd.DataFrame
+            Contingency tables, precision, recall and fisher's exact test results for
+            every cutoff and HPO term (see ThresholdSweep.sweep)
         """
-        overlap_netwas = data[data.ensemble_id.isin(genes)]
-        return overlap_netwas
+        return ThresholdSweep().sweep(hpo_data, data, self.gene_column, self.score_column,
+                                      self.ascending, hpo_terms, thresholds, top_k)
 
-    def filter_data(self, data, threshold=0.5):
+    @staticmethod
+    def genes_in(values, genes):
         """
-        Filter the data by only keeping the 'significant' genes.
+        Check which gene IDs are inside a list of genes.
 
         :parameters
         -----------
-        data - pd.DataFrame
-            Data
-        threshold - float
-            Threshold to determine what significant is.
+        values - pd.Series
+            Gene IDs to check
+        genes - pd.Series
+            List of gene IDs
 
         :returns
         --------
-        significant_netwas - pd.DataFrame
-            Data containing only the significant genes
-        significant_genes - pd.Series
-            Gene IDs of the significant genes
+        mask - np.ndarray
+            Boolean array that is True for the values inside the list of genes
         """
-        significant_netwas = data[data.netwas_score > threshold]
-        significant_genes = significant_netwas.ensemble_id
-        return significant_netwas, significant_genes
+        return GeneSet.from_ids(genes).contains_ids(values)
 
 
-class PoPs(PrioritizationMethod):
+class NetWAS(PrioritizationMethod):
     """
-    Subclass for the gene prioritization method PoPs.
+    Subclass for the gene prioritization method NetWAS.
     """
 
-    def __init__(self, hpo, fisher):
+    schema = get_reader("NetWAS")
+
+    def __init__(self, hpo, fisher, symbol_index=None):
         self.hpo = hpo
         self.fisher = fisher
+        self.symbol_index = symbol_index
 
     def read_data(self, data):
         """
-        Read in data from a CSV file.
+        Read in the NetWAS results. Without a symbol index the results should
+        already contain the ensembl gene IDs (output of convert_gene_id_ensembl_id),
+        with a symbol index the output of parse_netwas_results.py (gene symbol,
+        training label and score) is read and the gene symbols are mapped to
+        ensembl gene IDs.
 
         :parameters
         -----------
@@ -173,55 +244,33 @@ class PoPs(PrioritizationMethod):
 
         :returns
         --------
-        pops_data - pd.DataFrame
+        method_data - pd.DataFrame
             Data in a data frame
         genes - pd.Series
             Gene IDs
         """
-        pops_data = pd.read_csv(data, sep="\t")
-        genes = pops_data["ENSGID"]
-        return pops_data, genes
+        if self.symbol_index is None:
+            return super().read_data(data)
 
-    def get_overlap_genes(self, data, genes):
-        """
-        Get the data that overlaps with a list of specified genes.
+        netwas_data = pd.read_csv(data, sep="\t", header=None,
+                                  names=["gene_symbol", "training_label", "netwas_score"],
+                                  usecols=["gene_symbol", "netwas_score"],
+                                  dtype={"gene_symbol": str, "netwas_score": "float64"})
+        method_data, report = self.symbol_index.map_table(netwas_data, "gene_symbol")
+        print_report(report, str(data))
+        return method_data, method_data[self.gene_column]
 
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        genes - pd.Series
-            List of gene IDs
 
-        :returns
-        --------
-        overlap_pops - pd.DataFrame
-            Data overlapping with specified genes
-        """
-        overlap_pops = data[data["ENSGID"].isin(genes)]
-        return overlap_pops
+class PoPs(PrioritizationMethod):
+    """
+    Subclass for the gene prioritization method PoPs.
+    """
 
-    def filter_data(self, data, threshold=500):
-        """
-        Filter the data by only keeping the 'significant' genes.
+    schema = get_reader("PoPs")
 
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        threshold - float
-            Threshold to determine what significant is.
-
-        :returns
-        --------
-        significant_pops - pd.DataFrame
-            Data containing only the significant genes
-        significant_genes - pd.Series
-            Gene IDs of the significant genes
-        """
-        significant_pops = data.sort_values("PoPS_Score", ascending=False).iloc[0:threshold, :]
-        significant_genes = significant_pops["ENSGID"]
-        return significant_pops, significant_genes
+    def __init__(self, hpo, fisher):
+        self.hpo = hpo
+        self.fisher = fisher
 
 
 class Depict(PrioritizationMethod):
@@ -229,6 +278,8 @@ class Depict(PrioritizationMethod):
     Subclass for the gene prioritization method Depict
     """
 
+    schema = get_reader("DEPICT")
+
     def __init__(self, hpo, fisher):
         self.hpo = hpo
         self.fisher = fisher
@@ -249,192 +300,42 @@ class Depict(PrioritizationMethod):
         genes - pd.Series
             Gene IDs
         """
-        depict_data = pd.read_csv(data, sep="\t")
-        depict_data.columns = depict_data.columns.str.rstrip()
-        depict_data["Ensembl Gene ID"] = depict_data["Ensembl Gene ID"].str.rstrip()
+        depict_data, genes = super().read_data(data)
         depict_data["zscores"] = stats.zscore(depict_data["Nominal P value"], nan_policy='omit')
-        genes = depict_data["Ensembl Gene ID"]
         return depict_data, genes
 
-    def get_overlap_genes(self, data, genes):
-        """
-        Get the data that overlaps with a list of specified genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        genes - pd.Series
-            List of gene IDs
-
-        :returns
-        --------
-        overlap_depict - pd.DataFrame
-            Data overlapping with specified genes
-        """
-        overlap_depict = data[data["Ensembl Gene ID"].isin(genes)]
-        return overlap_depict
-
-    def filter_data(self, data, threshold = None):
-        """
-        Filter the data by only keeping the 'significant' genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        threshold - float
-            Threshold to determine what significant is.
-
-        :returns
-        --------
-        significant_depict - pd.DataFrame
-            Data containing only the significant genes
-        significant_genes - pd.Series
-            Gene IDs of the significant genes
-        """
-        significant_depict = data[data["False discovery rate < 5%"] == "Yes"]
-        significant_genes = significant_depict["Ensembl Gene ID"]
-        return significant_depict, significant_genes
-
 
 class Downstreamer(PrioritizationMethod):
     """
     Subclass for the gene prioritization method Downstreamer.
     """
 
+    schema = get_reader("Downstreamer")
+
     def __init__(self, hpo, fisher):
         self.hpo = hpo
         self.fisher = fisher
 
-    def read_data(self, data):
-        """
-        Read in data from a CSV file.
-
-        :parameters
-        -----------
-        data - Path
-            File containing the data
-
-        :returns
-        --------
-        downstreamer_data - pd.DataFrame
-            Data in a data frame
-        genes - pd.Series
-            Gene IDs
-        """
-        downstreamer_data = pd.read_excel(data, "GenePrioritization")
-        genes = downstreamer_data["Gene ID"]
-        return downstreamer_data, genes
-
-    def get_overlap_genes(self, data, genes):
-        """
-        Get the data that overlaps with a list of specified genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        genes - pd.Series
-            List of gene IDs
-
-        :returns
-        --------
-        overlap_downstreamer - pd.DataFrame
-            Data overlapping with specified genes
-        """
-        overlap_downstreamer = data[data["Gene ID"].isin(genes)]
-        return overlap_downstreamer
-
-    def filter_data(self, data, threshold = None):
-        """
-        Filter the data by only keeping the 'significant' genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        threshold - float
-            Threshold to determine what significant is.
-
-        :returns
-        --------
-        significant_downstreamer - pd.DataFrame
-            Data containing only the significant genes
-        significant_genes - pd.Series
-            Gene IDs of the significant genes
-        """
-        significant_downstreamer = data[data["FDR 5% significant"] == True]
-        significant_genes = significant_downstreamer["Gene ID"]
-        return significant_downstreamer, significant_genes
-
 
 class Magma(PrioritizationMethod):
     """
     Subclass for the gene prioritization method Magma.
     """
 
+    schema = get_reader("MAGMA")
+
     def __init__(self, hpo, fisher):
         self.hpo = hpo
         self.fisher = fisher
 
-    def read_data(self, data):
-        """
-        Read in data from a CSV file.
 
-        :parameters
-        -----------
-        data - Path
-            File containing the data
-
-        :returns
-        --------
-        magma_data - pd.DataFrame
-            Data in a data frame
-        genes - pd.Series
-            Gene IDs
-        """
-        magma_data = pd.read_csv(data, sep='\s\s+', engine='python')
-        genes = magma_data["GENE"]
-        return magma_data, genes
-
-    def get_overlap_genes(self, data, genes):
-        """
-        Get the data that overlaps with a list of specified genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        genes - pd.Series
-            List of gene IDs
-
-        :returns
-        --------
-        overlap_magma - pd.DataFrame
-            Data overlapping with specified genes
-        """
-        overlap_magma = data[data["GENE"].isin(genes)]
-        return overlap_magma
-
-    def filter_data(self, data, threshold=1.084e-4):
-        """
-        Filter the data by only keeping the 'significant' genes.
-
-        :parameters
-        -----------
-        data - pd.DataFrame
-            Data
-        threshold - float
-            Threshold to determine what gene is significant.
+class SchemaMethod(PrioritizationMethod):
+    """
+    Prioritization method that is completely described by its reader schema, so new
+    methods only have to be added to the reader registry (see readers.py).
+    """
 
-        :returns
-        --------
-        significant_magma - pd.DataFrame
-            Data containing only the significant genes
-        significant_genes - pd.Series
-            Gene IDs of the significant genes
-        """
-        significant_magma = data[data["P"] < threshold]
-        significant_genes = significant_magma["GENE"]
-        return significant_magma, significant_genes
+    def __init__(self, hpo, fisher, schema):
+        self.hpo = hpo
+        self.fisher = fisher
+        self.schema = get_reader(schema) if isinstance(schema, str) else schema
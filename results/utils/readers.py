@@ -0,0 +1,178 @@
+"""
+Module that contains a registry of readers for the output files of the
+prioritization methods.
+
+Every method declares how its output file is laid out (separator, gene ID column,
+score column, score direction and the columns and dtypes that are needed) in a
+ReaderSchema. Files are then read with the C (or pyarrow) parser, only the needed
+columns are parsed and the whitespace around the gene IDs is stripped once.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+import pandas as pd
+from .excel_cache import ExcelSheetCache
+
+
+@dataclass(frozen=True)
+class ReaderSchema:
+    """
+    Description of the output file of a prioritization method.
+
+    :attributes
+    -----------
+    sep - str
+        Separator of the columns, r'\\s+' for files aligned with whitespace
+    gene_column - str
+        Name of the column containing the gene IDs
+    score_column - str
+        Name of the column containing the scores
+    ascending - bool
+        True if a lower score is more significant (e.g. p values)
+    columns - Tuple[str]
+        Names of the columns that are needed, None to read all columns
+    dtypes - Dict[str, str]
+        dtype of the columns that should not be inferred
+    engine - str
+        Parser used by pandas, 'c' or 'pyarrow'
+    strip_column_names - bool
+        Remove whitespace around the column names
+    sheet_name - str
+        Name of the sheet for Excel files, None for text files. Excel sheets are
+        cached, see excel_cache.py
+    significant_column - str
+        Column marking the significant genes, used when no threshold is given
+    significant_value - Any
+        Value of significant_column for significant genes
+    default_threshold - float
+        Default score threshold (or number of top genes when top_k is True)
+    top_k - bool
+        If True the threshold is the number of top ranked genes that is significant
+    """
+
+    sep: str
+    gene_column: str
+    score_column: str
+    ascending: bool
+    columns: Optional[Tuple[str, ...]] = None
+    dtypes: Dict[str, str] = field(default_factory=dict)
+    engine: str = "c"
+    strip_column_names: bool = False
+    sheet_name: Optional[str] = None
+    significant_column: Optional[str] = None
+    significant_value: object = True
+    default_threshold: Optional[float] = None
+    top_k: bool = False
+
+    def read(self, file) -> pd.DataFrame:
+        """
+        Read an output file of the prioritization method.
+
+        :parameters
+        -----------
+        file - Path
+            Output file of the prioritization method
+
+        :returns
+        --------
+        data - pd.DataFrame
+            The needed columns of the rows with a gene ID, with the gene IDs stripped
+            of whitespace
+        """
+        if self.sheet_name is not None:
+            # The needed columns of the sheet are streamed once and cached next to
+            # the workbook
+            data = ExcelSheetCache(file, self.sheet_name, self.columns).load()
+        else:
+            data = self._read_text(file)
+        if self.strip_column_names:
+            data.columns = data.columns.str.strip()
+        # Rows without a gene ID are removed, otherwise they would become the gene "nan"
+        data = data.dropna(subset=[self.gene_column]).reset_index(drop=True)
+        data[self.gene_column] = data[self.gene_column].astype(str).str.strip()
+        return data
+
+    def _select_columns(self, name) -> bool:
+        if self.columns is None:
+            return True
+        return (name.strip() if self.strip_column_names else name) in self.columns
+
+    def _read_text(self, file) -> pd.DataFrame:
+        # The header is read first to map the needed columns to their names inside the
+        # file, which may contain whitespace
+        header = pd.read_csv(file, sep=self.sep, nrows=0).columns
+        usecols = [name for name in header if self._select_columns(name)]
+        names = {(name.strip() if self.strip_column_names else name): name for name in usecols}
+        missing = set(self.columns or ()) - set(names)
+        if missing:
+            raise KeyError(f"Columns not found in {file}: {sorted(missing)}")
+        dtypes = {names[name]: dtype for name, dtype in self.dtypes.items() if name in names}
+        dtypes.setdefault(names[self.gene_column], str)
+        return pd.read_csv(file, sep=self.sep, usecols=usecols, dtype=dtypes,
+                           engine=self.engine)
+
+
+READERS = {
+    "NetWAS": ReaderSchema(sep=",", gene_column="ensemble_id",
+                           score_column="netwas_score", ascending=False,
+                           columns=("ensemble_id", "netwas_score"),
+                           dtypes={"netwas_score": "float64"},
+                           default_threshold=0.5),
+    "PoPs": ReaderSchema(sep="\t", gene_column="ENSGID", score_column="PoPS_Score",
+                         ascending=False, columns=("ENSGID", "PoPS_Score"),
+                         dtypes={"PoPS_Score": "float64"},
+                         default_threshold=500, top_k=True),
+    "DEPICT": ReaderSchema(sep="\t", gene_column="Ensembl Gene ID",
+                           score_column="Nominal P value", ascending=True,
+                           columns=("Ensembl Gene ID", "Nominal P value",
+                                    "False discovery rate < 5%"),
+                           dtypes={"Nominal P value": "float64",
+                                   "False discovery rate < 5%": str},
+                           strip_column_names=True,
+                           significant_column="False discovery rate < 5%",
+                           significant_value="Yes"),
+    "Downstreamer": ReaderSchema(sep="\t", gene_column="Gene ID",
+                                 score_column="Enrichment Z-score", ascending=False,
+                                 columns=("Gene ID", "Enrichment Z-score",
+                                          "FDR 5% significant"),
+                                 sheet_name="GenePrioritization",
+                                 significant_column="FDR 5% significant",
+                                 significant_value=True),
+    "MAGMA": ReaderSchema(sep=r"\s+", gene_column="GENE", score_column="P",
+                          ascending=True, columns=("GENE", "P"),
+                          dtypes={"P": "float64"}, default_threshold=1.084e-4),
+}
+
+
+def register_reader(name: str, schema: ReaderSchema) -> None:
+    """
+    Add the reader of a prioritization method to the registry.
+
+    :parameters
+    -----------
+    name - str
+        Name of the prioritization method
+    schema - ReaderSchema
+        Description of the output file of the method
+    """
+    READERS[name] = schema
+
+
+def get_reader(name: str) -> ReaderSchema:
+    """
+    Get the reader of a prioritization method.
+
+    :parameters
+    -----------
+    name - str
+        Name of the prioritization method
+
+    :returns
+    --------
+    schema - ReaderSchema
+        Description of the output file of the method
+    """
+    try:
+        return READERS[name]
+    except KeyError:
+        raise KeyError(f"No reader registered for the prioritization method: {name}") from None
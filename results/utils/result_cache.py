@@ -0,0 +1,157 @@
+"""
+Module that provides a content-addressed cache for the results of the fisher exact tests.
+
+The results of a (trait, method) combination only depend on the contents of the
+method file, the HPO database, the threshold used to select the significant genes and
+the tested HPO terms. The cache key is a hash of all of these, so unchanged
+combinations are read from disk instead of being recomputed.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Optional
+import pandas as pd
+from .hpo_cache import HPOCache
+
+
+# Version of the cached results, part of every key. Increase it when the reading or
+# filtering of the method outputs or the tests change, so older results are not reused
+CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    Size-bounded, content-addressed cache of results on disk.
+
+    Every entry is a pickle file named after its key. When the total size of the
+    cache exceeds max_size, the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = 1024 ** 3) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+
+    @staticmethod
+    def hash_data_frame(data: pd.DataFrame) -> str:
+        """
+        Calculate a hash of the contents of a data frame.
+
+        :parameters
+        -----------
+        data - pd.DataFrame
+            A data frame
+
+        :returns
+        --------
+        digest - str
+            Hex digest of the data frame
+        """
+        return hashlib.sha256(data.to_csv(index=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        """
+        Create a cache key from the things a result depends on (e.g. file hashes,
+        the threshold and the tested HPO terms).
+
+        :parameters
+        -----------
+        parts - Any
+            JSON serializable values that determine the result
+
+        :returns
+        --------
+        key - str
+            Hex digest identifying the result
+        """
+        parts["cache_version"] = CACHE_VERSION
+        content = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def hash_file(file: Path) -> str:
+        """
+        Calculate the sha256 hash of a file.
+
+        :parameters
+        -----------
+        file - Path
+            A file
+
+        :returns
+        --------
+        digest - str
+            Hex digest of the file
+        """
+        return HPOCache.hash_file(file)
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / (key + ".pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a result from the cache.
+
+        :parameters
+        -----------
+        key - str
+            Cache key
+
+        :returns
+        --------
+        result - Any
+            The cached result or None if the key is not inside the cache
+        """
+        entry = self._entry(key)
+        try:
+            with open(entry, 'rb') as stream:
+                result = pickle.load(stream)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # Mark the entry as recently used
+        os.utime(entry)
+        return result
+
+    def put(self, key: str, result: Any) -> None:
+        """
+        Store a result inside the cache and evict old entries if the cache is too large.
+
+        :parameters
+        -----------
+        key - str
+            Cache key
+        result - Any
+            Result to store, must be picklable
+        """
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = entry.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as stream:
+            pickle.dump(result, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache is smaller than max_size.
+        """
+        entries = []
+        for entry in self.cache_dir.glob("*/*.pkl"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,214 @@
+"""
+Module that evaluates many significance cutoffs of a prioritization method in one pass.
+
+Each prioritization method normally uses a single cutoff (e.g. a NetWAS score > 0.5 or
+the top 500 PoPS genes). Instead of re-running the fisher's exact tests for every
+cutoff, the genes are sorted by score once and the number of HPO genes among the top
+ranked genes is obtained from a cumulative sum over the ranked gene x term matrix. This
+gives the 2x2 contingency table of every cutoff x HPO term combination at once.
+"""
+
+from typing import Optional, Sequence
+import numpy as np
+import pandas as pd
+from .genes import gene_dictionary
+from .hypergeometric import HypergeometricEngine
+
+
+class ThresholdSweep:
+    """
+    Sweep over score thresholds or top K cutoffs of a prioritization method.
+
+    The contingency tables have the same layout as FisherTest.create_fisher_table:
+    [[No GWAS & No HPO, No GWAS & Yes HPO], [Yes GWAS & No HPO, Yes GWAS & Yes HPO]].
+    """
+
+    def __init__(self, engine: Optional[HypergeometricEngine] = None) -> None:
+        self.engine = HypergeometricEngine() if engine is None else engine
+
+    @staticmethod
+    def rank_data(data: pd.DataFrame, score_column: str, ascending: bool) -> pd.DataFrame:
+        """
+        Sort the data from the most to the least significant gene. Genes without a
+        score are placed last, the same as the filter_data methods.
+
+        :parameters
+        -----------
+        data - pd.DataFrame
+            Data of a prioritization method
+        score_column - str
+            Name of the column containing the scores
+        ascending - bool
+            True if a lower score is more significant (e.g. p values)
+
+        :returns
+        --------
+        ranked - pd.DataFrame
+            Sorted data
+        """
+        return data.sort_values(score_column, ascending=ascending, kind="mergesort")
+
+    @staticmethod
+    def threshold_sizes(scores: np.ndarray, thresholds: Sequence[float],
+                        ascending: bool) -> np.ndarray:
+        """
+        Get the number of top ranked genes that pass every threshold.
+
+        :parameters
+        -----------
+        scores - np.ndarray
+            Scores of the ranked genes
+        thresholds - Sequence[float]
+            Thresholds, a gene passes if its score is lower (ascending) or higher
+            (descending) than the threshold, the same as the filter_data methods
+        ascending - bool
+            True if a lower score is more significant
+
+        :returns
+        --------
+        sizes - np.ndarray
+            Number of genes passing every threshold
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        sorted_scores = np.sort(scores[~np.isnan(scores)])
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        if ascending:
+            return np.searchsorted(sorted_scores, thresholds, side='left')
+        return sorted_scores.shape[0] - np.searchsorted(sorted_scores, thresholds, side='right')
+
+    @staticmethod
+    def contingency_tensor(hpo_data: pd.DataFrame, ranked_genes: pd.Series,
+                           sizes: Sequence[int], hpo_terms: pd.Series) -> tuple:
+        """
+        Create the 2x2 contingency tables of every cutoff and HPO term.
+
+        :parameters
+        -----------
+        hpo_data - pd.DataFrame
+            HPO metric inside a pandas data frame, the index is used as the gene universe
+        ranked_genes - pd.Series
+            Gene IDs sorted from most to least significant
+        sizes - Sequence[int]
+            Number of top ranked genes that are significant for every cutoff
+        hpo_terms - pd.Series
+            IDs of the HPO terms (e.g. HP:00002)
+
+        :returns
+        --------
+        tables - np.ndarray
+            Array of shape (len(sizes), len(hpo_terms), 2, 2), tables of HPO terms that
+            are not inside the HPO data are filled with NaN
+        n_significant - np.ndarray
+            Number of significant genes that are counted for every cutoff (TP + FP),
+            this excludes duplicated genes and genes outside of the gene universe
+        """
+        sizes = np.asarray(sizes, dtype=np.int64)
+        term_index = hpo_data.columns.get_indexer(pd.Index(hpo_terms))
+        found = np.flatnonzero(term_index >= 0)
+
+        # Position of every ranked gene inside the universe, duplicated genes and
+        # genes outside of the universe only count at their first (best) rank
+        universe_codes = gene_dictionary.encode(hpo_data.index)
+        rows = pd.Index(universe_codes).get_indexer(gene_dictionary.encode(ranked_genes))
+        counted = (rows >= 0) & ~pd.Series(rows).duplicated().values
+
+        # The last column counts the significant genes themselves
+        matrix = np.zeros((rows.shape[0], found.shape[0] + 1), dtype=np.float32)
+        matrix[counted, :-1] = hpo_data.values[rows[counted]][:, term_index[found]] == 1
+        matrix[counted, -1] = 1
+
+        # Sum the rows between consecutive cutoffs, the cumulative sum over these
+        # segments gives the counts of every cutoff
+        cutoffs = np.unique(np.clip(sizes, 0, rows.shape[0]))
+        starts = np.concatenate([[0], cutoffs[:-1]])
+        nonempty = cutoffs > starts
+        counts = np.zeros((cutoffs.shape[0], matrix.shape[1]), dtype=np.float64)
+        if nonempty.any():
+            segments = np.add.reduceat(matrix[:cutoffs[-1]], starts[nonempty], axis=0,
+                                       dtype=np.float64)
+            counts[nonempty] = np.cumsum(segments, axis=0)
+        counts = counts[np.searchsorted(cutoffs, np.clip(sizes, 0, rows.shape[0]))]
+        yes_yes = counts[:, :-1]
+        yes_gwas = counts[:, -1]
+
+        n_genes = hpo_data.shape[0]
+        yes_hpo = (hpo_data.values[:, term_index[found]] == 1).sum(axis=0)
+
+        tables = np.full((sizes.shape[0], term_index.shape[0], 2, 2), np.nan)
+        tables[:, found, 1, 1] = yes_yes
+        tables[:, found, 1, 0] = yes_gwas[:, None] - yes_yes
+        tables[:, found, 0, 1] = yes_hpo[None, :] - yes_yes
+        tables[:, found, 0, 0] = n_genes - yes_gwas[:, None] - tables[:, found, 0, 1]
+        return tables, yes_gwas.astype(np.int64)
+
+    def sweep(self, hpo_data: pd.DataFrame, data: pd.DataFrame, gene_column: str,
+              score_column: str, ascending: bool, hpo_terms: pd.Series,
+              thresholds: Optional[Sequence[float]] = None,
+              top_k: Optional[Sequence[int]] = None) -> pd.DataFrame:
+        """
+        Calculate the contingency tables, precision, recall and fisher's exact test
+        results for every cutoff and HPO term.
+
+        :parameters
+        -----------
+        hpo_data - pd.DataFrame
+            HPO metric inside a pandas data frame, the index is used as the gene universe
+        data - pd.DataFrame
+            Data of a prioritization method overlapping with the HPO data
+        gene_column - str
+            Name of the column containing the gene IDs
+        score_column - str
+            Name of the column containing the scores
+        ascending - bool
+            True if a lower score is more significant (e.g. p values)
+        hpo_terms - pd.Series
+            IDs of the HPO terms (e.g. HP:00002)
+        thresholds - Sequence[float]
+            Score thresholds to evaluate
+        top_k - Sequence[int]
+            Number of top ranked genes to evaluate, used instead of thresholds
+
+        :returns
+        --------
+        results - pd.DataFrame
+            One row per cutoff x HPO term with the columns: cutoff, n_significant, HPO ID,
+            TP, FP, FN, TN, precision, recall, OR and pvalues
+        """
+        if (thresholds is None) == (top_k is None):
+            raise ValueError("Specify either thresholds or top_k.")
+
+        ranked = self.rank_data(data, score_column, ascending)
+        if top_k is not None:
+            cutoffs = np.asarray(top_k)
+            sizes = cutoffs
+        else:
+            cutoffs = np.asarray(thresholds, dtype=np.float64)
+            sizes = self.threshold_sizes(ranked[score_column].values, cutoffs, ascending)
+
+        hpo_terms = pd.Series(hpo_terms).reset_index(drop=True)
+        tables, n_significant = self.contingency_tensor(hpo_data, ranked[gene_column], sizes,
+                                                       hpo_terms)
+        flat = tables.reshape(-1, 2, 2)
+
+        odds_ratios = np.full(flat.shape[0], np.nan)
+        p_values = np.full(flat.shape[0], np.nan)
+        valid = ~np.isnan(flat).any(axis=(1, 2))
+        odds_ratios[valid], p_values[valid], _ = self.engine.fisher_exact(
+            flat[valid].astype(np.int64))
+
+        true_positives = flat[:, 1, 1]
+        false_positives = flat[:, 1, 0]
+        false_negatives = flat[:, 0, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = true_positives / (true_positives + false_positives)
+            recall = true_positives / (true_positives + false_negatives)
+
+        results = pd.DataFrame({
+            "cutoff": np.repeat(cutoffs, hpo_terms.shape[0]),
+            "n_significant": np.repeat(n_significant, hpo_terms.shape[0]),
+            "HPO ID": np.tile(hpo_terms.values, cutoffs.shape[0]),
+            "TP": true_positives, "FP": false_positives,
+            "FN": false_negatives, "TN": flat[:, 0, 0],
+            "precision": precision, "recall": recall,
+            "OR": odds_ratios, "pvalues": p_values})
+        return results